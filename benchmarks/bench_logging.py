@@ -0,0 +1,64 @@
+"""Benchmark the time a logging call takes on the calling thread, with and without the queue.
+
+Usage: python benchmarks/bench_logging.py [--calls 20000] [--write-delay 0.0001] [--debug]
+
+--write-delay makes every write block for that long, like a slow terminal or a full pipe.
+"""
+import os
+import time
+import logging
+from argparse import ArgumentParser
+from plextvstation import logging as plex_logging
+from plextvstation.logging import log
+
+
+class SlowHandler(logging.FileHandler):
+    def __init__(self, delay: float) -> None:
+        super().__init__(os.devnull)
+        self.delay = delay
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        time.sleep(self.delay)
+
+
+def per_call(calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        log.info("Request %d for station %s", i, "Station")
+    return (time.perf_counter() - start) / calls
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--write-delay", type=float, default=0.0001)
+    parser.add_argument("--debug", action="store_true", help="Also time disabled debug calls")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = SlowHandler(args.write_delay)
+    handler.setFormatter(logging.Formatter(plex_logging.log_format))
+    root.addHandler(handler)
+
+    print(f"synchronous  {per_call(args.calls) * 1e6:7.2f}us per call")
+    plex_logging.setup()
+    print(f"queued       {per_call(args.calls) * 1e6:7.2f}us per call")
+    plex_logging.stop()
+
+    if args.debug:
+        start = time.perf_counter()
+        for i in range(args.calls):
+            log.debug(f"Request {i} for station {'Station'}")
+        fstring = (time.perf_counter() - start) / args.calls
+        start = time.perf_counter()
+        for i in range(args.calls):
+            log.debug("Request %d for station %s", i, "Station")
+        lazy = (time.perf_counter() - start) / args.calls
+        print(f"disabled debug, f-string {fstring * 1e6:.3f}us, arguments {lazy * 1e6:.3f}us per call")
+
+
+if __name__ == "__main__":
+    main()
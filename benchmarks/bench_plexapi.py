@@ -0,0 +1,52 @@
+"""Benchmark loading a library from the Plex HTTP API, served by the stub server of the tests.
+
+The stub runs in its own process, and --latency adds the time Plex takes to answer a request.
+
+Usage: python benchmarks/bench_plexapi.py [--movies 20000] [--shows 1000] [--latency 0.05] [--workers 1 8]
+"""
+import os
+import sys
+import time
+import multiprocessing
+from argparse import ArgumentParser
+from plextvstation.plex import PlexDB
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+from test_plexapi import StubPlexServer, make_library, plex_args  # noqa: E402
+
+
+def serve(library: dict, latency: float, port: "multiprocessing.Queue[int]") -> None:
+    server = StubPlexServer(library, latency=latency)
+    port.put(server.server_address[1])
+    server.serve_forever()
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--shows", type=int, default=1000)
+    parser.add_argument("--seasons", type=int, default=4)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    args = parser.parse_args()
+
+    library = make_library(args.movies, args.shows, args.seasons, args.episodes)
+    num_items = args.movies + args.shows * (1 + args.seasons * args.episodes)
+    print(f"{num_items} items, {args.page_size} per page, {args.latency * 1000:.0f}ms latency")
+    port: "multiprocessing.Queue[int]" = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(library, args.latency, port), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port.get()}"
+    try:
+        for workers in args.workers:
+            start = time.perf_counter()
+            PlexDB(plex_args(url, plex_api_workers=workers, plex_api_page_size=args.page_size), index_content=False)
+            print(f"{workers:3d} workers: {time.perf_counter() - start:.2f}s")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark network-wide schedule generation.
+
+Usage: python benchmarks/bench_schedule.py [--days 7] [--stations 10 100 1000]
+"""
+import time
+import random
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta, timezone
+from plextvstation.media import Movie, MediaFile, TVShow, Season, Episode
+from plextvstation.plex import PlexDB
+from plextvstation.schedule import StationSchedule
+from plextvstation.scheduler import regenerate_schedules
+from plextvstation.station import Network, TVStation
+from plextvstation.utils import num_default_threads
+
+genres = ["Action", "Comedy", "Drama", "Crime", "Documentary", "Animation", "Sci-Fi", "Horror", "Romance", "Family"]
+
+
+def synthetic_library(num_movies: int, num_shows: int, seed: int = 0) -> PlexDB:
+    rng = random.Random(seed)
+    plexdb = PlexDB(Namespace(plex_db=None, path_translate=None), load=False)
+    for i in range(num_movies):
+        plexdb.movies.append(
+            Movie(
+                id=i,
+                title=f"Movie {i}",
+                summary=None,
+                tagline=None,
+                genres=rng.sample(genres, 2),
+                released_at=None,
+                media=MediaFile(id=i, file=f"/movies/{i}.mkv", duration=timedelta(minutes=rng.randint(80, 160))),
+            )
+        )
+    episode_id = num_movies
+    for i in range(num_shows):
+        show = TVShow(
+            id=1_000_000 + i,
+            title=f"Show {i}",
+            summary=None,
+            tagline=None,
+            genres=rng.sample(genres, 2),
+            released_at=None,
+        )
+        for season_number in range(1, rng.randint(2, 6)):
+            season = Season(number=season_number)
+            for number in range(1, 13):
+                episode_id += 1
+                media = MediaFile(
+                    id=episode_id, file=f"/tv/{episode_id}.mkv", duration=timedelta(minutes=rng.choice([22, 44]))
+                )
+                season.episodes.append(
+                    Episode(episode_id, number, f"Episode {number}", None, None, media, season, show)
+                )
+            show.seasons.append(season)
+        plexdb.tv_shows.append(show)
+    plexdb.build_index()
+    return plexdb
+
+
+def network(num_stations: int) -> Network:
+    now = datetime.now(timezone.utc)
+    stations = [
+        TVStation(f"Station {i}", None, StationSchedule(now, []), None, None, [genres[i % len(genres)]], True)
+        for i in range(num_stations)
+    ]
+    return Network("Benchmark", stations)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--stations", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--shows", type=int, default=1000)
+    args = parser.parse_args()
+
+    plexdb = synthetic_library(args.movies, args.shows)
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    duration = timedelta(days=args.days)
+    print(
+        f"{len(plexdb.movies)} movies, {len(plexdb.episodes_by_id)} episodes,"
+        f" {args.days} days, {num_default_threads()} workers"
+    )
+    for num_stations in args.stations:
+        timings = {}
+        schedules = {}
+        for label, workers in (("serial", 1), ("parallel", None)):
+            net = network(num_stations)
+            t = time.perf_counter()
+            regenerate_schedules(net, plexdb, start, duration, seed=42, workers=workers)
+            timings[label] = time.perf_counter() - t
+            schedules[label] = [[(p.media_id, p.start_time) for p in s.schedule.programs] for s in net.stations]
+        assert schedules["serial"] == schedules["parallel"], "output differs between serial and parallel runs"
+        print(
+            f"{num_stations:5d} stations: serial {timings['serial']:.3f}s, parallel {timings['parallel']:.3f}s"
+            f" ({timings['serial'] / timings['parallel']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Benchmark full library dumps with the compiled serializer against safe_asdict.
+
+Usage: python benchmarks/bench_serialize.py [--movies 5000] [--shows 1000] [--rounds 3]
+"""
+import json
+import time
+from argparse import ArgumentParser
+from typing import Any, Callable
+from bench_schedule import synthetic_library
+from plextvstation.serialize import Serializer, msgpack
+from plextvstation.utils import safe_asdict
+
+
+def best_of(rounds: int, func: Callable[[], Any]) -> float:
+    timings = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t)
+    return min(timings)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--shows", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    plexdb = synthetic_library(args.movies, args.shows)
+    library = [*plexdb.movies, *plexdb.tv_shows]
+    print(f"{len(plexdb.movies)} movies, {len(plexdb.tv_shows)} shows, {len(plexdb.episodes_by_id)} episodes")
+
+    def baseline() -> bytes:
+        return json.dumps([safe_asdict(item) for item in library], default=str).encode()
+
+    serializer = Serializer()
+    candidates = {"safe_asdict + json": baseline, "Serializer json": lambda: serializer.dumps(library)}
+    if msgpack is not None:
+        candidates["Serializer msgpack"] = lambda: serializer.dumps(library, "msgpack")
+
+    reference = None
+    for label, func in candidates.items():
+        elapsed = best_of(args.rounds, func)
+        size = len(func())
+        if reference is None:
+            reference = elapsed
+        print(f"{label:20s} {elapsed:.3f}s {size / 1e6:7.1f} MB ({reference / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,43 @@
+import os
 import sys
 import logging
+from functools import partial
+from argparse import Namespace
 from threading import Event
-from signal import SIGTERM
+from signal import signal, SIGTERM, SIGHUP, SIG_IGN
+from datetime import datetime, timedelta, timezone
+from socket import socket
 from typing import Optional
 from types import FrameType
 from .utils import kill_children
-from .logging import log
-from .config import get_config
+from .logging import log, add_args as logging_add_args, setup as setup_logging
+from .config import get_config, Config
 from .args import parse_args
 from .utils import make_dirs, initializer
 from . import __title__ as title, __version__ as version
-from .web import WebServer, add_args as web_add_args
-from .web.app import WebApp
+from .web import add_args as web_add_args, default_limits
 from .plex import add_args as plex_add_args, validate_args as plex_validate_args, PlexDB
 from .station import load_network, save_network, Network
+from .stream import add_args as stream_add_args, StreamManager
+from .events import add_args as events_add_args, ProgramEvents, Broadcaster
+from .asrun import add_args as asrun_add_args, AsRunLog
+from .workers import add_args as workers_add_args, WorkerPool
+from .batch import add_args as batch_add_args, commands as batch_commands, run as run_batch
+from .replica import add_args as replica_add_args, Replica
+from .scheduler import extend_schedules
+from .reload import (
+    add_args as reload_add_args,
+    supported as reload_supported,
+    graceful_reload,
+    take_ready_fd,
+    take_listen_socket,
+    notify_ready,
+    release_ready_fd,
+)
 
 shutdown_event = Event()
+reload_event = Event()
+shared_plexdb: Optional[PlexDB] = None
 
 
 def shutdown(sig: int, frame: Optional[FrameType]) -> None:
@@ -23,31 +45,205 @@ def shutdown(sig: int, frame: Optional[FrameType]) -> None:
     shutdown_event.set()
 
 
+def reload(sig: int, frame: Optional[FrameType]) -> None:
+    log.info("Received SIGHUP - reloading")
+    reload_event.set()
+
+
+def handover(args: Namespace, config: Config, network: Optional[Network], listen_socket: socket) -> bool:
+    """Start a replacement process on `listen_socket` if a reload was requested. True once it took over.
+
+    The network is saved first, unless `network` is None because this process doesn't own it.
+    """
+    if not reload_event.is_set():
+        return False
+    reload_event.clear()
+    if network is not None and not args.replica:
+        save_network(config, network)
+    return graceful_reload(listen_socket, args.reload_timeout)
+
+
 def main() -> None:
-    args = parse_args([web_add_args, plex_add_args], [plex_validate_args])
+    global shared_plexdb
+    args = parse_args(
+        [
+            logging_add_args,
+            web_add_args,
+            plex_add_args,
+            stream_add_args,
+            events_add_args,
+            asrun_add_args,
+            workers_add_args,
+            reload_add_args,
+            batch_add_args,
+            replica_add_args,
+        ],
+        [plex_validate_args],
+        commands=batch_commands,
+    )
     if args.verbose:
         log.setLevel(logging.DEBUG)
+    setup_logging(json_output=args.log_json, rate=args.log_rate)
 
-    log.info(f"{title} v{version} starting up...")
+    log.info("%s v%s starting up...", title, version)
+    if args.commands:
+        config = get_config(args)
+        make_dirs(config)
+        sys.exit(run_batch(args, config))
+    from .web.server import listen_socket as web_listen_socket
+
+    take_ready_fd()
+    # Bound once here for the workers and for the process replacing us on a reload, which
+    # is handed the socket by the process it replaces instead
+    listen_socket = take_listen_socket()
+    if listen_socket is None:
+        try:
+            listen_socket = web_listen_socket(args.web_host, args.web_port)
+        except OSError as e:
+            log.error("Can't listen on port %d: %s", args.web_port, e)
+            sys.exit(1)
     initializer(shutdown)
+    can_reload = reload_supported()
+    if can_reload:
+        signal(SIGHUP, reload)
     config = get_config(args)
     make_dirs(config)
     network: Network = load_network(config)
+    plexdb = PlexDB(args, tmp_dir=config["tmp_dir"])
+
+    if args.workers > 1:
+        # Forked workers share the library and network with us copy-on-write
+        shared_plexdb = plexdb
+        pool = WorkerPool(args.workers, partial(run_worker, args, config, network, listen_socket), name="webworker")
+        pool.start()
+        # The workers tell a process we are replacing when they are serving
+        release_ready_fd()
+        handed_over = False
+        while not shutdown_event.wait(1):
+            pool.check()
+            # The workers have copies of the network of their own, so ours is never newer
+            if handover(args, config, None, listen_socket):
+                handed_over = True
+                break
+        pool.shutdown()
+    else:
+        handed_over = serve(args, config, network, plexdb, listen_socket, handle_reload=can_reload)
+
+    if not handed_over and not args.replica and args.workers <= 1:
+        # After a reload the new process owns the network, and replicas leave it to their leader
+        save_network(config, network)
+    kill_children(SIGTERM, ensure_death=True)
+    log.info("Shutdown complete")
+    sys.exit(0)
+
+
+def serve(
+    args: Namespace,
+    config: Config,
+    network: Network,
+    plexdb: PlexDB,
+    listen_socket: socket,
+    handle_reload: bool = False,
+) -> bool:
+    # Batch commands don't need the web server and its dependencies
+    from .web.server import WebServer
+    from .web.app import WebApp
+    from .web.admission import AdmissionControl
+
+    stream_manager = StreamManager(
+        network,
+        plexdb,
+        config["tmp_dir"],
+        ffmpeg=args.ffmpeg,
+        idle_timeout=args.stream_idle_timeout,
+        segment_duration=args.stream_segment_duration,
+    )
+    stream_manager.start()
+    asrun_log = AsRunLog(
+        os.path.join(config["conf_dir"], "asrun"),
+        max_segment_bytes=int(args.asrun_segment_size * 1024 * 1024),
+        max_segment_age=args.asrun_segment_age * 3600,
+    )
+    asrun_log.start()
+    program_events = ProgramEvents(network, plexdb, Broadcaster(max_subscribers=args.events_max_clients))
+    program_events.listeners.append(asrun_log.record_event)
+    for event in program_events.on_air():
+        asrun_log.seed(event)
+    program_events.start()
+    replica: Optional[Replica] = None
+    if args.replica:
+
+        def extend() -> None:
+            until = datetime.now(timezone.utc) + timedelta(days=args.days)
+            # Without --schedule-workers in-process, rather than forking the threaded server
+            extend_schedules(network, plexdb, until, seed=args.seed, workers=args.schedule_workers or 1)
+
+        replica = Replica(
+            config,
+            network,
+            extend=extend,
+            poll_interval=args.replica_poll,
+            extend_interval=args.replica_extend_interval,
+        )
+        replica.start()
 
     web_server = WebServer(
-        WebApp(plexdb=PlexDB(args)),
+        WebApp(
+            plexdb=plexdb,
+            network=network,
+            stream_manager=stream_manager,
+            program_events=program_events,
+            asrun_log=asrun_log,
+            admission=AdmissionControl(
+                max_requests=args.web_max_requests,
+                limits={**default_limits, **dict(args.web_limits)},
+                queue=args.web_queue,
+                queue_timeout=args.web_queue_timeout,
+                dedicated={"stream": args.web_stream_threads},
+            ),
+        ),
         web_host=args.web_host,
         web_port=args.web_port,
         ssl_cert=args.web_ssl_cert,
         ssl_key=args.web_ssl_key,
+        # Admitted requests leave the reserved threads to /health, /metrics and the greeting
+        # of event streams, which are served by the program events thread after that. Streams
+        # have threads of their own.
+        extra_config={
+            "server.thread_pool": args.web_max_requests + max(0, args.web_stream_threads) + args.web_reserved_threads
+        },
+        shared_socket=listen_socket,
     )
     web_server.start()
+    while not web_server.serving and web_server.is_alive() and not shutdown_event.wait(0.1):
+        pass
+    notify_ready()
 
-    shutdown_event.wait()
-    save_network(config, network)
+    handed_over = False
+    while not shutdown_event.wait(1):
+        if handle_reload and handover(args, config, network, listen_socket):
+            handed_over = True
+            break
+    program_events.shutdown()
+    # Stops accepting connections and finishes requests in flight
     web_server.shutdown()
-    kill_children(SIGTERM, ensure_death=True)
-    log.info("Shutdown complete")
+    stream_manager.shutdown()
+    asrun_log.shutdown()
+    if replica is not None:
+        replica.shutdown()
+    return handed_over
+
+
+def run_worker(args: Namespace, config: Config, network: Network, listen_socket: socket, worker_id: int) -> None:
+    initializer(shutdown)
+    # Reloads are handled by the main process
+    signal(SIGHUP, SIG_IGN)
+    plexdb = shared_plexdb
+    if plexdb is None:
+        # Not forked from the process that loaded the library, on platforms without fork()
+        plexdb = PlexDB(args, tmp_dir=config["tmp_dir"])
+    log.debug("Web worker %d serving", worker_id)
+    serve(args, config, network, plexdb, listen_socket)
     sys.exit(0)
 
 
@@ -1,13 +1,22 @@
-from argparse import ArgumentParser, Namespace
-from typing import Callable, List, Optional
+from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
+from typing import Callable, List, Optional, Dict
 from . import __version__ as version, __description__ as description, __title__ as title
 
 
 def parse_args(
     add_args: Optional[List[Callable[[ArgumentParser], None]]] = None,
     validate_args: Optional[List[Callable[[ArgumentParser, Namespace], None]]] = None,
+    commands: Optional[Dict[str, str]] = None,
 ) -> Namespace:
-    parser = ArgumentParser(prog=title, description=f"{description} (v{version})")
+    epilog = None
+    if commands:
+        epilog = "commands:\n" + "\n".join(f"  {name:12s}{help}" for name, help in commands.items())
+    parser = ArgumentParser(
+        prog=title,
+        description=f"{description} (v{version})",
+        epilog=epilog,
+        formatter_class=RawDescriptionHelpFormatter,
+    )
     parser.add_argument("-v", "--verbose", dest="verbose", help="Enable verbose logging", action="store_true")
     parser.add_argument(
         "-d",
@@ -24,12 +33,25 @@ def parse_args(
         default="Plex Station Network",
     )
 
+    if commands:
+        parser.add_argument(
+            "commands",
+            help="Run these commands headless and exit instead of starting the web server",
+            nargs="*",
+            metavar="command",
+        )
+
     if add_args is not None:
         for add_arg in add_args:
             add_arg(parser)
 
     args = parser.parse_args()
 
+    # Not checked with choices, which rejects an empty list for nargs="*"
+    for command in getattr(args, "commands", []):
+        if commands is not None and command not in commands:
+            parser.error(f"argument command: invalid choice: '{command}' (choose from {', '.join(commands)})")
+
     if validate_args is not None:
         for validate_arg in validate_args:
             validate_arg(parser, args)
@@ -0,0 +1,318 @@
+import os
+import sys
+import glob
+import gzip
+import json
+import queue
+import shutil
+import threading
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Optional, List, Any, IO, Iterator, Union
+from prometheus_client import Counter
+from .events import ProgramEvent
+from .logging import log, rate_limit
+from .types import MediaType
+
+try:
+    import fcntl
+except ImportError:
+    pass
+
+metric_asrun_entries = Counter("plextvstation_asrun_entries", "Number of programs written to the as-run log")
+metric_asrun_rotations = Counter("plextvstation_asrun_rotations", "Number of as-run log segments rotated")
+metric_asrun_dropped = Counter(
+    "plextvstation_asrun_dropped", "Programs not written to the as-run log because another process writes it"
+)
+
+asrun_log = rate_limit(log.getChild("asrun"), rate=1, burst=10)
+
+index_name = "index.ndjson"
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--asrun-segment-size",
+        dest="asrun_segment_size",
+        help="Rotate as-run log segments after this many MB (default: 16)",
+        default=16,
+        type=float,
+    )
+    parser.add_argument(
+        "--asrun-segment-age",
+        dest="asrun_segment_age",
+        help="Rotate as-run log segments after this many hours (default: 24)",
+        default=24,
+        type=float,
+    )
+
+
+@dataclass(frozen=True)
+class AsRunEntry:
+    station: str
+    start: datetime
+    end: datetime
+    media_type: MediaType
+    media_id: int
+    title: Optional[str]
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "station": self.station,
+                "start": self.start.timestamp(),
+                "end": self.end.timestamp(),
+                "type": self.media_type.name.lower(),
+                "id": self.media_id,
+                "title": self.title,
+            },
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "AsRunEntry":
+        return cls(
+            data["station"],
+            datetime.fromtimestamp(data["start"], timezone.utc),
+            datetime.fromtimestamp(data["end"], timezone.utc),
+            MediaType[data["type"].upper()],
+            data["id"],
+            data["title"],
+        )
+
+    @classmethod
+    def from_event(cls, event: ProgramEvent) -> Optional["AsRunEntry"]:
+        program = event.data.get("program")
+        if event.kind != "program" or program is None:
+            return None
+        return cls(
+            event.station,
+            datetime.fromisoformat(program["start"]),
+            datetime.fromisoformat(program["end"]),
+            MediaType[program["media_type"].upper()],
+            program["media_id"],
+            program["title"],
+        )
+
+
+@dataclass(frozen=True)
+class OnAir:
+    """`entry` went on air on `station`, or nothing did. Seeded entries are logged from `since`."""
+
+    station: str
+    entry: Optional[AsRunEntry]
+    since: Optional[datetime] = None
+
+
+class AsRunLog(threading.Thread):
+    """Append-only log of every program that went on air.
+
+    Program events are queued by `record_event()`, which never blocks. This thread keeps
+    track of what is on air on each station, and logs a program once it went off air, so
+    entries end when the program did. Whatever is on air at shutdown is logged as ending
+    then, and `seed()` starts logging the programs that are on air at startup.
+
+    Entries are written as one JSON line each to the current segment file. Segments are rotated by size and age, gzip
+    compressed, and described by a line in an index file with their time range and stations.
+    Queries only open the segments whose index entry matches.
+
+    With several worker processes only the one holding the lock file writes the log. The
+    others drop their entries, which `plextvstation_asrun_dropped` counts.
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = 16 * 1024 * 1024, max_segment_age: float = 86400):
+        super().__init__()
+        self.name = "asrunlog"
+        self.daemon = True
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.queue: queue.SimpleQueue[Union[AsRunEntry, OnAir, None]] = queue.SimpleQueue()
+        self.on_air: dict[str, AsRunEntry] = {}
+        self.segment: Optional[IO[str]] = None
+        self.segment_path: Optional[str] = None
+        self.segment_opened = 0.0
+        self.segment_number = 0
+        self.lock_fd: Optional[int] = None
+        self.index_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def record(self, entry: AsRunEntry) -> None:
+        self.queue.put(entry)
+
+    def record_event(self, event: ProgramEvent) -> None:
+        if event.kind == "program":
+            self.queue.put(OnAir(event.station, AsRunEntry.from_event(event)))
+
+    def seed(self, event: ProgramEvent) -> None:
+        """Start logging the program on air at startup, from now on."""
+        if event.kind == "program":
+            self.queue.put(OnAir(event.station, AsRunEntry.from_event(event), datetime.now(timezone.utc)))
+
+    def acquire(self) -> bool:
+        if self.lock_fd is not None or sys.platform == "win32":
+            return True
+        fd = os.open(os.path.join(self.directory, "writer.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        # Segments left open by a writer that died are finished now
+        for path in glob.glob(os.path.join(self.directory, "asrun-*.ndjson")):
+            self.rotate(path)
+        return True
+
+    def run(self) -> None:
+        while True:
+            try:
+                entry = self.queue.get(timeout=1)
+            except queue.Empty:
+                if self.segment is not None and time.time() - self.segment_opened > self.max_segment_age:
+                    self.close_segment(rotate=True)
+                continue
+            if entry is None:
+                break
+            try:
+                if isinstance(entry, OnAir):
+                    self.switch(entry)
+                else:
+                    self.write(entry)
+            except Exception:
+                log.exception("Failed to write to the as-run log")
+        try:
+            self.off_air(datetime.now(timezone.utc))
+        except Exception:
+            log.exception("Failed to write to the as-run log")
+        self.close_segment(rotate=False)
+
+    def switch(self, on_air: OnAir) -> None:
+        """Log the program that went off air on a station, and remember the one that replaced it."""
+        previous = self.on_air.pop(on_air.station, None)
+        entry = on_air.entry
+        if previous is not None:
+            # Cut short if the schedule changed while it was on air
+            self.finish(previous, previous.end if entry is None else entry.start)
+        if entry is None:
+            return
+        if on_air.since is not None and entry.start < on_air.since:
+            entry = replace(entry, start=min(on_air.since, entry.end))
+        self.on_air[on_air.station] = entry
+
+    def off_air(self, now: datetime) -> None:
+        """Log everything that is on air as ending at `now`."""
+        for entry in self.on_air.values():
+            self.finish(entry, now)
+        self.on_air.clear()
+
+    def finish(self, entry: AsRunEntry, end: datetime) -> None:
+        end = min(entry.end, end)
+        if end > entry.start:
+            self.write(replace(entry, end=end))
+
+    def write(self, entry: AsRunEntry) -> None:
+        if not self.acquire():
+            metric_asrun_dropped.inc()
+            asrun_log.debug("Another process writes the as-run log, dropped %s on %s", entry.title, entry.station)
+            return
+        if self.segment is None:
+            self.segment_opened = time.time()
+            self.segment_number += 1
+            timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+            name = f"asrun-{timestamp}-{os.getpid()}-{self.segment_number}.ndjson"
+            self.segment_path = os.path.join(self.directory, name)
+            self.segment = open(self.segment_path, "a", encoding="utf-8")
+        self.segment.write(entry.to_json() + "\n")
+        self.segment.flush()
+        metric_asrun_entries.inc()
+        if self.segment.tell() >= self.max_segment_bytes or time.time() - self.segment_opened > self.max_segment_age:
+            self.close_segment(rotate=True)
+
+    def close_segment(self, rotate: bool) -> None:
+        if self.segment is None or self.segment_path is None:
+            return
+        self.segment.close()
+        self.segment = None
+        if rotate:
+            self.rotate(self.segment_path)
+        self.segment_path = None
+
+    def rotate(self, path: str) -> None:
+        """Compress a finished segment and add it to the index."""
+        log.debug("Rotating as-run log segment %s", path)
+        entries = list(self.read_segment(path))
+        if not entries:
+            os.remove(path)
+            return
+        gz_path = f"{path}.gz"
+        with open(path, "rb") as src, gzip.open(f"{gz_path}.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(f"{gz_path}.tmp", gz_path)
+        index_entry = {
+            "segment": os.path.basename(gz_path),
+            "start": min(e.start for e in entries).timestamp(),
+            "end": max(e.end for e in entries).timestamp(),
+            "stations": sorted({e.station for e in entries}),
+            "entries": len(entries),
+        }
+        with self.index_lock, open(os.path.join(self.directory, index_name), "a", encoding="utf-8") as f:
+            f.write(json.dumps(index_entry, separators=(",", ":")) + "\n")
+        os.remove(path)
+        metric_asrun_rotations.inc()
+
+    @staticmethod
+    def read_segment(path: str) -> Iterator[AsRunEntry]:
+        opener: Any = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield AsRunEntry.from_dict(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A line that is still being written
+                        continue
+        except FileNotFoundError:
+            # Rotated while we were looking for it
+            return
+
+    def segments(self, station: Optional[str], start: datetime, end: datetime) -> List[str]:
+        # Segments that are still being written are not indexed yet. Listed before reading the
+        # index, so one that is rotated in between is found through the index.
+        raw_paths = sorted(glob.glob(os.path.join(self.directory, "asrun-*.ndjson")))
+        paths = []
+        indexed = set()
+        index_path = os.path.join(self.directory, index_name)
+        if os.path.isfile(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                for line in f:
+                    segment = json.loads(line)
+                    indexed.add(segment["segment"])
+                    if segment["end"] <= start.timestamp() or segment["start"] >= end.timestamp():
+                        continue
+                    if station is not None and station not in segment["stations"]:
+                        continue
+                    paths.append(os.path.join(self.directory, segment["segment"]))
+        # A rotated segment is indexed just before its raw file is removed
+        paths.extend(path for path in raw_paths if f"{os.path.basename(path)}.gz" not in indexed)
+        return paths
+
+    def aired(self, station: Optional[str], start: datetime, end: datetime) -> List[AsRunEntry]:
+        """Programs that were on air on `station` (or any station) at any time in [start, end)."""
+        entries = [
+            entry
+            for path in self.segments(station, start, end)
+            for entry in self.read_segment(path)
+            if (station is None or entry.station == station) and entry.end > start and entry.start < end
+        ]
+        entries.sort(key=lambda e: (e.start, e.station))
+        return entries
+
+    def shutdown(self) -> None:
+        self.queue.put(None)
+        self.join(timeout=10)
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
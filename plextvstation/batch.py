@@ -0,0 +1,129 @@
+import time
+from collections import Counter
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, List, Tuple
+from .config import Config
+from .guide import GuideBuilder
+from .logging import log
+from .plex import PlexDB
+from .scheduler import regenerate_schedules, extend_schedules
+from .station import load_network, save_network, Network
+from .validate import validate_network
+
+commands = {
+    "generate": "Regenerate all schedules from now on for --days",
+    "extend": "Extend all schedules up to --days from now",
+    "validate": "Check schedules for overlaps, gaps and duplicates",
+    "export": "Write the XMLTV guide and M3U playlist to --export-dir",
+    "save": "Save the network",
+}
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--days",
+        dest="days",
+        help="Number of days to generate or extend schedules for (default: 7)",
+        default=7,
+        type=float,
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        help="Seed for schedule generation (default: 0)",
+        default=0,
+        type=int,
+    )
+    parser.add_argument(
+        "--schedule-workers",
+        dest="schedule_workers",
+        help="Number of processes generating schedules (default: number of CPUs)",
+        type=int,
+    )
+    parser.add_argument(
+        "--export-dir",
+        dest="export_dir",
+        help="Directory to export the guide and playlist to (default: <directory>/conf)",
+    )
+    parser.add_argument(
+        "--base-url",
+        dest="base_url",
+        help="Base URL of the web server for stream URLs in the playlist (default: http://localhost:9898)",
+        default="http://localhost:9898",
+    )
+    parser.add_argument(
+        "--strict",
+        dest="strict",
+        help="Exit with an error if validation finds problems",
+        action="store_true",
+    )
+
+
+class Timings:
+    def __init__(self) -> None:
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases.append((name, elapsed))
+            log.info("%s took %.3fs", name, elapsed)
+
+    def summary(self) -> str:
+        width = max(len(name) for name, _ in self.phases)
+        lines = [f"{name:{width}s} {elapsed:8.3f}s" for name, elapsed in self.phases]
+        lines.append(f"{'total':{width}s} {sum(elapsed for _, elapsed in self.phases):8.3f}s")
+        return "\n".join(lines)
+
+
+def run(args: Namespace, config: Config) -> int:
+    """Run the requested commands without starting the web server. Returns the exit code."""
+    requested = set(args.commands)
+    timings = Timings()
+    exit_code = 0
+
+    with timings.phase("load network"):
+        network: Network = load_network(config)
+
+    plexdb: Optional[PlexDB] = None
+    if requested & {"generate", "extend", "export"}:
+        with timings.phase("load library"):
+            plexdb = PlexDB(args, tmp_dir=config["tmp_dir"], index_content=False)
+
+    now = datetime.now(timezone.utc)
+    until = now + timedelta(days=args.days)
+    if "generate" in requested and plexdb is not None:
+        with timings.phase("generate"):
+            start = now.replace(second=0, microsecond=0)
+            regenerate_schedules(network, plexdb, start, until - start, seed=args.seed, workers=args.schedule_workers)
+    # After generate, this only extends schedules that came out short of --days
+    if "extend" in requested and plexdb is not None:
+        with timings.phase("extend"):
+            extend_schedules(network, plexdb, until, seed=args.seed, workers=args.schedule_workers, now=now)
+
+    if "validate" in requested:
+        with timings.phase("validate"):
+            conflicts = validate_network(network)
+        for conflict in conflicts:
+            log.debug("Schedule problem: %s", conflict)
+        kinds = Counter(conflict.kind.value for conflict in conflicts)
+        log.info("Validation found %d problems%s", len(conflicts), f" {dict(kinds)}" if kinds else "")
+        if conflicts and args.strict:
+            exit_code = 1
+
+    if "export" in requested and plexdb is not None:
+        with timings.phase("export"):
+            GuideBuilder(network, plexdb).write(args.export_dir or config["conf_dir"], args.base_url.rstrip("/"))
+
+    if "save" in requested:
+        with timings.phase("save"):
+            save_network(config, network)
+
+    print(timings.summary())
+    return exit_code
@@ -0,0 +1,425 @@
+import ssl
+import json
+import heapq
+import queue
+import socket
+import selectors
+import threading
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import count
+from typing import Optional, Iterator, Any, List, Tuple, Callable
+from prometheus_client import Gauge, Counter
+from .logging import log, rate_limit
+from .media import Episode
+from .schedule import MediaLibrary
+from .station import Network, TVStation
+
+metric_event_subscribers = Gauge("plextvstation_event_subscribers", "Number of connected event stream clients")
+metric_events_published = Counter("plextvstation_events_published", "Number of program events published", ["kind"])
+metric_events_dropped = Counter("plextvstation_events_dropped", "Subscribers disconnected for not keeping up")
+
+events_log = rate_limit(log.getChild("events"), rate=1, burst=10)
+
+# Raised by non-blocking sockets that can't take more data right now
+would_block = (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--events-max-clients",
+        dest="events_max_clients",
+        help="Maximum number of concurrent /events clients (default: 16)",
+        default=16,
+        type=int,
+    )
+
+
+@dataclass(frozen=True)
+class ProgramEvent:
+    id: int
+    kind: str
+    station: str
+    data: dict[str, Any]
+
+    def encode(self) -> bytes:
+        return f"id: {self.id}\nevent: {self.kind}\ndata: {json.dumps(self.data)}\n\n".encode()
+
+
+class Subscription:
+    def __init__(self, station: Optional[str], max_queue: int) -> None:
+        self.station = station
+        self.queue: queue.Queue[Optional[ProgramEvent]] = queue.Queue(max_queue)
+        self.closed = False
+
+    def offer(self, event: Optional[ProgramEvent]) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self) -> None:
+        self.closed = True
+        # Wakes up the reader, unless its queue is full anyway
+        self.offer(None)
+
+
+class Broadcaster:
+    """Fans events out to all subscribers.
+
+    Every subscriber has a bounded queue. Publishing never blocks: a subscriber whose queue is
+    full is disconnected and can reconnect to get the current state again.
+    """
+
+    def __init__(self, max_subscribers: int = 16, max_queue: int = 256) -> None:
+        self.max_subscribers = max_subscribers
+        self.max_queue = max_queue
+        self.subscribers: set[Subscription] = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, station: Optional[str] = None) -> Optional[Subscription]:
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(station, self.max_queue)
+            self.subscribers.add(subscription)
+            metric_event_subscribers.set(len(self.subscribers))
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscribers.discard(subscription)
+            metric_event_subscribers.set(len(self.subscribers))
+
+    def publish(self, event: ProgramEvent) -> None:
+        metric_events_published.labels(kind=event.kind).inc()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.station is not None and subscription.station != event.station:
+                continue
+            if not subscription.offer(event):
+                events_log.debug("Disconnecting event subscriber that is not keeping up")
+                metric_events_dropped.inc()
+                self.unsubscribe(subscription)
+                subscription.close()
+
+    def close(self) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+
+class EventClient:
+    """An event stream connection taken over from the web server, written to without blocking."""
+
+    def __init__(self, subscription: Subscription, sock: socket.socket, chunked: bool, keepalive_at: datetime) -> None:
+        self.subscription = subscription
+        self.sock = sock
+        self.chunked = chunked
+        self.keepalive_at = keepalive_at
+        self.buffer = bytearray()
+
+    def send(self, data: bytes) -> None:
+        if self.chunked:
+            # The response started out with chunked transfer encoding
+            data = b"%x\r\n%s\r\n" % (len(data), data)
+        self.buffer += data
+
+    def flush(self) -> bool:
+        """Write as much of the buffer as the socket takes. False once the connection is gone."""
+        while self.buffer:
+            try:
+                sent = self.sock.send(self.buffer)
+            except would_block:
+                return True
+            except OSError:
+                return False
+            del self.buffer[:sent]
+        return True
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ProgramEvents(threading.Thread):
+    """Publishes an event whenever a program starts or ends on a station, or a schedule changes.
+
+    A single thread keeps a heap with the next program boundary of every station and sleeps
+    until the earliest one is due. The network is checked for a new version once a second,
+    and only then are the stations compared one by one. Events are published to a `Broadcaster`. Program
+    boundary events are also passed to `listeners`, which must not block.
+
+    Event stream connections that the web server hands over with `attach()` are served by the
+    same thread: it waits for them to become writable along with the next boundary, and never
+    blocks on a slow client. A client whose unsent events exceed `max_buffer` bytes is dropped.
+    Time is read from `clock`, which tests replace.
+    """
+
+    def __init__(
+        self,
+        network: Network,
+        library: MediaLibrary,
+        broadcaster: Optional[Broadcaster] = None,
+        check_interval: float = 1.0,
+        keepalive: float = 15.0,
+        max_buffer: int = 65536,
+        clock: Callable[[], datetime] = utc_now,
+    ) -> None:
+        super().__init__()
+        self.name = "programevents"
+        self.daemon = True
+        self.network = network
+        self.library = library
+        self.broadcaster = broadcaster or Broadcaster()
+        self.check_interval = check_interval
+        self.keepalive = timedelta(seconds=keepalive)
+        self.max_buffer = max_buffer
+        self.clock = clock
+        self.heap: List[Tuple[datetime, int, str]] = []
+        self.schedule_keys: dict[str, Tuple[Any, ...]] = {}
+        self.generations: dict[str, int] = {}
+        self.synced_version: Optional[int] = None
+        self.event_ids = count(1)
+        self.listeners: List[Callable[[ProgramEvent], None]] = []
+        self.clients: List[EventClient] = []
+        self.attaching: queue.SimpleQueue[Tuple[Subscription, socket.socket, bool]] = queue.SimpleQueue()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.wakeup_send.setblocking(False)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ)
+        self.shutdown_event = threading.Event()
+
+    @staticmethod
+    def schedule_key(station: TVStation) -> Tuple[Any, ...]:
+        schedule = station.schedule
+        return station.active, id(schedule), schedule.revision, len(schedule.programs)
+
+    def now_playing(self, station: TVStation, now: datetime) -> dict[str, Any]:
+        data: dict[str, Any] = {"station": station.name, "program": None}
+        program = station.schedule.program_at(now) if station.active else None
+        if program is None:
+            return data
+        content = program.content(self.library)
+        title = None
+        if isinstance(content, Episode):
+            title = f"{content.tv_show.title} - {content.title}"
+        elif content is not None:
+            title = content.title
+        data["program"] = {
+            "media_type": program.media_type.name.lower(),
+            "media_id": program.media_id,
+            "title": title,
+            "start": program.start_time.isoformat(),
+            "end": program.end_time.isoformat(),
+        }
+        return data
+
+    def event(self, kind: str, station: TVStation, now: datetime) -> ProgramEvent:
+        return ProgramEvent(next(self.event_ids), kind, station.name, self.now_playing(station, now))
+
+    def schedule_next(self, station: TVStation, now: datetime) -> None:
+        if not station.active:
+            return
+        boundary = station.schedule.next_boundary(now)
+        if boundary is not None:
+            heapq.heappush(self.heap, (boundary, self.generations[station.name], station.name))
+
+    def sync(self, now: datetime) -> None:
+        """Pick up new, changed and removed stations."""
+        snapshot = self.network.snapshot()
+        if snapshot.number == self.synced_version:
+            return
+        self.synced_version = snapshot.number
+        names = set()
+        for station in snapshot.stations:
+            names.add(station.name)
+            key = self.schedule_key(station)
+            previous = self.schedule_keys.get(station.name)
+            if previous == key:
+                continue
+            self.schedule_keys[station.name] = key
+            self.generations[station.name] = self.generations.get(station.name, 0) + 1
+            self.schedule_next(station, now)
+            if previous is not None:
+                self.broadcaster.publish(self.event("schedule", station, now))
+        for name in set(self.schedule_keys) - names:
+            del self.schedule_keys[name]
+            del self.generations[name]
+
+    def fire(self, now: datetime) -> None:
+        """Publish events for all boundaries that are due."""
+        while self.heap and self.heap[0][0] <= now:
+            _, generation, name = heapq.heappop(self.heap)
+            if self.generations.get(name) != generation:
+                # The schedule changed after this boundary was queued
+                continue
+            station = self.network.get_station(name)
+            if station is None:
+                continue
+            event = self.event("program", station, now)
+            self.broadcaster.publish(event)
+            for listener in self.listeners:
+                listener(event)
+            self.schedule_next(station, now)
+
+    def run(self) -> None:
+        while not self.shutdown_event.is_set():
+            now = self.clock()
+            try:
+                self.sync(now)
+                self.fire(now)
+                self.serve_clients(now)
+            except Exception:
+                log.exception("Error while publishing program events")
+            now = self.clock()
+            deadlines = [now + timedelta(seconds=self.check_interval)]
+            if self.heap:
+                deadlines.append(self.heap[0][0])
+            deadlines.extend(client.keepalive_at for client in self.clients)
+            self.wait(max((min(deadlines) - now).total_seconds(), 0))
+        for client in list(self.clients):
+            self.drop(client)
+        self.selector.close()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until `timeout`, a wake up, or until a client can take more data or went away."""
+        for key, mask in self.selector.select(timeout):
+            client: Optional[EventClient] = key.data
+            if client is None:
+                try:
+                    while self.wakeup_recv.recv(4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            if mask & selectors.EVENT_READ:
+                try:
+                    # Clients don't send anything, so this only ever reads the end of the connection
+                    if not client.sock.recv(4096):
+                        self.drop(client)
+                        continue
+                except would_block:
+                    pass
+                except OSError:
+                    self.drop(client)
+                    continue
+            if mask & selectors.EVENT_WRITE:
+                self.write(client)
+
+    def wake(self) -> None:
+        try:
+            self.wakeup_send.send(b"\0")
+        except OSError:
+            # Nobody's listening anymore, or a wake up is already pending
+            pass
+
+    def on_air(self, station: Optional[str] = None) -> List[ProgramEvent]:
+        """Program events for what is on air right now on `station`, or on all stations."""
+        now = self.clock()
+        return [self.event("program", s, now) for s in self.network.stations if station is None or station == s.name]
+
+    def greeting(self, subscription: Subscription) -> List[bytes]:
+        """The start of an event stream: the reconnect delay and what is on air right now."""
+        return [b"retry: 3000\n\n", *(event.encode() for event in self.on_air(subscription.station))]
+
+    def attach(self, subscription: Subscription, sock: Optional[socket.socket], chunked: bool) -> None:
+        """Take over the connection of an event stream, after the web server sent its greeting.
+
+        Called on a request thread. Without `sock` the response failed and the subscription ends.
+        """
+        if sock is None:
+            self.broadcaster.unsubscribe(subscription)
+            return
+        self.attaching.put((subscription, sock, chunked))
+        self.wake()
+
+    def serve_clients(self, now: datetime) -> None:
+        """Take over attached connections, and pass them their events or a keepalive."""
+        while True:
+            try:
+                subscription, sock, chunked = self.attaching.get_nowait()
+            except queue.Empty:
+                break
+            if self.shutdown_event.is_set():
+                sock.close()
+                self.broadcaster.unsubscribe(subscription)
+                continue
+            sock.setblocking(False)
+            client = EventClient(subscription, sock, chunked, now + self.keepalive)
+            self.clients.append(client)
+            self.selector.register(sock, selectors.EVENT_READ, client)
+        for client in list(self.clients):
+            while True:
+                try:
+                    event = client.subscription.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None or client.subscription.closed:
+                    break
+                client.send(event.encode())
+            if client.subscription.closed:
+                self.drop(client)
+                continue
+            if not client.buffer and now >= client.keepalive_at:
+                client.send(b": keepalive\n\n")
+            if client.buffer:
+                client.keepalive_at = now + self.keepalive
+                self.write(client)
+
+    def write(self, client: EventClient) -> None:
+        if not client.flush():
+            self.drop(client)
+            return
+        if len(client.buffer) > self.max_buffer:
+            events_log.debug("Disconnecting event stream client that is not keeping up")
+            metric_events_dropped.inc()
+            self.drop(client)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.buffer else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def drop(self, client: EventClient) -> None:
+        if client not in self.clients:
+            return
+        self.clients.remove(client)
+        self.selector.unregister(client.sock)
+        self.broadcaster.unsubscribe(client.subscription)
+        client.close()
+
+    def stream(self, subscription: Subscription) -> Iterator[bytes]:
+        """Server-Sent Events for a subscription on a request thread, which it holds on to.
+
+        Only for web servers that can't hand the connection over to `attach()`.
+        """
+        try:
+            yield from self.greeting(subscription)
+            while not self.shutdown_event.is_set():
+                try:
+                    event = subscription.queue.get(timeout=self.keepalive.total_seconds())
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is None or subscription.closed:
+                    return
+                yield event.encode()
+        finally:
+            self.broadcaster.unsubscribe(subscription)
+
+    def shutdown(self) -> None:
+        self.shutdown_event.set()
+        self.broadcaster.close()
+        self.wake()
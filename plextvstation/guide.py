@@ -0,0 +1,238 @@
+import os
+import re
+import gzip
+import hashlib
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Iterator, Iterable, Any
+from urllib.parse import quote
+from xml.sax.saxutils import escape, quoteattr
+from .logging import log, rate_limit
+from .media import Episode
+from .schedule import ScheduledProgram, MediaLibrary
+from .station import Network, TVStation
+
+xmltv_time_format = "%Y%m%d%H%M%S %z"
+
+# Stations are rendered on every guide request
+guide_log = rate_limit(log.getChild("guide"), rate=10, burst=100)
+
+
+@dataclass(frozen=True)
+class GuideDocument:
+    body: bytes
+    gzip_body: bytes
+    etag: str
+    last_modified: datetime
+    content_type: str
+
+
+@dataclass
+class StationFragment:
+    key: tuple[Any, ...]
+    channel: bytes
+    programmes: bytes
+
+
+def channel_id(station: TVStation) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", station.name.lower()).strip("-") + ".plextvstation"
+
+
+def channel_ids(stations: Iterable[TVStation]) -> list[str]:
+    """Channel ids in the order of the stations.
+
+    Names that only differ in punctuation or case, or not at all, get a numbered suffix.
+    """
+    ids: list[str] = []
+    taken: set[str] = set()
+    for station in stations:
+        station_id = channel_id(station)
+        stem = station_id.removesuffix(".plextvstation")
+        number = 1
+        while station_id in taken:
+            number += 1
+            station_id = f"{stem}-{number}.plextvstation"
+        taken.add(station_id)
+        ids.append(station_id)
+    return ids
+
+
+def m3u_attribute(value: str) -> str:
+    # M3U has no quoting, a quote or line break would end the attribute or the entry
+    return value.replace('"', "&quot;").replace("\r", " ").replace("\n", " ")
+
+
+def xmltv_programme(station_id: str, program: ScheduledProgram, library: MediaLibrary) -> str:
+    content = program.content(library)
+    if content is None:
+        return ""
+    start = program.start_time.strftime(xmltv_time_format)
+    stop = program.end_time.strftime(xmltv_time_format)
+    lines = [f"  <programme start={quoteattr(start)} stop={quoteattr(stop)} channel={quoteattr(station_id)}>"]
+    if isinstance(content, Episode):
+        lines.append(f"    <title>{escape(content.tv_show.title)}</title>")
+        lines.append(f"    <sub-title>{escape(content.title)}</sub-title>")
+        summary = content.summary or content.tv_show.summary
+        genres = content.tv_show.genres
+    else:
+        lines.append(f"    <title>{escape(content.title)}</title>")
+        summary = content.summary
+        genres = content.genres
+    if summary:
+        lines.append(f"    <desc>{escape(summary)}</desc>")
+    for genre in genres:
+        lines.append(f"    <category>{escape(genre.strip())}</category>")
+    if isinstance(content, Episode):
+        lines.append(
+            f'    <episode-num system="xmltv_ns">{max(content.season.number - 1, 0)}.{max(content.number - 1, 0)}.'
+            "</episode-num>"
+        )
+    lines.append("  </programme>\n")
+    return "\n".join(lines)
+
+
+def xmltv_channel(station_id: str, station: TVStation) -> str:
+    lang = f" lang={quoteattr(station.language)}" if station.language else ""
+    return (
+        f"  <channel id={quoteattr(station_id)}>\n"
+        f"    <display-name{lang}>{escape(station.name)}</display-name>\n"
+        "  </channel>\n"
+    )
+
+
+class GuideBuilder:
+    """Builds XMLTV and M3U documents for a network.
+
+    Rendered XMLTV output is cached per station. A station is only re-rendered when its schedule
+    revision, its metadata or the guide window changes. The full document is then assembled from
+    the cached fragments and compressed once, so repeated polls are served from memory.
+    """
+
+    def __init__(
+        self,
+        network: Network,
+        library: MediaLibrary,
+        past: timedelta = timedelta(hours=2),
+        future: timedelta = timedelta(days=3),
+        window_step: timedelta = timedelta(minutes=30),
+    ) -> None:
+        self.network = network
+        self.library = library
+        self.past = past
+        self.future = future
+        self.window_step = window_step
+        # By position, as station names need not be unique
+        self.fragments: dict[int, StationFragment] = {}
+        self.documents: dict[str, tuple[tuple[Any, ...], GuideDocument]] = {}
+        self.lock = threading.Lock()
+
+    def window(self, now: Optional[datetime] = None) -> tuple[datetime, datetime]:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        step = self.window_step.total_seconds()
+        start = datetime.fromtimestamp(now.timestamp() // step * step, timezone.utc) - self.past
+        return start, start + self.past + self.future
+
+    def station_key(self, station: TVStation, station_id: str, window: tuple[datetime, datetime]) -> tuple[Any, ...]:
+        schedule = station.schedule
+        # Every change to a schedule bumps its revision, regenerated ones included
+        return (
+            station.name,
+            station_id,
+            station.language,
+            station.active,
+            schedule.date,
+            schedule.revision,
+            len(schedule.programs),
+            window,
+        )
+
+    def station_fragment(
+        self, position: int, station: TVStation, station_id: str, window: tuple[datetime, datetime]
+    ) -> StationFragment:
+        key = self.station_key(station, station_id, window)
+        fragment = self.fragments.get(position)
+        if fragment is not None and fragment.key == key:
+            return fragment
+
+        guide_log.debug("Rendering guide for station %s", station.name)
+        programmes = "".join(
+            xmltv_programme(station_id, program, self.library) for program in station.schedule.programs_between(*window)
+        )
+        fragment = StationFragment(
+            key=key,
+            channel=xmltv_channel(station_id, station).encode(),
+            programmes=programmes.encode(),
+        )
+        self.fragments[position] = fragment
+        return fragment
+
+    def xmltv_chunks(self, fragments: Iterable[StationFragment]) -> Iterator[bytes]:
+        fragments = list(fragments)
+        yield b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield b'<!DOCTYPE tv SYSTEM "xmltv.dtd">\n'
+        yield f"<tv generator-info-name={quoteattr('plextvstation')}>\n".encode()
+        for fragment in fragments:
+            yield fragment.channel
+        for fragment in fragments:
+            yield fragment.programmes
+        yield b"</tv>\n"
+
+    def m3u_chunks(self, stations: Iterable[TVStation], base_url: str) -> Iterator[bytes]:
+        stations = list(stations)
+        yield f'#EXTM3U x-tvg-url="{base_url}/xmltv"\n'.encode()
+        for station, station_id in zip(stations, channel_ids(stations)):
+            attrs = f'tvg-id="{station_id}" tvg-name="{m3u_attribute(station.name)}"'
+            if station.language:
+                attrs += f' tvg-language="{m3u_attribute(station.language)}"'
+            if station.tags:
+                attrs += f' group-title="{m3u_attribute(station.tags[0])}"'
+            yield f"#EXTINF:-1 {attrs},{m3u_attribute(station.name)}\n".encode()
+            yield f"{base_url}/stream/{quote(station.name, safe='')}/index.m3u8\n".encode()
+
+    def _document(self, name: str, key: tuple[Any, ...], content_type: str, chunks: Iterator[bytes]) -> GuideDocument:
+        cached = self.documents.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        body = b"".join(chunks)
+        document = GuideDocument(
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=6, mtime=0),
+            etag='"' + hashlib.sha1(body).hexdigest() + '"',
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+            content_type=content_type,
+        )
+        if cached is not None and cached[1].etag == document.etag:
+            document = cached[1]
+        self.documents[name] = (key, document)
+        return document
+
+    def xmltv(self, now: Optional[datetime] = None) -> GuideDocument:
+        window = self.window(now)
+        with self.lock:
+            stations = [station for station in self.network.stations if station.active]
+            fragments = [
+                self.station_fragment(position, station, station_id, window)
+                for position, (station, station_id) in enumerate(zip(stations, channel_ids(stations)))
+            ]
+            for position in [position for position in self.fragments if position >= len(stations)]:
+                del self.fragments[position]
+            key = tuple(fragment.key for fragment in fragments)
+            return self._document("xmltv", key, "application/xml", self.xmltv_chunks(fragments))
+
+    def m3u(self, base_url: str) -> GuideDocument:
+        with self.lock:
+            stations = [station for station in self.network.stations if station.active]
+            key = (base_url,) + tuple((s.name, s.language, tuple(s.tags or [])) for s in stations)
+            return self._document("m3u", key, "audio/x-mpegurl", self.m3u_chunks(stations, base_url))
+
+    def write(self, directory: str, base_url: str) -> None:
+        """Write the guide and playlist to `directory`, along with gzip compressed copies."""
+        for filename, document in (("xmltv.xml", self.xmltv()), ("stations.m3u", self.m3u(base_url))):
+            for path, data in ((filename, document.body), (f"{filename}.gz", document.gzip_body)):
+                path = os.path.join(directory, path)
+                log.debug("Writing %s", path)
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(data)
+                os.replace(f"{path}.tmp", path)
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+from typing import Callable, List, Iterator, Any, Optional, SupportsIndex, Union, overload
+from prometheus_client import Gauge, Counter
+from .logging import log, sample
+from .media import Season
+
+metric_show_cache_hits = Counter("plextvstation_show_cache_hits", "Lazy TV show lookups served from memory")
+metric_show_cache_misses = Counter("plextvstation_show_cache_misses", "Lazy TV show lookups loaded from SQLite")
+metric_show_cache_evictions = Counter("plextvstation_show_cache_evictions", "TV shows evicted from the show cache")
+metric_show_cache_size = Gauge("plextvstation_show_cache_size", "Number of TV shows with seasons in memory")
+
+# A cache that is too small evicts on almost every lookup
+cache_log = sample(log.getChild("lazy"), 100)
+
+caches: "WeakValueDictionary[str, ShowCache]" = WeakValueDictionary()
+
+
+class LazySeasons(List[Season]):
+    """The seasons of a TV show, loaded from the Plex database on first access.
+
+    Behaves like the plain list it replaces. Reading it loads the show's seasons and episodes
+    through the `ShowCache`, which may later evict them again. Mutating it is not supported.
+    Pickling stores only the show id and the name of the cache, and never loads the seasons.
+    """
+
+    def __init__(self, show_id: int, cache: "ShowCache") -> None:
+        super().__init__()
+        self.show_id = show_id
+        self.cache = cache
+        self.loaded = False
+
+    def seasons(self) -> List[Season]:
+        with self.cache.lock:
+            self.cache.load(self)
+            return list.copy(self)
+
+    def __len__(self) -> int:
+        return len(self.seasons())
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    @overload
+    def __getitem__(self, index: SupportsIndex) -> Season:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[Season]:
+        ...
+
+    def __getitem__(self, index: Union[SupportsIndex, slice]) -> Union[Season, List[Season]]:
+        return self.seasons()[index]
+
+    def __iter__(self) -> Iterator[Season]:
+        return iter(self.seasons())
+
+    def __reversed__(self) -> Iterator[Season]:
+        return reversed(self.seasons())
+
+    def __contains__(self, item: object) -> bool:
+        return item in self.seasons()
+
+    def __eq__(self, other: object) -> bool:
+        return self.seasons() == other
+
+    def __ne__(self, other: object) -> bool:
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.seasons())
+
+    def copy(self) -> List[Season]:
+        return self.seasons()
+
+    def index(self, item: Season, *args: Any) -> int:
+        return self.seasons().index(item, *args)
+
+    def count(self, item: Season) -> int:
+        return self.seasons().count(item)
+
+    def __reduce_ex__(self, protocol: SupportsIndex) -> Any:
+        return LazySeasons, (self.show_id, self.cache)
+
+
+def named_cache(name: str) -> "ShowCache":
+    return caches[name]
+
+
+class ShowCache:
+    """A size bounded LRU of TV shows whose seasons and episodes are in memory.
+
+    `loader` returns the seasons of a show, `evicted` is called with the seasons that were
+    dropped when a show falls out of the cache. A cache pickles as its `name`, and unpickles
+    as the cache of that name in the unpickling process.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[int], List[Season]],
+        evicted: Optional[Callable[[int, List[Season]], None]] = None,
+        max_shows: int = 256,
+        name: Optional[str] = None,
+    ) -> None:
+        self.name = name if name is not None else f"cache-{id(self)}"
+        self.loader = loader
+        self.evicted = evicted
+        self.max_shows = max(max_shows, 1)
+        self.shows: OrderedDict[int, LazySeasons] = OrderedDict()
+        self.lock = threading.RLock()
+        caches[self.name] = self
+
+    def __reduce__(self) -> Any:
+        return named_cache, (self.name,)
+
+    def __len__(self) -> int:
+        return len(self.shows)
+
+    def load(self, seasons: LazySeasons) -> None:
+        with self.lock:
+            if seasons.loaded:
+                metric_show_cache_hits.inc()
+                self.shows.move_to_end(seasons.show_id)
+                return
+            metric_show_cache_misses.inc()
+            list.extend(seasons, self.loader(seasons.show_id))
+            seasons.loaded = True
+            self.shows[seasons.show_id] = seasons
+            while len(self.shows) > self.max_shows:
+                self.evict(self.shows.popitem(last=False)[1])
+            metric_show_cache_size.set(len(self.shows))
+
+    def evict(self, seasons: LazySeasons) -> None:
+        cache_log.debug("Evicting seasons of TV show %s from the show cache", seasons.show_id)
+        metric_show_cache_evictions.inc()
+        dropped = list.copy(seasons)
+        list.clear(seasons)
+        seasons.loaded = False
+        if self.evicted is not None:
+            self.evicted(seasons.show_id, dropped)
+
+    def clear(self) -> None:
+        with self.lock:
+            while self.shows:
+                self.evict(self.shows.popitem(last=False)[1])
+            metric_show_cache_size.set(0)
@@ -1,7 +1,234 @@
+import os
+import json
+import time
+import queue
+import atexit
 import logging
+import threading
+import multiprocessing.util
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from enum import Enum
+from pathlib import PurePath
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, List, Any, Tuple
+from prometheus_client import Counter
 
 log_format = "%(asctime)s|%(levelname)5s|%(process)d|%(threadName)10s  %(message)s"
 logging.basicConfig(level=logging.WARNING, format=log_format)
 
 log = logging.getLogger("plextvstation")
 log.setLevel(logging.INFO)
+
+metric_log_records_dropped = Counter(
+    "plextvstation_log_records_dropped", "Log records dropped by rate limiting or sampling", ["reason"]
+)
+
+queue_handler: Optional["LogQueueHandler"] = None
+listener: Optional[QueueListener] = None
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--log-json",
+        dest="log_json",
+        help="Write log messages as JSON lines",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--log-rate",
+        dest="log_rate",
+        help="Maximum debug and info messages per second from any one line of code, 0 for no limit (default: 0)",
+        default=0,
+        type=float,
+    )
+
+
+@dataclass
+class Bucket:
+    tokens: float
+    updated: float
+    suppressed: int = 0
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through `rate` records per second from every line of code, in bursts of up to `burst`.
+
+    Records of level WARNING and above always pass. The first record let through after
+    some were dropped says how many.
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.buckets: dict[Tuple[str, int], Bucket] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get((record.pathname, record.lineno))
+            if bucket is None:
+                bucket = self.buckets[(record.pathname, record.lineno)] = Bucket(self.burst, now)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            if bucket.tokens < 1:
+                bucket.suppressed += 1
+                metric_log_records_dropped.labels(reason="rate_limit").inc()
+                return False
+            bucket.tokens -= 1
+            suppressed, bucket.suppressed = bucket.suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+            record.suppressed = suppressed
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Lets through one in every `every` records from every line of code.
+
+    Records of level WARNING and above always pass.
+    """
+
+    def __init__(self, every: int) -> None:
+        super().__init__()
+        self.every = every
+        self.counts: dict[Tuple[str, int], int] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            num = self.counts.get((record.pathname, record.lineno), 0)
+            self.counts[(record.pathname, record.lineno)] = num + 1
+        if num % self.every:
+            metric_log_records_dropped.labels(reason="sample").inc()
+            return False
+        if self.every > 1:
+            record.msg = f"{record.msg} (sampled 1 in {self.every})"
+            record.sampled = self.every
+        return True
+
+
+def rate_limit(logger: logging.Logger, rate: float, burst: Optional[int] = None) -> logging.Logger:
+    logger.addFilter(RateLimitFilter(rate, burst))
+    return logger
+
+
+def sample(logger: logging.Logger, every: int) -> logging.Logger:
+    logger.addFilter(SampleFilter(every))
+    return logger
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data: dict[str, Any] = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        for extra in ("suppressed", "sampled"):
+            if hasattr(record, extra):
+                data[extra] = getattr(record, extra)
+        return json.dumps(data, default=str)
+
+
+# Values of these types can't change once logged, so the listener can format them later
+immutable_types = (str, int, float, bool, bytes, type(None), datetime, date, timedelta, Enum, PurePath)
+
+
+def immutable(value: Any) -> bool:
+    if isinstance(value, tuple):
+        return all(immutable(item) for item in value)
+    return isinstance(value, immutable_types)
+
+
+class LogQueueHandler(QueueHandler):
+    """Queues records for the listener thread.
+
+    Timestamps, padding, JSON and mostly also merging the message with its arguments are
+    done by the listener. Only arguments that may change once we return, like lists or
+    objects, are merged on the calling thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not isinstance(record.msg, str) or not immutable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+def setup(json_output: bool = False, rate: float = 0) -> None:
+    """Move writing log messages off the calling threads.
+
+    The handlers of the root logger are moved behind a queue, which a listener thread
+    empties. CherryPy's request threads and the library loading only pay for putting a
+    record on the queue.
+    """
+    global queue_handler, listener
+    root = logging.getLogger()
+    if queue_handler is not None:
+        stop()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+        if json_output:
+            handler.setFormatter(JsonFormatter())
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    if rate > 0:
+        queue_handler.addFilter(RateLimitFilter(rate))
+    root.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    multiprocessing.util.register_after_fork(queue_handler, stop_at_exit)
+
+
+def stop() -> None:
+    """Write all queued records and log on the calling threads again."""
+    global queue_handler, listener
+    if queue_handler is None or listener is None:
+        return
+    listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(queue_handler)
+    for handler in listener.handlers:
+        root.addHandler(handler)
+    queue_handler = None
+    listener = None
+
+
+def restart_after_fork() -> None:
+    global listener
+    if queue_handler is None or listener is None:
+        return
+    # Records the parent had queued are the parent's to write
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    handlers: List[logging.Handler] = list(listener.handlers)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+
+def stop_at_exit(_: Any) -> None:
+    # Child processes of multiprocessing skip atexit
+    multiprocessing.util.Finalize(None, stop, exitpriority=0)
+
+
+atexit.register(stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_after_fork)
@@ -1,12 +1,23 @@
 import os
+import json
+import hashlib
+import time
 import sqlite3
 import platform
 from datetime import timedelta
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Union, Iterable, Iterator, NamedTuple, Any, TYPE_CHECKING
 from argparse import ArgumentParser, ArgumentTypeError, Namespace
 from .utils import from_timestamp
 from .logging import log
-from .media import Movie, TVShow, Episode, Season, MediaFile
+from .lazy import LazySeasons, ShowCache
+from .media import Movie, TVShow, Episode, Season, MediaFile, MediaBase
+from .search import SearchIndex, SearchDocument, SearchResult
+from .types import MediaType
+
+if TYPE_CHECKING:
+    # Both only load their dependencies, requests and numpy, when they are used
+    from .plexapi import PlexAPI, Row
+    from .similarity import SimilarityEngine, SimilarityItem, MediaKey
 
 
 def add_args(parser: ArgumentParser) -> None:
@@ -26,11 +37,69 @@ def add_args(parser: ArgumentParser) -> None:
         help="Translate paths to a different root (e.g. '/mnt/plex -> /data/plex')",
         type=path_translation,
     )
+    parser.add_argument(
+        "--plex-db-snapshot",
+        dest="plex_db_snapshot",
+        help="Load from a local copy of the Plex database, taken with the SQLite backup API",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--plex-db-snapshot-pages",
+        dest="plex_db_snapshot_pages",
+        help="Number of pages to copy per backup step (default: 256)",
+        default=256,
+        type=int,
+    )
+    parser.add_argument(
+        "--plex-db-snapshot-sleep",
+        dest="plex_db_snapshot_sleep",
+        help="Seconds to sleep between backup steps (default: 0.05)",
+        default=0.05,
+        type=float,
+    )
+    parser.add_argument(
+        "--plex-url",
+        dest="plex_url",
+        help="Load the library from the Plex Media Server at this URL instead of its database (e.g. http://plex:32400)",
+    )
+    parser.add_argument(
+        "--plex-token",
+        dest="plex_token",
+        help="Plex authentication token for --plex-url (default: $PLEX_TOKEN)",
+        default=os.environ.get("PLEX_TOKEN"),
+    )
+    parser.add_argument(
+        "--plex-api-workers",
+        dest="plex_api_workers",
+        help="Number of concurrent requests to the Plex API (default: 8)",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--plex-api-page-size",
+        dest="plex_api_page_size",
+        help="Number of items per Plex API request (default: 1000)",
+        default=1000,
+        type=int,
+    )
+    parser.add_argument(
+        "--plex-db-lazy",
+        dest="plex_db_lazy",
+        help="Load seasons and episodes of TV shows on first use instead of at startup",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--plex-db-show-cache",
+        dest="plex_db_show_cache",
+        help="Number of TV shows to keep in memory with --plex-db-lazy (default: 256)",
+        default=256,
+        type=int,
+    )
 
 
 def validate_args(parser: ArgumentParser, args: Namespace) -> None:
-    if args.plex_db is None:
-        parser.error("the following arguments are required: --plex-db")
+    if args.plex_db is None and args.plex_url is None:
+        parser.error("the following arguments are required: --plex-db or --plex-url")
 
 
 def get_default_plex_db_path() -> Optional[str]:
@@ -113,28 +182,329 @@ def path_translation(pt: str) -> Tuple[str, str]:
     return src, dst
 
 
+def db_signature(db_path: str) -> List[Optional[List[int]]]:
+    """Size and mtime of a SQLite database and its WAL. Changes whenever Plex commits."""
+    signature: List[Optional[List[int]]] = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append([stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            signature.append(None)
+    return signature
+
+
+class BackupRestarts(Exception):
+    pass
+
+
+def snapshot_plex_db(
+    plex_db_path: str, snapshot_path: str, pages: int = 256, sleep: float = 0.05, max_restarts: int = 10
+) -> str:
+    """Copy the Plex database to `snapshot_path` unless an up to date copy exists.
+
+    The copy is taken with the SQLite online backup API in batches of `pages` pages, sleeping
+    between batches. Plex never waits for us to release a lock and our own, long running load
+    queries run against a file nobody else is writing to.
+
+    Every time Plex writes to its database the backup starts over. If that happens more than
+    `max_restarts` times the database is copied in a single step instead, which can't be
+    interrupted but holds the read lock for the whole copy.
+    """
+    signature_path = f"{snapshot_path}.source"
+    signature = db_signature(plex_db_path)
+    if os.path.isfile(snapshot_path) and os.path.isfile(signature_path):
+        with open(signature_path) as f:
+            if json.load(f) == signature:
+                log.debug("Plex database unchanged, reusing snapshot %s", snapshot_path)
+                return snapshot_path
+
+    log.debug("Taking snapshot of %s to %s", plex_db_path, snapshot_path)
+    start_time = time.monotonic()
+    tmp_path = f"{snapshot_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    src = sqlite3.connect(f"file:{plex_db_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(tmp_path)
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        # A restarted backup has as many pages left as before the step, or more
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarts()
+        last_remaining = remaining
+
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+        except BackupRestarts:
+            log.warning("Plex database changed %d times during the snapshot, copying it in one step", restarts)
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp_path, snapshot_path)
+    with open(signature_path, "w") as f:
+        json.dump(signature, f)
+    log.debug("Snapshot of Plex database took %.2fs", time.monotonic() - start_time)
+    return snapshot_path
+
+
+# A result row of our queries, or the same columns from the Plex API
+LibraryRow = Union[sqlite3.Row, "Row"]
+
+
+class EpisodeRecord(NamedTuple):
+    id: int
+    show_id: int
+    title: str
+    summary: Optional[str]
+    duration: int
+
+
 class PlexDB:
-    def __init__(self, args: Namespace) -> None:
+    def __init__(
+        self, args: Namespace, load: bool = True, tmp_dir: Optional[str] = None, index_content: bool = True
+    ) -> None:
         self.plex_db_path = args.plex_db
         self.path_translate = args.path_translate
+        self.api: Optional["PlexAPI"] = None
+        if getattr(args, "plex_url", None):
+            from .plexapi import PlexAPI
+
+            self.api = PlexAPI(
+                args.plex_url,
+                token=getattr(args, "plex_token", None),
+                workers=getattr(args, "plex_api_workers", 8),
+                page_size=getattr(args, "plex_api_page_size", 1000),
+            )
+        # Snapshots and lazy loading need the database file
+        self.snapshot = bool(getattr(args, "plex_db_snapshot", False)) and tmp_dir is not None and self.api is None
+        self.snapshot_pages = getattr(args, "plex_db_snapshot_pages", 256)
+        self.snapshot_sleep = getattr(args, "plex_db_snapshot_sleep", 0.05)
+        self.lazy = bool(getattr(args, "plex_db_lazy", False)) and self.api is None
+        # Search and similarity indexes are only needed when serving
+        self.index_content = index_content
+        self.tmp_dir = tmp_dir
+        self.db_path = self.plex_db_path
         self.movies: List[Movie] = []
         self.tv_shows: List[TVShow] = []
-        self.load_db()
-
-    def _execute_query(self, query: str) -> List[sqlite3.Row]:
-        with sqlite3.connect(f"file:{self.plex_db_path}?mode=ro", uri=True) as conn:
+        self.movies_by_id: Dict[int, Movie] = {}
+        self.tv_shows_by_id: Dict[int, TVShow] = {}
+        self.episodes_by_id: Dict[int, Episode] = {}
+        self.show_cache = ShowCache(
+            self.fetch_seasons,
+            self.forget_seasons,
+            max_shows=getattr(args, "plex_db_show_cache", 256),
+            name=self.plex_db_path,
+        )
+        self.search_index = SearchIndex(os.path.join(tmp_dir, "search.db") if tmp_dir is not None else None)
+        self.similarity: Optional["SimilarityEngine"] = None
+        self.generation: Optional[str] = None
+        if load:
+            self.load_db()
+
+    def _execute_query(self, query: str, params: Tuple[Any, ...] = ()) -> List[sqlite3.Row]:
+        uri = f"file:{self.db_path}?mode=ro"
+        if self.db_path != self.plex_db_path:
+            # Our own snapshot never changes underneath us, so SQLite can skip locking
+            uri += "&immutable=1"
+        with sqlite3.connect(uri, uri=True) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute(query)
+            cursor.execute(query, params)
             return cursor.fetchall()
 
     def load_db(self) -> None:
+        if self.api is not None:
+            try:
+                self.load_api(self.api)
+            finally:
+                self.api.close()
+            return
         log.debug("Loading Plex database")
+        if self.snapshot and self.tmp_dir is not None:
+            self.db_path = snapshot_plex_db(
+                self.plex_db_path,
+                os.path.join(self.tmp_dir, "plex-library.db"),
+                pages=self.snapshot_pages,
+                sleep=self.snapshot_sleep,
+            )
         self.movies = self.fetch_all_movies()
         self.tv_shows = self.fetch_all_tv_shows()
-        self.fetch_all_episodes()
+        if self.lazy:
+            self.fetch_aired_dates()
+        else:
+            self.fetch_all_episodes()
+        self.build_index()
         log.debug("Loaded Plex database")
 
+    def load_api(self, api: "PlexAPI") -> None:
+        log.debug("Loading library from %s", api.url)
+        movie_rows, show_rows, episode_rows = api.fetch_library()
+        self.movies = [self._movie(row) for row in movie_rows]
+        self.tv_shows = [self._tv_show(row) for row in show_rows]
+        tv_shows: dict[int, TVShow] = {show.id: show for show in self.tv_shows}
+        for row in episode_rows:
+            tv_show = tv_shows.get(row["show_id"])
+            if tv_show is not None:
+                self._add_episode(tv_show, tv_show.seasons, row)
+        self.build_index()
+        log.debug("Loaded library from %s", api.url)
+
+    def build_index(self) -> None:
+        self.movies_by_id = {movie.id: movie for movie in self.movies}
+        self.tv_shows_by_id = {tv_show.id: tv_show for tv_show in self.tv_shows}
+        self.show_cache.clear()
+        self.episodes_by_id = {
+            episode.id: episode
+            for tv_show in self.tv_shows
+            if not isinstance(tv_show.seasons, LazySeasons)
+            for season in tv_show.seasons
+            for episode in season.episodes
+            if episode is not None
+        }
+        self.generation = None
+        if not self.index_content:
+            return
+        # Episodes are read once, for the search index and the generation at the same time
+        digest = hashlib.blake2b(digest_size=16)
+        self.search_index.update(self.digest_library(self.search_documents(), digest))
+        self.generation = digest.hexdigest()
+        from .similarity import SimilarityEngine, available as similarity_available
+
+        if similarity_available():
+            items = list(self.similarity_items())
+            if self.tmp_dir is not None:
+                self.similarity = SimilarityEngine.load_or_build(items, self.generation, self.tmp_dir)
+            else:
+                self.similarity = SimilarityEngine.build(items)
+
+    def digest_library(
+        self, documents: Iterable[SearchDocument], digest: "hashlib.blake2b"
+    ) -> Iterator[SearchDocument]:
+        """Pass `documents` through, adding them and all genres to `digest`.
+
+        The digest changes whenever an item is added, removed or edited.
+        """
+        media: MediaBase
+        for media in (*self.movies, *self.tv_shows):
+            digest.update(f"{type(media).__name__}|{media.id}|{','.join(media.genres)}\0".encode())
+        for document in documents:
+            digest.update(f"{document.media_type.value}|{document.media_id}|".encode())
+            digest.update(document.digest)
+            yield document
+
+    def get_movie(self, movie_id: int) -> Optional[Movie]:
+        return self.movies_by_id.get(movie_id)
+
+    def get_episode(self, episode_id: int) -> Optional[Episode]:
+        episode = self.episodes_by_id.get(episode_id)
+        if episode is None and self.lazy:
+            rows = self._execute_query(
+                """
+                SELECT mip.parent_id AS show_id
+                FROM metadata_items AS mi
+                JOIN metadata_items AS mip ON mi.parent_id = mip.id
+                WHERE mi.id = ? AND mi.metadata_type = 4
+                """,
+                (episode_id,),
+            )
+            tv_show = self.tv_shows_by_id.get(rows[0]["show_id"]) if rows else None
+            if tv_show is not None and isinstance(tv_show.seasons, LazySeasons):
+                with self.show_cache.lock:
+                    self.show_cache.load(tv_show.seasons)
+                    episode = self.episodes_by_id.get(episode_id)
+        return episode
+
+    def get_media(self, media_type: MediaType, media_id: int) -> Optional[Union[Episode, Movie]]:
+        if media_type == MediaType.EPISODE:
+            return self.get_episode(media_id)
+        if media_type == MediaType.MOVIE:
+            return self.get_movie(media_id)
+        return None
+
+    def search_documents(self) -> Iterator[SearchDocument]:
+        for movie in self.movies:
+            yield SearchDocument(MediaType.MOVIE, movie.id, movie.title, movie.tagline, movie.summary)
+        for tv_show in self.tv_shows:
+            yield SearchDocument(MediaType.SHOW, tv_show.id, tv_show.title, tv_show.tagline, tv_show.summary)
+        for episode in self.episode_records():
+            show_title = self.tv_shows_by_id[episode.show_id].title
+            yield SearchDocument(
+                MediaType.EPISODE, episode.id, f"{show_title} - {episode.title}", None, episode.summary
+            )
+
+    def episode_records(self) -> Iterator[EpisodeRecord]:
+        """All episodes in airing order, without materialising lazily loaded TV shows."""
+        if self.lazy:
+            query = """
+            SELECT
+                mi.id AS episode_id,
+                mip.parent_id AS show_id,
+                mi.title AS episode_title,
+                mi.summary AS episode_summary,
+                COALESCE(m.duration, 0) AS episode_duration
+            FROM metadata_items AS mi
+            JOIN metadata_items AS mip ON mi.parent_id = mip.id
+            LEFT JOIN media_items AS m ON mi.id = m.metadata_item_id
+            WHERE mi.library_section_id = 2 AND mi.metadata_type = 4
+            GROUP BY mi.id
+            ORDER BY show_id, mip."index", mi."index";
+            """
+            for row in self._execute_query(query):
+                if row["show_id"] in self.tv_shows_by_id:
+                    yield EpisodeRecord(
+                        row["episode_id"],
+                        row["show_id"],
+                        row["episode_title"],
+                        row["episode_summary"],
+                        row["episode_duration"],
+                    )
+            return
+        for tv_show in self.tv_shows:
+            for season in tv_show.seasons:
+                for episode in season.episodes:
+                    if episode is not None:
+                        yield EpisodeRecord(
+                            episode.id,
+                            tv_show.id,
+                            episode.title,
+                            episode.summary,
+                            int(episode.media.duration.total_seconds() * 1000),
+                        )
+
+    def similarity_items(self) -> Iterator["SimilarityItem"]:
+        from .similarity import SimilarityItem
+
+        for media_type, items in ((MediaType.MOVIE, self.movies), (MediaType.SHOW, self.tv_shows)):
+            for item in items:
+                yield SimilarityItem(
+                    media_type,
+                    item.id,
+                    " ".join(filter(None, (item.title, item.tagline, item.summary))),
+                    tuple(sorted({genre.strip().lower() for genre in item.genres if genre.strip()})),
+                )
+
+    def more_like_this(self, keys: List["MediaKey"], limit: int = 20) -> List[Tuple["MediaKey", float]]:
+        if self.similarity is None:
+            return []
+        return self.similarity.similar(keys, limit)
+
+    def cluster(
+        self, num_clusters: int, keys: Optional[List["MediaKey"]] = None, seed: int = 0
+    ) -> List[List["MediaKey"]]:
+        if self.similarity is None:
+            return []
+        return self.similarity.cluster(num_clusters, keys, seed=seed)
+
+    def search(self, query: str, limit: int = 20, media_type: Optional[MediaType] = None) -> List[SearchResult]:
+        return self.search_index.search(query, limit, media_type)
+
     def fetch_all_movies(self) -> List[Movie]:
         log.debug("Fetching all movies")
         query = """
@@ -156,27 +526,25 @@ class PlexDB:
         WHERE mi.library_section_id = 1 AND mi.metadata_type = 1
         GROUP BY mi.id;
         """
-        rows = self._execute_query(query)
-        movies = []
-        for row in rows:
-            genres: List[str] = []
-            if row["genres"]:
-                genres = row["genres"].split(",")
-            movie = Movie(
-                id=row["movie_id"],
-                title=row["title"],
-                tagline=row["tagline"],
-                summary=row["summary"],
-                genres=genres,
-                released_at=from_timestamp(row["originally_available_at"]) if row["originally_available_at"] else None,
-                media=MediaFile(
-                    id=row["media_id"],
-                    file=self.__path_translate(row["file"]),
-                    duration=timedelta(milliseconds=row["duration"]),
-                ),
-            )
-            movies.append(movie)
-        return movies
+        return [self._movie(row) for row in self._execute_query(query)]
+
+    def _movie(self, row: LibraryRow) -> Movie:
+        genres: List[str] = []
+        if row["genres"]:
+            genres = row["genres"].split(",")
+        return Movie(
+            id=row["movie_id"],
+            title=row["title"],
+            tagline=row["tagline"],
+            summary=row["summary"],
+            genres=genres,
+            released_at=from_timestamp(row["originally_available_at"]) if row["originally_available_at"] else None,
+            media=MediaFile(
+                id=row["media_id"],
+                file=self.__path_translate(row["file"]),
+                duration=timedelta(milliseconds=row["duration"]),
+            ),
+        )
 
     def fetch_all_tv_shows(self) -> List[TVShow]:
         log.debug("Fetching all TV shows")
@@ -194,28 +562,72 @@ class PlexDB:
         WHERE mi.library_section_id = 2 AND mi.metadata_type = 2
         GROUP BY mi.id;
         """
-        rows = self._execute_query(query)
         tv_shows = []
-        for row in rows:
-            genres: List[str] = []
-            if row["genres"]:
-                genres = row["genres"].split(",")
-            tv_show = TVShow(
-                id=row["show_id"],
-                title=row["show_title"],
-                tagline=row["show_tagline"],
-                genres=genres,
-                summary=row["show_summary"],
-                released_at=from_timestamp(row["show_release_date"]) if row["show_release_date"] else from_timestamp(0),
-                seasons=[],
-            )
+        for row in self._execute_query(query):
+            tv_show = self._tv_show(row)
+            if self.lazy:
+                tv_show.seasons = LazySeasons(tv_show.id, self.show_cache)
             tv_shows.append(tv_show)
         return tv_shows
 
+    def _tv_show(self, row: LibraryRow) -> TVShow:
+        genres: List[str] = []
+        if row["genres"]:
+            genres = row["genres"].split(",")
+        return TVShow(
+            id=row["show_id"],
+            title=row["show_title"],
+            tagline=row["show_tagline"],
+            genres=genres,
+            summary=row["show_summary"],
+            released_at=from_timestamp(row["show_release_date"]) if row["show_release_date"] else from_timestamp(0),
+        )
+
     def fetch_all_episodes(self) -> None:
         log.debug("Fetching all episodes")
         tv_shows: dict[int, TVShow] = {show.id: show for show in self.tv_shows}
+        for row in self._fetch_episode_rows():
+            tv_show = tv_shows[row["show_id"]]
+            self._add_episode(tv_show, tv_show.seasons, row)
+
+    def fetch_seasons(self, show_id: int) -> List[Season]:
+        """Load the seasons and episodes of a single TV show. Used as the loader of the show cache."""
+        log.debug("Fetching episodes of TV show %s", show_id)
+        tv_show = self.tv_shows_by_id[show_id]
+        seasons: List[Season] = []
+        for row in self._fetch_episode_rows(show_id):
+            episode = self._add_episode(tv_show, seasons, row)
+            self.episodes_by_id[episode.id] = episode
+        return seasons
+
+    def forget_seasons(self, show_id: int, seasons: List[Season]) -> None:
+        for season in seasons:
+            for episode in season.episodes:
+                if episode is not None:
+                    self.episodes_by_id.pop(episode.id, None)
+
+    def fetch_aired_dates(self) -> None:
+        log.debug("Fetching first and last air dates of all TV shows")
         query = """
+        SELECT
+            mip.parent_id AS show_id,
+            MIN(mi.originally_available_at) AS first_aired,
+            MAX(mi.originally_available_at) AS last_aired
+        FROM metadata_items AS mi
+        JOIN metadata_items AS mip ON mi.parent_id = mip.id
+        WHERE mi.library_section_id = 2 AND mi.metadata_type = 4
+        GROUP BY mip.parent_id;
+        """
+        tv_shows: dict[int, TVShow] = {show.id: show for show in self.tv_shows}
+        for row in self._execute_query(query):
+            tv_show = tv_shows.get(row["show_id"])
+            if tv_show is not None:
+                tv_show.first_aired = from_timestamp(row["first_aired"]) if row["first_aired"] else None
+                tv_show.last_aired = from_timestamp(row["last_aired"]) if row["last_aired"] else None
+
+    def _fetch_episode_rows(self, show_id: Optional[int] = None) -> List[sqlite3.Row]:
+        # The episode's season is its parent. Filtering on the season's parent_id uses Plex's parent_id index.
+        query = f"""
         SELECT
             mi.id AS episode_id,
             mi.parent_id AS season_id,
@@ -231,49 +643,49 @@ class PlexDB:
         JOIN metadata_items AS mip ON mi.parent_id = mip.id
         LEFT JOIN media_items AS m ON mi.id = m.metadata_item_id
         LEFT JOIN media_parts AS mp ON m.id = mp.media_item_id
-        WHERE mi.library_section_id = 2 AND mi.metadata_type = 4
+        WHERE mi.library_section_id = 2 AND mi.metadata_type = 4{"" if show_id is None else " AND mip.parent_id = ?"}
         ORDER BY show_id, season_number, episode_number;
         """
-        rows = self._execute_query(query)
-
-        for row in rows:
-            tv_show: TVShow = tv_shows[row["show_id"]]
-            season_number = row["season_number"]
-            episode_number = row["episode_number"]
-
-            if len(tv_show.seasons) <= season_number:
-                for i in range(len(tv_show.seasons), season_number + 1):
-                    tv_show.seasons.append(Season(number=i))
-            season: Season = tv_show.seasons[season_number]
-
-            if len(season.episodes) <= episode_number:
-                for _ in range(len(season.episodes), episode_number + 1):
-                    season.episodes.append(None)
-
-            episode = Episode(
+        return self._execute_query(query, () if show_id is None else (show_id,))
+
+    def _add_episode(self, tv_show: TVShow, seasons: List[Season], row: LibraryRow) -> Episode:
+        season_number = row["season_number"]
+        episode_number = row["episode_number"]
+
+        if len(seasons) <= season_number:
+            for i in range(len(seasons), season_number + 1):
+                seasons.append(Season(number=i))
+        season: Season = seasons[season_number]
+
+        if len(season.episodes) <= episode_number:
+            for _ in range(len(season.episodes), episode_number + 1):
+                season.episodes.append(None)
+
+        episode = Episode(
+            id=row["episode_id"],
+            title=row["episode_title"],
+            summary=row["episode_summary"],
+            aired_at=from_timestamp(row["aired_at"]) if row["aired_at"] else None,
+            media=MediaFile(
                 id=row["episode_id"],
-                title=row["episode_title"],
-                summary=row["episode_summary"],
-                aired_at=from_timestamp(row["aired_at"]) if row["aired_at"] else None,
-                media=MediaFile(
-                    id=row["episode_id"],
-                    file=row["episode_file"],
-                    duration=timedelta(milliseconds=row["episode_duration"])
-                    if row["episode_duration"]
-                    else timedelta(milliseconds=0),
-                ),
-                season=season,
-                number=episode_number,
-                tv_show=tv_show,
-            )
+                file=row["episode_file"],
+                duration=timedelta(milliseconds=row["episode_duration"])
+                if row["episode_duration"]
+                else timedelta(milliseconds=0),
+            ),
+            season=season,
+            number=episode_number,
+            tv_show=tv_show,
+        )
 
-            tv_show.seasons[season_number].episodes[episode_number] = episode
+        season.episodes[episode_number] = episode
 
-            if episode.aired_at is not None:
-                if tv_show.first_aired is None or tv_show.first_aired > episode.aired_at:
-                    tv_show.first_aired = episode.aired_at
-                if tv_show.last_aired is None or tv_show.last_aired < episode.aired_at:
-                    tv_show.last_aired = episode.aired_at
+        if episode.aired_at is not None:
+            if tv_show.first_aired is None or tv_show.first_aired > episode.aired_at:
+                tv_show.first_aired = episode.aired_at
+            if tv_show.last_aired is None or tv_show.last_aired < episode.aired_at:
+                tv_show.last_aired = episode.aired_at
+        return episode
 
     def __path_translate(self, path: str) -> str:
         if self.path_translate is None:
@@ -0,0 +1,178 @@
+import requests
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Optional, List, Tuple, Any, Dict
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .logging import log
+
+metric_plex_api_requests = Counter("plextvstation_plex_api_requests", "Requests made to the Plex HTTP API")
+
+# Plex metadata types, as used in /library/sections/<key>/all?type=
+MOVIE = 1
+SHOW = 2
+EPISODE = 4
+
+Row = Dict[str, Any]
+
+
+@lru_cache(maxsize=65536)
+def timestamp(date: Optional[str]) -> Optional[int]:
+    """A Plex 'YYYY-MM-DD' date as seconds since the epoch, the way the database stores it."""
+    if not date:
+        return None
+    try:
+        return int(datetime.fromisoformat(date).replace(tzinfo=timezone.utc).timestamp())
+    except ValueError:
+        return None
+
+
+def genres(item: Row) -> Optional[str]:
+    return ",".join(genre["tag"] for genre in item.get("Genre", [])) or None
+
+
+def media_part(item: Row) -> Tuple[Row, Row]:
+    media = item.get("Media") or [{}]
+    parts = media[0].get("Part") or [{}]
+    return media[0], parts[0]
+
+
+class PlexAPI:
+    """Reads the library from Plex Media Server's HTTP API instead of its database file.
+
+    All requests go through one session, whose connection pool has a connection per worker
+    that is kept alive between requests. Every section is read in pages: the first page
+    of each section is requested at once, and as soon as it tells us the section's size
+    the remaining pages are fetched concurrently. Items are returned as rows with the same
+    columns our SQL queries return, so `PlexDB` builds the same model from either source.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: Optional[str] = None,
+        workers: int = 8,
+        page_size: int = 1000,
+        timeout: float = 30,
+    ) -> None:
+        self.url = url.rstrip("/")
+        self.workers = workers
+        self.page_size = page_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+        if token:
+            self.session.headers["X-Plex-Token"] = token
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, path: str, params: Optional[Row] = None, start: Optional[int] = None) -> Row:
+        headers = {}
+        if start is not None:
+            headers["X-Plex-Container-Start"] = str(start)
+            headers["X-Plex-Container-Size"] = str(self.page_size)
+        metric_plex_api_requests.inc()
+        response = self.session.get(f"{self.url}{path}", params=params, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        container: Row = response.json()["MediaContainer"]
+        return container
+
+    def sections(self) -> List[Tuple[str, str]]:
+        """(key, type) of every library section, type being 'movie', 'show' and so on."""
+        return [(section["key"], section["type"]) for section in self.get("/library/sections").get("Directory", [])]
+
+    def fetch_items(self, listings: List[Tuple[str, int]]) -> Dict[Tuple[str, int], List[Row]]:
+        """Fetch the metadata of all items of the given (section key, metadata type) listings."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="plexapi") as pool:
+
+            def page(section: str, media_type: int, start: int) -> Row:
+                return self.get(f"/library/sections/{section}/all", {"type": media_type}, start)
+
+            first_pages = {listing: pool.submit(page, *listing, 0) for listing in listings}
+            pages: Dict[Tuple[str, int], List[Future[Row]]] = {}
+            for listing, first_page in first_pages.items():
+                container = first_page.result()
+                total = int(container.get("totalSize", container.get("size", 0)))
+                pages[listing] = [first_page] + [
+                    pool.submit(page, *listing, start) for start in range(self.page_size, total, self.page_size)
+                ]
+            return {
+                listing: [item for future in futures for item in future.result().get("Metadata", [])]
+                for listing, futures in pages.items()
+            }
+
+    def fetch_library(self) -> Tuple[List[Row], List[Row], List[Row]]:
+        """Rows of all movies, TV shows and episodes."""
+        sections = self.sections()
+        listings = [(key, MOVIE) for key, kind in sections if kind == "movie"]
+        listings += [(key, media_type) for key, kind in sections if kind == "show" for media_type in (SHOW, EPISODE)]
+        log.debug("Fetching %d listings from %s", len(listings), self.url)
+        items = self.fetch_items(listings)
+
+        movie_rows, show_rows, episode_rows = [], [], []
+        skipped = 0
+        for (_, media_type), metadata in items.items():
+            for item in metadata:
+                if media_type != SHOW and not media_part(item)[1].get("file"):
+                    # Nothing to play, like the database's rows of items without a media part
+                    skipped += 1
+                elif media_type == MOVIE:
+                    movie_rows.append(self.movie_row(item))
+                elif media_type == SHOW:
+                    show_rows.append(self.show_row(item))
+                else:
+                    episode_rows.append(self.episode_row(item))
+        if skipped:
+            log.debug("Skipped %d items without a media file", skipped)
+        episode_rows.sort(key=lambda row: (row["show_id"], row["season_number"], row["episode_number"]))
+        log.debug("Fetched %d movies, %d TV shows and %d episodes", len(movie_rows), len(show_rows), len(episode_rows))
+        return movie_rows, show_rows, episode_rows
+
+    @staticmethod
+    def movie_row(item: Row) -> Row:
+        media, part = media_part(item)
+        return {
+            "movie_id": int(item["ratingKey"]),
+            "title": item.get("title"),
+            "genres": genres(item),
+            "tagline": item.get("tagline"),
+            "summary": item.get("summary"),
+            "originally_available_at": timestamp(item.get("originallyAvailableAt")),
+            "file": part.get("file"),
+            "media_id": media.get("id"),
+            "duration": media.get("duration") or item.get("duration") or 0,
+        }
+
+    @staticmethod
+    def show_row(item: Row) -> Row:
+        return {
+            "show_id": int(item["ratingKey"]),
+            "show_title": item.get("title"),
+            "genres": genres(item),
+            "show_tagline": item.get("tagline"),
+            "show_summary": item.get("summary"),
+            "show_release_date": timestamp(item.get("originallyAvailableAt")),
+        }
+
+    @staticmethod
+    def episode_row(item: Row) -> Row:
+        media, part = media_part(item)
+        return {
+            "episode_id": int(item["ratingKey"]),
+            "season_id": int(item["parentRatingKey"]),
+            "show_id": int(item["grandparentRatingKey"]),
+            "episode_title": item.get("title"),
+            "episode_summary": item.get("summary"),
+            "aired_at": timestamp(item.get("originallyAvailableAt")),
+            "episode_number": int(item.get("index", 0)),
+            "season_number": int(item.get("parentIndex", 0)),
+            "episode_duration": media.get("duration") or item.get("duration"),
+            "episode_file": part.get("file"),
+        }
+
+    def close(self) -> None:
+        self.session.close()
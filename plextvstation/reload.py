@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import select
+import socket
+import subprocess
+from argparse import ArgumentParser
+from typing import Optional
+from .logging import log
+from .utils import close_fds, initial_dir
+
+ready_fd_env = "PLEXTVSTATION_READY_FD"
+ready_fd: Optional[int] = None
+listen_fd_env = "PLEXTVSTATION_LISTEN_FD"
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--reload-timeout",
+        dest="reload_timeout",
+        help="Seconds to wait for the new process to serve on SIGHUP before giving up (default: 300)",
+        default=300,
+        type=int,
+    )
+
+
+def supported() -> bool:
+    """Graceful reloads hand the listening socket to a new process, which we start with fork()."""
+    return hasattr(os, "fork")
+
+
+def take_ready_fd() -> None:
+    """Pick up the pipe of a parent that is waiting for us to serve, if any."""
+    global ready_fd
+    fd = os.environ.pop(ready_fd_env, None)
+    if fd is not None:
+        ready_fd = int(fd)
+
+
+def take_listen_socket() -> Optional[socket.socket]:
+    """Pick up the listening socket of a parent that we are replacing, if any."""
+    fd = os.environ.pop(listen_fd_env, None)
+    if fd is None:
+        return None
+    sock = socket.socket(fileno=int(fd))
+    sock.set_inheritable(False)
+    return sock
+
+
+def notify_ready() -> None:
+    """Tell the process we are replacing that we are serving requests now."""
+    if ready_fd is None:
+        return
+    try:
+        os.write(ready_fd, b"1")
+    except OSError:
+        pass
+    release_ready_fd()
+
+
+def release_ready_fd() -> None:
+    global ready_fd
+    if ready_fd is not None:
+        os.close(ready_fd)
+        ready_fd = None
+
+
+def spawn_replacement(ready_fd: int, listen_fd: int) -> None:
+    """Start a new instance of ourselves that is not our child, serving on our listening socket.
+
+    The new process is double forked, so it survives us killing our children on exit.
+    """
+    python_args = []
+    if not getattr(sys, "frozen", False):
+        python_args = subprocess._args_from_interpreter_flags()  # type: ignore
+    main_spec = getattr(sys.modules["__main__"], "__spec__", None)
+    if main_spec is not None and main_spec.name.endswith(".__main__"):
+        # Started with python -m, running __main__.py directly would break our imports
+        args = [sys.executable, *python_args, "-m", main_spec.name.removesuffix(".__main__"), *sys.argv[1:]]
+    else:
+        args = [sys.executable, *python_args, *sys.argv]
+
+    pid = os.fork()
+    if pid > 0:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork() > 0:
+            os._exit(0)
+        close_fds(keep=[ready_fd, listen_fd])
+        for fd in (ready_fd, listen_fd):
+            os.set_inheritable(fd, True)
+        os.environ[ready_fd_env] = str(ready_fd)
+        os.environ[listen_fd_env] = str(listen_fd)
+        os.chdir(initial_dir)
+        os.execv(sys.executable, args)
+    finally:
+        os._exit(1)
+
+
+def graceful_reload(listen_socket: socket.socket, timeout: int = 300) -> bool:
+    """Start a new process and wait until it serves requests on `listen_socket`.
+
+    Returns True once the new process is ready, after which the caller should stop
+    accepting requests, finish the ones in flight and exit. Returns False if the new
+    process did not come up, in which case we keep serving.
+    """
+    log.info("Reloading - starting a new process")
+    read_fd, write_fd = os.pipe()
+    try:
+        spawn_replacement(write_fd, listen_socket.fileno())
+    finally:
+        os.close(write_fd)
+
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                readable, _, _ = select.select([read_fd], [], [], remaining)
+            except InterruptedError:
+                continue
+            if readable:
+                # EOF means the new process exited before it was ready
+                if os.read(read_fd, 1) == b"1":
+                    log.info("New process is serving - draining requests and exiting")
+                    return True
+                break
+    finally:
+        os.close(read_fd)
+    log.error("New process failed to start - continuing to serve")
+    return False
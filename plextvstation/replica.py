@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import threading
+from argparse import ArgumentParser
+from typing import Optional, Callable, Tuple
+from prometheus_client import Gauge, Counter
+from .config import Config
+from .logging import log
+from .station import Network, network_path, reload_network, save_network
+
+try:
+    import fcntl
+except ImportError:
+    pass
+
+metric_replica_leader = Gauge("plextvstation_replica_leader", "Whether this replica writes the network")
+metric_network_reloads = Counter("plextvstation_network_reloads", "Networks reloaded after another replica saved")
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--replica",
+        dest="replica",
+        help="Share the working directory with other replicas, of which only the leader writes the network",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--replica-poll",
+        dest="replica_poll",
+        help="Seconds between checks for a changed network file and a free leader lock (default: 5)",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--replica-extend-interval",
+        dest="replica_extend_interval",
+        help="Seconds between the leader extending all schedules up to --days from now (default: 3600)",
+        default=3600.0,
+        type=float,
+    )
+
+
+class Replica(threading.Thread):
+    """One of several processes serving the same network from a shared conf_dir.
+
+    The process holding the leader lock file is the only one that writes: it extends the
+    schedules every `extend_interval` and saves the network. All others serve the network
+    as last saved, and poll the network file for a new generation. Polling only stats the
+    file, and reads it when its mtime, size or inode changed. If the leader goes away the
+    kernel releases its lock, and the first follower to poll next takes over.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        network: Network,
+        extend: Optional[Callable[[], None]] = None,
+        poll_interval: float = 5.0,
+        extend_interval: float = 3600.0,
+    ) -> None:
+        super().__init__()
+        self.name = "replica"
+        self.daemon = True
+        self.config = config
+        self.network = network
+        self.extend = extend
+        self.poll_interval = poll_interval
+        self.extend_interval = extend_interval
+        self.network_file = network_path(config)
+        # Unknown, so the first check compares the file with what we loaded
+        self.file_state: Optional[Tuple[int, int, int]] = None
+        self.next_extend = 0.0
+        self.lock_fd: Optional[int] = None
+        self.shutdown_event = threading.Event()
+
+    @property
+    def leader(self) -> bool:
+        return self.lock_fd is not None
+
+    def acquire(self) -> bool:
+        if self.lock_fd is not None:
+            return True
+        if sys.platform == "win32":
+            # There is no fcntl to share the lock with, so every replica writes
+            return True
+        fd = os.open(os.path.join(self.config["conf_dir"], "network.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        metric_replica_leader.set(1)
+        log.info("This replica is the leader now")
+        return True
+
+    def release(self) -> None:
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            metric_replica_leader.set(0)
+
+    def stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.network_file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def check(self) -> bool:
+        """Reload the network if its file changed since we last looked. True if a new version was published."""
+        file_state = self.stat()
+        if file_state is None or file_state == self.file_state:
+            return False
+        self.file_state = file_state
+        if reload_network(self.config, self.network) is None:
+            return False
+        metric_network_reloads.inc()
+        log.info("Reloaded the network saved by another replica")
+        return True
+
+    def poll(self) -> None:
+        # A new leader first catches up with what the previous one saved
+        self.check()
+        if not self.acquire():
+            return
+        if self.extend is not None and time.monotonic() >= self.next_extend:
+            self.extend()
+            self.next_extend = time.monotonic() + self.extend_interval
+        if self.network.snapshot().number != self.network.saved_version:
+            save_network(self.config, self.network)
+            self.file_state = self.stat()
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                log.exception("Error while polling the network")
+            if self.shutdown_event.wait(self.poll_interval):
+                break
+
+    def shutdown(self) -> None:
+        self.shutdown_event.set()
+        self.join(timeout=10)
+        if self.leader:
+            save_network(self.config, self.network)
+        self.release()
@@ -1,21 +1,103 @@
-from dataclasses import dataclass
-from typing import List, Union
-from datetime import datetime
-from .media import TVShow, Movie, MediaFile, Episode
+from __future__ import annotations
+from bisect import bisect_right
+from dataclasses import dataclass, replace
+from typing import List, Tuple, Union, Optional, Any, Protocol, Iterable
+from datetime import datetime, timedelta
+from .media import Movie, Episode
+from .types import MediaType
 
 
-@dataclass
+class MediaLibrary(Protocol):
+    def get_media(self, media_type: MediaType, media_id: int) -> Optional[Union[Episode, Movie]]:
+        ...
+
+
+@dataclass(frozen=True)
 class ScheduledProgram:
+    """A schedule entry referencing its content by id.
+
+    The content is resolved against the library on access, so pickled schedules
+    don't carry copies of the media objects (and everything they reference).
+    """
+
+    media_id: int
+    media_type: MediaType
     start_time: datetime
-    end_time: datetime
-    content: Union[Episode, Movie]
+    duration: timedelta
+
+    @property
+    def end_time(self) -> datetime:
+        return self.start_time + self.duration
+
+    def content(self, library: MediaLibrary) -> Optional[Union[Episode, Movie]]:
+        return library.get_media(self.media_type, self.media_id)
+
+    @classmethod
+    def from_content(cls, content: Union[Episode, Movie], start_time: datetime) -> ScheduledProgram:
+        media_type = MediaType.EPISODE if isinstance(content, Episode) else MediaType.MOVIE
+        return cls(content.id, media_type, start_time, content.media.duration)
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Migrate schedules pickled before programs referenced their content by id
+        if "content" in state:
+            content = state.pop("content")
+            end_time = state.pop("end_time")
+            state["media_id"] = content.id
+            state["media_type"] = MediaType.EPISODE if isinstance(content, Episode) else MediaType.MOVIE
+            state["duration"] = end_time - state["start_time"]
+        self.__dict__.update(state)
 
 
-@dataclass
+@dataclass(frozen=True)
 class StationSchedule:
+    """An immutable schedule. Changes return a new schedule with the next revision."""
+
     date: datetime
-    programs: List[ScheduledProgram]
+    programs: Tuple[ScheduledProgram, ...]
+    revision: int = 0
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.programs, tuple):
+            object.__setattr__(self, "programs", tuple(self.programs))
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        # Schedules pickled before they were immutable have a list of programs
+        state["programs"] = tuple(state["programs"])
+        self.__dict__.update(state)
+
+    def with_program(self, content: Union[Episode, Movie], start_time: datetime) -> StationSchedule:
+        return self.extended([ScheduledProgram.from_content(content, start_time)])
+
+    def extended(self, programs: Iterable[ScheduledProgram]) -> StationSchedule:
+        return replace(self, programs=self.programs + tuple(programs), revision=self.revision + 1)
+
+    def program_at(self, when: datetime) -> Optional[ScheduledProgram]:
+        """Return the program airing at the given time. Programs are expected to be sorted by start time."""
+        idx = bisect_right(self.programs, when, key=lambda p: p.start_time) - 1
+        if idx < 0:
+            return None
+        program = self.programs[idx]
+        if program.end_time <= when:
+            return None
+        return program
+
+    def programs_between(self, start: datetime, end: datetime) -> List[ScheduledProgram]:
+        """Return all programs airing at any time in [start, end)."""
+        idx = max(bisect_right(self.programs, start, key=lambda p: p.start_time) - 1, 0)
+        programs = []
+        for program in self.programs[idx:]:
+            if program.start_time >= end:
+                break
+            if program.end_time > start:
+                programs.append(program)
+        return programs
 
-    def add_program(self, content: Union[Episode, Movie], start_time: datetime) -> None:
-        end_time = start_time + content.media.duration
-        self.programs.append(ScheduledProgram(start_time, end_time, content))
+    def next_boundary(self, when: datetime) -> Optional[datetime]:
+        """Return the first time after `when` at which a program starts or ends."""
+        idx = bisect_right(self.programs, when, key=lambda p: p.start_time)
+        boundary = self.programs[idx].start_time if idx < len(self.programs) else None
+        if idx > 0:
+            end_time = self.programs[idx - 1].end_time
+            if end_time > when and (boundary is None or end_time < boundary):
+                boundary = end_time
+        return boundary
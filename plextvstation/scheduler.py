@@ -0,0 +1,212 @@
+import os
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Tuple, Iterable
+from .logging import log
+from .plex import PlexDB
+from .schedule import StationSchedule, ScheduledProgram
+from .station import Network, TVStation
+from .types import MediaType
+from .utils import num_default_threads
+
+MOVIE = MediaType.MOVIE.value
+EPISODE = MediaType.EPISODE.value
+
+# (kind, media id, duration in ms)
+CompactItem = Tuple[int, int, int]
+# (lower case genres, items in airing order) - a movie or all episodes of a show
+CompactUnit = Tuple[Tuple[str, ...], Tuple[CompactItem, ...]]
+# (kind, media id, start timestamp, duration in ms)
+CompactProgram = Tuple[int, int, float, int]
+# (station name, tags, start timestamp, end timestamp, seed)
+StationTask = Tuple[str, Tuple[str, ...], float, float, str]
+
+
+def compact_library(plexdb: PlexDB) -> List[CompactUnit]:
+    """Reduce the library to what schedule generation needs: ids, durations and genres."""
+    units: List[CompactUnit] = []
+    for movie in plexdb.movies:
+        duration = int(movie.media.duration.total_seconds() * 1000)
+        if duration > 0:
+            units.append((normalize_genres(movie.genres), ((MOVIE, movie.id, duration),)))
+    episodes: dict[int, List[CompactItem]] = {}
+    for episode in plexdb.episode_records():
+        if episode.duration > 0:
+            episodes.setdefault(episode.show_id, []).append((EPISODE, episode.id, episode.duration))
+    for tv_show in plexdb.tv_shows:
+        items = tuple(episodes.get(tv_show.id, ()))
+        if items:
+            units.append((normalize_genres(tv_show.genres), items))
+    return units
+
+
+def normalize_genres(genres: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(sorted({genre.strip().lower() for genre in genres if genre.strip()}))
+
+
+class ProgramGenerator:
+    """Fills a time range with programs from the compact library.
+
+    Content is picked by matching station tags against genres. Shows air their episodes in
+    order. The random number generator is seeded per station, so a station's schedule only
+    depends on the seed and the library, not on which worker process generated it.
+    """
+
+    def __init__(self, units: List[CompactUnit]) -> None:
+        self.units = units
+        self.genre_index: dict[str, List[int]] = {}
+        for idx, (genres, _) in enumerate(units):
+            for genre in genres:
+                self.genre_index.setdefault(genre, []).append(idx)
+
+    def eligible(self, tags: Iterable[str]) -> List[int]:
+        wanted = normalize_genres(tags)
+        if not wanted:
+            return list(range(len(self.units)))
+        eligible: set[int] = set()
+        for tag in wanted:
+            eligible.update(self.genre_index.get(tag, []))
+        return sorted(eligible)
+
+    def generate(self, task: StationTask) -> Tuple[str, List[CompactProgram]]:
+        station_name, tags, start, end, seed = task
+        rng = random.Random(seed)
+        eligible = self.eligible(tags)
+        cursors: dict[int, int] = {}
+        programs: List[CompactProgram] = []
+        if not eligible:
+            return station_name, programs
+
+        t = start
+        while t < end:
+            unit_idx = eligible[rng.randrange(len(eligible))]
+            items = self.units[unit_idx][1]
+            cursor = cursors.get(unit_idx, 0)
+            cursors[unit_idx] = cursor + 1
+            kind, media_id, duration = items[cursor % len(items)]
+            programs.append((kind, media_id, t, duration))
+            t += duration / 1000
+        return station_name, programs
+
+
+_generator: Optional[ProgramGenerator] = None
+
+
+def _init_worker(units: List[CompactUnit]) -> None:
+    global _generator
+    _generator = ProgramGenerator(units)
+
+
+def _generate(task: StationTask) -> Tuple[str, List[CompactProgram]]:
+    assert _generator is not None
+    return _generator.generate(task)
+
+
+def station_seed(seed: int, station: TVStation) -> str:
+    return f"{seed}:{station.name}"
+
+
+def station_tasks(stations: List[TVStation], start: datetime, end: datetime, seed: int) -> List[StationTask]:
+    return [
+        (station.name, tuple(station.tags or []), start.timestamp(), end.timestamp(), station_seed(seed, station))
+        for station in stations
+    ]
+
+
+def generate_compact_schedules(
+    units: List[CompactUnit], tasks: List[StationTask], workers: Optional[int] = None
+) -> List[Tuple[str, List[CompactProgram]]]:
+    if workers is None:
+        workers = num_default_threads()
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        generator = ProgramGenerator(units)
+        return [generator.generate(task) for task in tasks]
+
+    context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(units,)
+    ) as executor:
+        return list(executor.map(_generate, tasks, chunksize=chunksize))
+
+
+def scheduled_program(program: CompactProgram) -> ScheduledProgram:
+    kind, media_id, start, duration = program
+    return ScheduledProgram(
+        media_id, MediaType(kind), datetime.fromtimestamp(start, timezone.utc), timedelta(milliseconds=duration)
+    )
+
+
+def regenerate_schedules(
+    network: Network,
+    plexdb: PlexDB,
+    start: datetime,
+    duration: timedelta,
+    seed: int = 0,
+    workers: Optional[int] = None,
+) -> None:
+    """Regenerate the schedules of all stations in the network.
+
+    Stations are generated in parallel in a process pool. Workers only receive the compact
+    library and return (kind, id, start, duration) records, which are merged back into the
+    network here.
+    """
+    end = start + duration
+    snapshot = network.snapshot()
+    log.debug("Regenerating schedules for %d stations from %s to %s", len(snapshot.stations), start, end)
+    units = compact_library(plexdb)
+    # In the order of the tasks, which is that of the stations
+    results = generate_compact_schedules(units, station_tasks(list(snapshot.stations), start, end, seed), workers)
+
+    network.replace_schedules(
+        [
+            (
+                station,
+                StationSchedule(
+                    date=start,
+                    programs=tuple(scheduled_program(program) for program in compact_programs),
+                    revision=station.schedule.revision + 1,
+                ),
+            )
+            for station, (_, compact_programs) in zip(snapshot.stations, results)
+        ]
+    )
+    log.debug("Regenerated schedules")
+
+
+def extend_schedules(
+    network: Network,
+    plexdb: PlexDB,
+    until: datetime,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    now: Optional[datetime] = None,
+) -> None:
+    """Append programs to every station's schedule up to `until`, continuing where it ends."""
+    if now is None:
+        now = datetime.now(timezone.utc)
+    snapshot = network.snapshot()
+    tasks: List[StationTask] = []
+    stations: List[TVStation] = []
+    for station in snapshot.stations:
+        programs = station.schedule.programs
+        start = max(programs[-1].end_time, now) if programs else now
+        if start < until:
+            # Seeded by the start too, so an extension doesn't repeat the station's first picks
+            task_seed = f"{station_seed(seed, station)}:{start.timestamp()}"
+            tasks.append((station.name, tuple(station.tags or []), start.timestamp(), until.timestamp(), task_seed))
+            stations.append(station)
+    log.debug("Extending schedules of %d stations until %s", len(tasks), until)
+    if not tasks:
+        return
+    units = compact_library(plexdb)
+    schedules = [
+        (station, station.schedule.extended(scheduled_program(p) for p in compact_programs))
+        for station, (_, compact_programs) in zip(stations, generate_compact_schedules(units, tasks, workers))
+        if compact_programs
+    ]
+    network.replace_schedules(schedules)
+    log.debug("Extended schedules")
@@ -0,0 +1,149 @@
+import re
+import sqlite3
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Optional, Iterable, List, Any
+from .logging import log
+from .types import MediaType
+
+token_re = re.compile(r"\w+")
+# bm25() weights for the title, tagline and summary columns
+column_weights = (3.0, 1.5, 1.0)
+
+schema = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    media_type INTEGER NOT NULL,
+    media_id INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    UNIQUE (media_type, media_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(title, tagline, summary, tokenize='porter unicode61');
+"""
+
+
+@dataclass(frozen=True)
+class SearchDocument:
+    media_type: MediaType
+    media_id: int
+    title: str
+    tagline: Optional[str] = None
+    summary: Optional[str] = None
+
+    @property
+    def digest(self) -> bytes:
+        text = "\0".join((self.title, self.tagline or "", self.summary or ""))
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    media_type: MediaType
+    media_id: int
+    title: str
+    score: float
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Turn free text into an FTS5 query matching any of the words. Never lets FTS5 syntax through."""
+    tokens = token_re.findall(query.lower())
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in dict.fromkeys(tokens))
+
+
+class SearchIndex:
+    """Full-text index over titles, taglines and summaries backed by SQLite FTS5.
+
+    Results are ranked with bm25, weighting title matches over tagline and summary matches.
+    Each document's text digest is stored along with it, and `update()` only re-indexes
+    documents that were added, changed or removed. When the index lives in `tmp_dir` this
+    also holds across restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        if path is None:
+            self.uri = f"file:plextvstation-search-{id(self)}?mode=memory&cache=shared"
+        else:
+            self.uri = f"file:{path}"
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        # Keeps a shared in-memory database alive for as long as the index exists
+        self.conn = self.connection()
+        with self.conn:
+            self.conn.executescript(schema)
+
+    def connection(self) -> sqlite3.Connection:
+        conn: Optional[sqlite3.Connection] = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            if "mode=memory" not in self.uri:
+                conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        count: int = self.connection().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return count
+
+    def update(self, documents: Iterable[SearchDocument]) -> None:
+        """Bring the index in line with `documents`, touching only what changed."""
+        with self.write_lock:
+            conn = self.connection()
+            existing: dict[tuple[int, int], tuple[int, bytes]] = {
+                (media_type, media_id): (rowid, digest)
+                for rowid, media_type, media_id, digest in conn.execute(
+                    "SELECT id, media_type, media_id, digest FROM documents"
+                )
+            }
+            next_id: int = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM documents").fetchone()[0]
+            stale: List[tuple[int]] = []
+            new_documents: List[tuple[Any, ...]] = []
+            new_text: List[tuple[Any, ...]] = []
+            seen = set()
+            for document in documents:
+                key = (document.media_type.value, document.media_id)
+                seen.add(key)
+                digest = document.digest
+                current = existing.get(key)
+                if current is not None:
+                    if current[1] == digest:
+                        continue
+                    stale.append((current[0],))
+                new_documents.append((next_id, *key, document.title, digest))
+                new_text.append((next_id, document.title, document.tagline or "", document.summary or ""))
+                next_id += 1
+            stale.extend((rowid,) for key, (rowid, _) in existing.items() if key not in seen)
+
+            with conn:
+                conn.executemany("DELETE FROM documents WHERE id = ?", stale)
+                conn.executemany("DELETE FROM search WHERE rowid = ?", stale)
+                conn.executemany(
+                    "INSERT INTO documents (id, media_type, media_id, title, digest) VALUES (?, ?, ?, ?, ?)",
+                    new_documents,
+                )
+                conn.executemany("INSERT INTO search (rowid, title, tagline, summary) VALUES (?, ?, ?, ?)", new_text)
+            log.debug("Search index updated: %d documents indexed, %d removed", len(new_documents), len(stale))
+
+    def search(self, query: str, limit: int = 20, media_type: Optional[MediaType] = None) -> List[SearchResult]:
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        sql = f"""
+        SELECT d.media_type, d.media_id, d.title, bm25(search, {", ".join(map(str, column_weights))}) AS score
+        FROM search
+        JOIN documents AS d ON d.id = search.rowid
+        WHERE search MATCH ?
+        """
+        params: List[Any] = [expression]
+        if media_type is not None:
+            sql += " AND d.media_type = ?"
+            params.append(media_type.value)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        return [
+            SearchResult(MediaType(media_type), media_id, title, -score)
+            for media_type, media_id, title, score in self.connection().execute(sql, params)
+        ]
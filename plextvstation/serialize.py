@@ -0,0 +1,130 @@
+import json
+from dataclasses import fields, is_dataclass
+from datetime import datetime, timedelta
+from enum import Enum
+from operator import attrgetter
+from typing import Any, Callable, Optional, Tuple, Dict, List
+from .media import Episode
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# A field is either dropped (None) or emitted under a new name after applying a projection
+Projection = Optional[Tuple[str, Callable[[Any], Any]]]
+Encoder = Callable[[Any, int], Any]
+
+primitive_types = frozenset((str, int, float, bool, type(None)))
+
+
+def reference(obj: Any) -> Any:
+    """Project a referenced object to its id."""
+    return None if obj is None else obj.id
+
+
+library_rules: Dict[type, Dict[str, Projection]] = {
+    Episode: {
+        "season": ("season", lambda season: season.number),
+        "tv_show": ("tv_show_id", reference),
+    },
+}
+
+
+class Serializer:
+    """Turns dataclass object graphs into JSON compatible data.
+
+    An encoder is compiled once per class, with the field accessors and projection rules resolved
+    up front. Rules say how to emit a field instead of recursing into it, e.g. an episode emits its
+    show's id, not the show. That is what breaks the cycles in the media model. As a safety net,
+    dataclasses nested deeper than `max_depth` are emitted as their id.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[type, Dict[str, Projection]]] = None,
+        max_depth: int = 8,
+        native_datetimes: bool = False,
+    ) -> None:
+        self.rules = library_rules if rules is None else rules
+        self.max_depth = max_depth
+        self.native_datetimes = native_datetimes
+        self.encoders: Dict[type, Encoder] = {}
+
+    def encode(self, value: Any, depth: int = 0) -> Any:
+        cls = type(value)
+        if cls in primitive_types:
+            return value
+        encoder = self.encoders.get(cls)
+        if encoder is None:
+            encoder = self.encoders[cls] = self.compile(cls)
+        return encoder(value, depth)
+
+    def compile(self, cls: type) -> Encoder:
+        if is_dataclass(cls):
+            return self.compile_dataclass(cls)
+        encode = self.encode
+        if issubclass(cls, Enum):
+            return lambda value, depth: encode(value.value, depth)
+        if issubclass(cls, datetime):
+            if self.native_datetimes:
+                return lambda value, depth: value
+            return lambda value, depth: value.isoformat()
+        if issubclass(cls, timedelta):
+            return lambda value, depth: value.total_seconds()
+        if issubclass(cls, (list, tuple, set, frozenset)):
+            return lambda value, depth: [encode(item, depth) for item in value]
+        if issubclass(cls, dict):
+            return lambda value, depth: {str(key): encode(item, depth) for key, item in value.items()}
+        return lambda value, depth: str(value)
+
+    def class_rules(self, cls: type) -> Dict[str, Projection]:
+        rules: Dict[str, Projection] = {}
+        for base in reversed(cls.__mro__):
+            rules.update(self.rules.get(base, {}))
+        return rules
+
+    def compile_dataclass(self, cls: type) -> Encoder:
+        rules = self.class_rules(cls)
+        plan: List[Tuple[str, Callable[[Any], Any], Optional[Callable[[Any], Any]]]] = []
+        for field in fields(cls):
+            if field.name not in rules:
+                plan.append((field.name, attrgetter(field.name), None))
+                continue
+            rule = rules[field.name]
+            if rule is not None:
+                name, project = rule
+                plan.append((name, attrgetter(field.name), project))
+
+        encode = self.encode
+        max_depth = self.max_depth
+
+        def encode_dataclass(obj: Any, depth: int) -> Any:
+            if depth >= max_depth:
+                return getattr(obj, "id", None)
+            depth += 1
+            result = {}
+            for name, get, project in plan:
+                value = get(obj)
+                if project is not None:
+                    value = project(value)
+                result[name] = value if type(value) in primitive_types else encode(value, depth)
+            return result
+
+        return encode_dataclass
+
+    def dumps(self, obj: Any, format: str = "json") -> bytes:
+        data = self.encode(obj)
+        if format == "json":
+            return json.dumps(data, separators=(",", ":")).encode()
+        if format == "msgpack":
+            if msgpack is None:
+                raise ValueError("msgpack output requires the msgpack package")
+            result: bytes = msgpack.packb(data)
+            return result
+        raise ValueError(f"Unknown format {format}")
+
+
+serializer = Serializer()
+# Tables show datetimes as they are
+html_serializer = Serializer(native_datetimes=True)
@@ -0,0 +1,184 @@
+import os
+import glob
+import math
+from dataclasses import dataclass
+from typing import Optional, List, Tuple, Iterable, Sequence, Any
+from .logging import log
+from .search import token_re
+from .types import MediaType
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None  # type: ignore
+    sparse = None
+
+stopwords = frozenset(
+    "a about after an and are as at be been but by can for from has have he her his how in into is it its of on"
+    " one or out she so than that the their them they this to two up was were what when who will with".split()
+)
+
+MediaKey = Tuple[MediaType, int]
+
+
+def available() -> bool:
+    return np is not None and sparse is not None
+
+
+@dataclass(frozen=True)
+class SimilarityItem:
+    media_type: MediaType
+    media_id: int
+    text: str
+    genres: Tuple[str, ...]
+
+    @property
+    def key(self) -> MediaKey:
+        return self.media_type, self.media_id
+
+
+class SimilarityEngine:
+    """Content similarity over the library using TF-IDF vectors of summaries plus genres.
+
+    Every item is a row in a sparse, L2 normalised matrix. Dot products between rows are
+    cosine similarities, so "more like this" is one sparse matrix-vector product and
+    clustering is spherical k-means with one matrix product per iteration.
+    """
+
+    def __init__(self, keys: List[MediaKey], matrix: Any) -> None:
+        self.keys = keys
+        self.matrix = matrix
+        self.rows = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, items: Sequence[SimilarityItem], genre_weight: float = 1.0, min_df: int = 2) -> "SimilarityEngine":
+        log.debug("Building similarity matrix for %d items", len(items))
+        documents = [[t for t in token_re.findall(item.text.lower()) if t not in stopwords] for item in items]
+        document_frequency: dict[str, int] = {}
+        for tokens in documents:
+            for token in set(tokens):
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        vocabulary = {
+            token: idx for idx, token in enumerate(sorted(t for t, df in document_frequency.items() if df >= min_df))
+        }
+        genres = {
+            genre: len(vocabulary) + idx for idx, genre in enumerate(sorted({g for i in items for g in i.genres}))
+        }
+        num_items = len(items)
+        idf = {t: math.log((1 + num_items) / (1 + document_frequency[t])) + 1 for t in vocabulary}
+
+        rows: List[int] = []
+        cols: List[int] = []
+        data: List[float] = []
+        for row, (item, tokens) in enumerate(zip(items, documents)):
+            counts: dict[str, int] = {}
+            for token in tokens:
+                if token in vocabulary:
+                    counts[token] = counts.get(token, 0) + 1
+            text_values = [count * idf[token] for token, count in counts.items()]
+            norm = math.sqrt(sum(v * v for v in text_values)) or 1.0
+            for token, value in zip(counts, text_values):
+                rows.append(row)
+                cols.append(vocabulary[token])
+                data.append(value / norm)
+            for genre in item.genres:
+                rows.append(row)
+                cols.append(genres[genre])
+                data.append(genre_weight / math.sqrt(len(item.genres)))
+
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), (rows, cols)), shape=(num_items, len(vocabulary) + len(genres))
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        matrix = sparse.diags(1 / norms).dot(matrix).tocsr().astype(np.float32)
+        return cls([item.key for item in items], matrix)
+
+    def save(self, path: str) -> None:
+        log.debug("Saving similarity matrix to %s", path)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            shape=np.array(self.matrix.shape),
+            keys=np.array([(media_type.value, media_id) for media_type, media_id in self.keys], dtype=np.int64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityEngine":
+        log.debug("Loading similarity matrix from %s", path)
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            keys = [(MediaType(int(media_type)), int(media_id)) for media_type, media_id in f["keys"]]
+        return cls(keys, matrix)
+
+    @classmethod
+    def load_or_build(cls, items: Sequence[SimilarityItem], generation: str, cache_dir: str) -> "SimilarityEngine":
+        """Load the matrix for this library generation from `cache_dir`, building it if there is none."""
+        path = os.path.join(cache_dir, f"similarity-{generation}.npz")
+        if os.path.isfile(path):
+            try:
+                return cls.load(path)
+            except Exception:
+                log.exception("Failed to load %s - rebuilding", path)
+        engine = cls.build(items)
+        for old_path in glob.glob(os.path.join(cache_dir, "similarity-*.npz")):
+            os.remove(old_path)
+        engine.save(path)
+        return engine
+
+    def similar(self, keys: Iterable[MediaKey], limit: int = 20) -> List[Tuple[MediaKey, float]]:
+        """Items most similar to the centroid of `keys`, excluding `keys` themselves."""
+        rows = [self.rows[key] for key in keys if key in self.rows]
+        if not rows:
+            return []
+        query = np.asarray(self.matrix[rows].mean(axis=0)).ravel()
+        scores = self.matrix.dot(query)
+        scores[rows] = -np.inf
+        limit = min(limit, len(scores) - len(rows))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [(self.keys[row], float(scores[row])) for row in best]
+
+    def cluster(
+        self, num_clusters: int, keys: Optional[Iterable[MediaKey]] = None, iterations: int = 20, seed: int = 0
+    ) -> List[List[MediaKey]]:
+        """Split items into `num_clusters` groups of similar content with spherical k-means."""
+        rows = np.arange(len(self.keys)) if keys is None else np.array([self.rows[k] for k in keys if k in self.rows])
+        if len(rows) == 0:
+            return []
+        num_clusters = min(num_clusters, len(rows))
+        matrix = self.matrix[rows]
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(len(rows), num_clusters, replace=False)].toarray()
+        assignment = np.zeros(len(rows), dtype=np.int64)
+        for iteration in range(iterations):
+            new_assignment = np.asarray(matrix.dot(centroids.T)).argmax(axis=1)
+            if iteration > 0 and np.array_equal(new_assignment, assignment):
+                break
+            assignment = new_assignment
+            membership = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float32), (assignment, np.arange(len(rows)))),
+                shape=(num_clusters, len(rows)),
+            )
+            sums = np.asarray(membership.dot(matrix).todense())
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            # Keep the previous centroid for clusters that lost all their members
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = sums / norms[:, None]
+
+        clusters: List[List[MediaKey]] = [[] for _ in range(num_clusters)]
+        for row, cluster in zip(rows, assignment):
+            clusters[cluster].append(self.keys[row])
+        return clusters
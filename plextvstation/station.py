@@ -1,15 +1,16 @@
 import os
 import pickle
 import hashlib
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field, replace
 from datetime import timezone
-from typing import Optional
+from typing import Optional, Tuple, Iterable, Callable, Mapping, Sequence
 from .schedule import StationSchedule
 from .logging import log
 from .config import Config
 
 
-@dataclass
+@dataclass(frozen=True)
 class TVStation:
     name: str
     description: Optional[str]
@@ -21,21 +22,106 @@ class TVStation:
     timezone: timezone = timezone.utc
 
 
-@dataclass
+@dataclass(frozen=True)
+class NetworkVersion:
+    """One consistent state of all stations. Never changes once published."""
+
+    number: int
+    stations: Tuple[TVStation, ...]
+    by_name: dict[str, TVStation] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "by_name", {station.name: station for station in reversed(self.stations)})
+
+    def get_station(self, name: str) -> Optional[TVStation]:
+        return self.by_name.get(name)
+
+
 class Network:
-    name: str
-    stations: list[TVStation]
-    last_save_sha: Optional[str] = None
+    """The stations of the network, as a series of immutable versions.
 
+    Readers take a `snapshot()` and see the same stations for as long as they hold on to it,
+    without locking. Writers build new stations with `dataclasses.replace` and publish them
+    as the next version; stations they didn't change are shared with the previous one.
+    Writers are serialized with a lock, so read-modify-write through `update()` is safe.
+    """
 
-def load_network(config: Config) -> Network:
-    conf_dir = config["conf_dir"]
-    network_name = config["network"]
-    network_file = os.path.join(conf_dir, "network.db")
-    log.debug(f"Loading network from {network_file}")
-    if not os.path.exists(network_file):
-        log.warning(f"Network file not found: {network_file} - initializing new network")
-        return Network(network_name, [])
+    def __init__(self, name: str, stations: Iterable[TVStation], last_save_sha: Optional[str] = None) -> None:
+        self.name = name
+        self.current = NetworkVersion(0, tuple(stations))
+        self.last_save_sha = last_save_sha
+        self.saved_version: Optional[int] = 0 if last_save_sha is not None else None
+        self.write_lock = threading.Lock()
+
+    def snapshot(self) -> NetworkVersion:
+        return self.current
+
+    @property
+    def stations(self) -> Tuple[TVStation, ...]:
+        return self.current.stations
+
+    def get_station(self, name: str) -> Optional[TVStation]:
+        return self.current.get_station(name)
+
+    def publish(self, stations: Iterable[TVStation]) -> NetworkVersion:
+        with self.write_lock:
+            return self._publish(stations)
+
+    def _publish(self, stations: Iterable[TVStation]) -> NetworkVersion:
+        # A single reference assignment, which readers see entirely or not at all
+        self.current = NetworkVersion(self.current.number + 1, tuple(stations))
+        return self.current
+
+    def update(self, change: Callable[[NetworkVersion], Iterable[TVStation]]) -> NetworkVersion:
+        """Publish the stations `change` returns for the current version."""
+        with self.write_lock:
+            return self._publish(change(self.current))
+
+    def update_schedules(
+        self, schedules: Mapping[str, StationSchedule], since: Optional[NetworkVersion] = None
+    ) -> NetworkVersion:
+        """Replace the schedules of the named stations.
+
+        With `since`, the version the new schedules were built from, schedules that another
+        writer changed in the meantime are kept.
+        """
+
+        def change(version: NetworkVersion) -> Iterable[TVStation]:
+            for station in version.stations:
+                schedule = schedules.get(station.name)
+                if schedule is not None and since is not None:
+                    base = since.get_station(station.name)
+                    if base is not None and base.schedule is not station.schedule:
+                        log.debug("Schedule of %s changed while building a new one, keeping it", station.name)
+                        schedule = None
+                yield station if schedule is None else replace(station, schedule=schedule)
+
+        return self.update(change)
+
+    def replace_schedules(self, schedules: Sequence[Tuple[TVStation, StationSchedule]]) -> NetworkVersion:
+        """Give stations taken from an earlier version a new schedule.
+
+        Stations are matched by identity rather than by name, so stations that share a name
+        each get their own schedule. Stations that another writer replaced in the meantime
+        keep that change.
+        """
+        # `schedules` keeps the stations alive, so their ids can't be reused meanwhile
+        by_station = {id(station): schedule for station, schedule in schedules}
+
+        def change(version: NetworkVersion) -> Iterable[TVStation]:
+            for station in version.stations:
+                schedule = by_station.get(id(station))
+                yield station if schedule is None else replace(station, schedule=schedule)
+
+        return self.update(change)
+
+
+def network_path(config: Config) -> str:
+    return os.path.join(config["conf_dir"], "network.db")
+
+
+def read_network_file(network_file: str) -> Tuple[list[TVStation], str]:
+    """The stations in `network_file` and the sha256 of its content."""
     with open(network_file, "rb") as f:
         pickled_stations = f.read()
     stations = pickle.loads(pickled_stations)
@@ -43,16 +129,48 @@ def load_network(config: Config) -> Network:
         raise Exception(f"Invalid network file: {network_file}")
     sha256 = hashlib.sha256()
     sha256.update(pickled_stations)
-    network = Network(network_name, stations, sha256.hexdigest())
+    return stations, sha256.hexdigest()
+
+
+def load_network(config: Config) -> Network:
+    network_name = config["network"]
+    network_file = network_path(config)
+    log.debug("Loading network from %s", network_file)
+    if not os.path.exists(network_file):
+        log.warning("Network file not found: %s - initializing new network", network_file)
+        return Network(network_name, [])
+    stations, sha = read_network_file(network_file)
+    network = Network(network_name, stations, sha)
     return network
 
 
+def reload_network(config: Config, network: Network) -> Optional[NetworkVersion]:
+    """Publish the stations of the network file if another process saved different ones."""
+    network_file = network_path(config)
+    try:
+        stations, sha = read_network_file(network_file)
+    except FileNotFoundError:
+        # In between the renames of a save
+        return None
+    if sha == network.last_save_sha:
+        return None
+    log.debug("Reloading network from %s", network_file)
+    with network.write_lock:
+        version = network._publish(stations)
+        network.last_save_sha = sha
+        network.saved_version = version.number
+    return version
+
+
 def save_network(config: Config, network: Network) -> None:
-    conf_dir = config["conf_dir"]
-    network_file = os.path.join(conf_dir, "network.db")
+    network_file = network_path(config)
     tmp_network_file = f"{network_file}.tmp"
     backup_file = f"{network_file}.bak"
-    pickled_stations = pickle.dumps(network.stations)
+    snapshot = network.snapshot()
+    if snapshot.number == network.saved_version:
+        log.debug("No changes to network, skipping save")
+        return
+    pickled_stations = pickle.dumps(list(snapshot.stations))
 
     sha256 = hashlib.sha256()
     sha256.update(pickled_stations)
@@ -60,14 +178,16 @@ def save_network(config: Config, network: Network) -> None:
 
     if hash == network.last_save_sha:
         log.debug("No changes to network, skipping save")
+        network.saved_version = snapshot.number
         return
 
-    network.last_save_sha = hash
-
-    log.debug(f"Saving network to {network_file}")
+    log.debug("Saving network to %s", network_file)
     with open(tmp_network_file, "wb") as f:
         f.write(pickled_stations)
     if os.path.exists(network_file):
-        log.debug(f"Backing up existing stations file to {backup_file}")
+        log.debug("Backing up existing stations file to %s", backup_file)
         os.rename(network_file, backup_file)
     os.rename(tmp_network_file, network_file)
+    # Only now that it is on disk, so a failed save is tried again next time
+    network.last_save_sha = hash
+    network.saved_version = snapshot.number
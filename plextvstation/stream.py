@@ -0,0 +1,369 @@
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+import psutil
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from signal import SIGTERM
+from typing import Optional, List
+from prometheus_client import Gauge, Counter
+from .logging import log, rate_limit
+from .schedule import ScheduledProgram, MediaLibrary
+from .station import Network, TVStation
+from .utils import kill_children
+
+try:
+    import fcntl
+except ImportError:
+    pass
+
+metric_active_streams = Gauge("plextvstation_active_streams", "Number of stations currently being encoded")
+metric_stream_viewers = Gauge("plextvstation_stream_viewers", "Number of active stream viewers")
+metric_stream_starts = Counter("plextvstation_stream_starts", "Number of ffmpeg processes started")
+
+# Checked on every playlist request of an idle station
+stream_log = rate_limit(log.getChild("stream"), rate=1, burst=10)
+
+valid_segment_name = re.compile(r"^[0-9]+-[0-9]+\.ts$")
+playlist_name = "index.m3u8"
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--ffmpeg",
+        dest="ffmpeg",
+        help="Path to the ffmpeg binary (default: ffmpeg)",
+        default="ffmpeg",
+    )
+    parser.add_argument(
+        "--stream-idle-timeout",
+        dest="stream_idle_timeout",
+        help="Seconds without viewer requests after which a station stream is stopped (default: 30)",
+        default=30,
+        type=int,
+    )
+    parser.add_argument(
+        "--stream-segment-duration",
+        dest="stream_segment_duration",
+        help="HLS segment duration in seconds (default: 6)",
+        default=6,
+        type=int,
+    )
+
+
+class StationStream:
+    """A live HLS output for a single station.
+
+    One ffmpeg process is run per station and per scheduled program. The process is seeked to
+    the current offset into the program and writes segments into the station's stream directory.
+    When the program ends ffmpeg exits and the next program is appended to the same playlist.
+
+    When several worker processes serve the same network, the process holding the station's
+    lock file owns the ffmpeg process. All others only serve the files and refresh the shared
+    heartbeat file, so the owner knows the station is still being watched.
+
+    An ffmpeg that fails is restarted after `retry_delay`, doubled for every failure in a row
+    up to `max_retry_delay`, so a broken file or encoder isn't respawned every second.
+    """
+
+    retry_delay = 1.0
+    max_retry_delay = 60.0
+
+    def __init__(
+        self, station: TVStation, library: MediaLibrary, stream_dir: str, ffmpeg: str, segment_duration: int
+    ) -> None:
+        self.station = station
+        self.library = library
+        self.stream_dir = stream_dir
+        self.ffmpeg = ffmpeg
+        self.segment_duration = segment_duration
+        self.viewers: dict[str, float] = {}
+        self.process: Optional[subprocess.Popen[bytes]] = None
+        self.program: Optional[ScheduledProgram] = None
+        self.sequence = 0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+        self.lock_fd: Optional[int] = None
+
+    @property
+    def playlist(self) -> str:
+        return os.path.join(self.stream_dir, playlist_name)
+
+    @property
+    def heartbeat(self) -> str:
+        return f"{self.stream_dir}.heartbeat"
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def owner(self) -> bool:
+        return self.lock_fd is not None
+
+    def seen(self, viewer: str) -> None:
+        self.viewers[viewer] = time.monotonic()
+        try:
+            os.utime(self.heartbeat)
+        except FileNotFoundError:
+            open(self.heartbeat, "a").close()
+
+    def expire_viewers(self, idle_timeout: int) -> int:
+        cutoff = time.monotonic() - idle_timeout
+        for viewer, last_seen in list(self.viewers.items()):
+            if last_seen < cutoff:
+                del self.viewers[viewer]
+        return len(self.viewers)
+
+    def watched_elsewhere(self, idle_timeout: int) -> bool:
+        try:
+            return time.time() - os.path.getmtime(self.heartbeat) < idle_timeout
+        except OSError:
+            return False
+
+    def acquire(self) -> bool:
+        """Try to become the process that runs ffmpeg for this station."""
+        if self.lock_fd is not None:
+            return True
+        if sys.platform == "win32":
+            return True
+        fd = os.open(f"{self.stream_dir}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def release(self) -> None:
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    def ensure_running(self, now: Optional[datetime] = None) -> bool:
+        with self.lock:
+            if self.running:
+                return True
+            if not self.acquire():
+                # Another worker process is encoding this station
+                return True
+            if self.process is not None:
+                self.exited(self.process.returncode)
+            if time.monotonic() < self.retry_at:
+                return False
+            if now is None:
+                now = datetime.now(timezone.utc)
+            program = self.station.schedule.program_at(now)
+            if program is None:
+                stream_log.debug("Nothing scheduled on %s at %s", self.station.name, now)
+                return False
+            self.program = program
+            self.process = self._start(program, now - program.start_time)
+            if self.process is None:
+                self.exited(None)
+            return self.process is not None
+
+    def exited(self, returncode: Optional[int]) -> None:
+        """Account for the end of the last ffmpeg process, None if it couldn't be started at all."""
+        self.process = None
+        if returncode == 0:
+            # The program ended
+            self.failures = 0
+            return
+        self.failures += 1
+        delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+        self.retry_at = time.monotonic() + delay
+        log.warning(
+            "Stream for %s failed %d times in a row (exit code %s), retrying in %.0fs",
+            self.station.name,
+            self.failures,
+            returncode,
+            delay,
+        )
+
+    def ffmpeg_args(self, file: str, offset_seconds: float) -> List[str]:
+        self.sequence = max(self.sequence + 1, int(time.time()))
+        segment_file = os.path.join(self.stream_dir, f"{self.sequence}-%05d.ts")
+        return [
+            self.ffmpeg,
+            "-hide_banner",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            "-ss",
+            f"{offset_seconds:.3f}",
+            "-re",
+            "-i",
+            file,
+            "-map",
+            "0:v:0",
+            "-map",
+            "0:a:0?",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-c:a",
+            "aac",
+            "-f",
+            "hls",
+            "-hls_time",
+            str(self.segment_duration),
+            "-hls_list_size",
+            "10",
+            "-hls_flags",
+            "delete_segments+append_list+omit_endlist+discont_start+program_date_time",
+            "-hls_segment_filename",
+            segment_file,
+            self.playlist,
+        ]
+
+    def _start(self, program: ScheduledProgram, offset: timedelta) -> Optional[subprocess.Popen[bytes]]:
+        content = program.content(self.library)
+        if content is None:
+            log.error(
+                "Content %s %s on %s not in library", program.media_type.name, program.media_id, self.station.name
+            )
+            return None
+        os.makedirs(self.stream_dir, exist_ok=True)
+        args = self.ffmpeg_args(content.media.file, max(offset.total_seconds(), 0.0))
+        log.debug("Starting stream for %s: %s", self.station.name, " ".join(args))
+        try:
+            process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        except OSError as e:
+            log.error("Failed to start ffmpeg for %s: %s", self.station.name, e)
+            return None
+        metric_stream_starts.inc()
+        return process
+
+    def stop(self) -> None:
+        with self.lock:
+            try:
+                if self.process is not None and self.process.poll() is None:
+                    log.debug("Stopping stream for %s", self.station.name)
+                    try:
+                        kill_children(SIGTERM, ensure_death=True, process_pid=self.process.pid)
+                    except psutil.NoSuchProcess:
+                        # It exited since we polled it
+                        pass
+                    self.process.terminate()
+                    try:
+                        self.process.wait(timeout=3)
+                    except subprocess.TimeoutExpired:
+                        self.process.kill()
+                        self.process.wait()
+            finally:
+                self.process = None
+                self.program = None
+                self.viewers.clear()
+                if self.owner:
+                    shutil.rmtree(self.stream_dir, ignore_errors=True)
+                    self.release()
+
+
+class StreamManager(threading.Thread):
+    """Starts station streams on demand and reaps them once their last viewer is gone.
+
+    Viewers are identified by the client requesting the playlist and segments. HLS is plain HTTP,
+    so a viewer counts as connected for as long as it keeps requesting within `idle_timeout`.
+    Only stations that are being watched have an ffmpeg process.
+    """
+
+    def __init__(
+        self,
+        network: Network,
+        library: MediaLibrary,
+        tmp_dir: str,
+        ffmpeg: str = "ffmpeg",
+        idle_timeout: int = 30,
+        segment_duration: int = 6,
+    ) -> None:
+        super().__init__()
+        self.name = "streammanager"
+        self.daemon = True
+        self.network = network
+        self.library = library
+        self.stream_dir = os.path.join(tmp_dir, "streams")
+        self.ffmpeg = ffmpeg
+        self.idle_timeout = idle_timeout
+        self.segment_duration = segment_duration
+        self.streams: dict[str, StationStream] = {}
+        self.lock = threading.Lock()
+        self.shutdown_event = threading.Event()
+
+    def watch(self, station_name: str, viewer: str) -> Optional[StationStream]:
+        """Register a viewer request for a station and make sure its stream is running."""
+        with self.lock:
+            station = self.network.get_station(station_name)
+            if station is None or not station.active:
+                return None
+            stream = self.streams.get(station_name)
+            if stream is None:
+                os.makedirs(self.stream_dir, exist_ok=True)
+                stream_dir = os.path.join(self.stream_dir, hashlib.sha1(station_name.encode()).hexdigest())
+                stream = StationStream(station, self.library, stream_dir, self.ffmpeg, self.segment_duration)
+                self.streams[station_name] = stream
+            # Stations are replaced when their schedule changes
+            stream.station = station
+            stream.seen(viewer)
+        if not stream.ensure_running():
+            return None
+        return stream
+
+    def wait_for_playlist(self, stream: StationStream, timeout: Optional[float] = None) -> bool:
+        if timeout is None:
+            timeout = self.segment_duration * 2
+        deadline = time.monotonic() + timeout
+        while not os.path.isfile(stream.playlist):
+            if time.monotonic() > deadline or (stream.owner and not stream.running):
+                return False
+            time.sleep(0.1)
+        return True
+
+    def reap(self) -> None:
+        # Stopping and starting ffmpeg takes seconds, which watch() shouldn't wait for
+        stopped, ended = [], []
+        with self.lock:
+            num_viewers = 0
+            for station_name, stream in list(self.streams.items()):
+                stream_viewers = stream.expire_viewers(self.idle_timeout)
+                if stream_viewers == 0 and not (stream.owner and stream.watched_elsewhere(self.idle_timeout)):
+                    stopped.append(stream)
+                    del self.streams[station_name]
+                    continue
+                num_viewers += stream_viewers
+                if stream.owner and not stream.running:
+                    # The program ended, continue with whatever is on next
+                    stream.station = self.network.get_station(station_name) or stream.station
+                    ended.append(stream)
+            metric_active_streams.set(len(self.streams))
+            metric_stream_viewers.set(num_viewers)
+        for stream in stopped:
+            stream.stop()
+        for stream in ended:
+            stream.ensure_running()
+
+    def run(self) -> None:
+        while not self.shutdown_event.wait(1):
+            try:
+                self.reap()
+            except Exception:
+                log.exception("Error while reaping streams")
+
+    def shutdown(self) -> None:
+        self.shutdown_event.set()
+        with self.lock:
+            streams = list(self.streams.values())
+            self.streams.clear()
+        for stream in streams:
+            try:
+                stream.stop()
+            except Exception:
+                log.exception("Error while stopping the stream for %s", stream.station.name)
@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class Platform(Enum):
@@ -12,3 +12,9 @@ class Architecture(Enum):
     X86_64 = "x86_64"
     ARM64 = "arm64"
     UNKNOWN = "Unknown"
+
+
+class MediaType(IntEnum):
+    MOVIE = 0
+    EPISODE = 1
+    SHOW = 2
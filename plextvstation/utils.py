@@ -1,5 +1,4 @@
 import os
-import requests
 import ipaddress
 import platform
 import secrets
@@ -8,9 +7,8 @@ import sys
 import psutil
 import threading
 import subprocess
-import pandas as pd
 from dataclasses import asdict, is_dataclass, fields
-from typing import Optional, Callable, Union, Any
+from typing import Optional, Callable, Union, Any, Iterable
 from types import FrameType
 from signal import signal, Signals, SIGTERM, SIGINT
 from datetime import datetime, timedelta, timezone
@@ -29,7 +27,6 @@ except ImportError:
 
 from email.utils import parsedate
 from time import mktime
-from pkg_resources import resource_filename
 from .types import Platform, Architecture
 from .logging import log
 from . import __title__ as base_package_name
@@ -64,7 +61,9 @@ def download_binary(
     binary_uri: str, binary_path: str, make_executable: bool = True, force_download: bool = False
 ) -> bool:
     """Download executable if changed."""
-    log.debug(f"Checking for {binary_uri} updates")
+    import requests
+
+    log.debug("Checking for %s updates", binary_uri)
 
     # Check the headers of the URL, follow redirects if necessary
     r = requests.head(binary_uri, allow_redirects=True)
@@ -86,8 +85,8 @@ def download_binary(
     assert parsed_date is not None
     remote_last_modified_timestamp = mktime(parsed_date)
 
-    log.debug(f"Remote file size: {remote_file_size}, last modified: {remote_last_modified_timestamp}")
-    log.debug(f"Local file size: {local_file_size}, last modified: {local_file_last_modified}")
+    log.debug("Remote file size: %s, last modified: %s", remote_file_size, remote_last_modified_timestamp)
+    log.debug("Local file size: %s, last modified: %s", local_file_size, local_file_last_modified)
 
     # Download the file if size or last modified time differs
     if (
@@ -95,7 +94,7 @@ def download_binary(
         or remote_file_size != local_file_size
         or remote_last_modified_timestamp != local_file_last_modified
     ):
-        log.debug(f"New version of {binary_uri} found, downloading...")
+        log.debug("New version of %s found, downloading...", binary_uri)
         r = requests.get(binary_uri, stream=True, allow_redirects=True)
         r.raise_for_status()
         with open(binary_path, "wb") as f:
@@ -110,11 +109,13 @@ def download_binary(
         os.utime(binary_path, (local_file_access_time, remote_last_modified_timestamp))
         return True
     else:
-        log.debug(f"No new version of {binary_uri} found.")
+        log.debug("No new version of %s found.", binary_uri)
         return False
 
 
 def get_template(template_name: str) -> str:
+    from pkg_resources import resource_filename
+
     template_file = resource_filename(base_package_name, f"templates/{template_name}")
     with open(template_file, "r") as f:
         return f.read()
@@ -122,7 +123,7 @@ def get_template(template_name: str) -> str:
 
 def make_dirs(config: dict[str, str]) -> None:
     for dir in [config["env_dir"], config["bin_dir"], config["tmp_dir"], config["conf_dir"]]:
-        log.debug(f"Creating directory {dir}")
+        log.debug("Creating directory %s", dir)
         os.makedirs(dir, exist_ok=True)
 
 
@@ -183,30 +184,45 @@ def delayed_exit(delay: int = 3) -> None:
     os._exit(0)
 
 
-def close_fds(safety_margin: int = 1024) -> None:
-    """Set FD_CLOEXEC on all file descriptors except stdin, stdout, stderr
+def close_fds(safety_margin: int = 1024, keep: Iterable[int] = ()) -> None:
+    """Set FD_CLOEXEC on all file descriptors except stdin, stdout, stderr and `keep`
 
-    Since there is a race between determining the max number of fds to close
-    and actually closing them we are adding a safety margin.
+    The open file descriptors are listed from /proc/self/fd (or /dev/fd). Where that is not
+    available we fall back to trying every fd up to the highest open one. Since there is a race
+    between determining the max number of fds to close and actually closing them we are adding
+    a safety margin in that case.
     """
     if sys.platform == "win32":
         return
 
-    open_fds = [f.fd for f in psutil.Process().open_files()]
-    if len(open_fds) == 0:
-        return
+    fds = list_open_fds()
+    if fds is None:
+        open_fds = [f.fd for f in psutil.Process().open_files()]
+        if len(open_fds) == 0:
+            return
 
-    num_open = max(open_fds)
+        num_open = max(open_fds)
 
-    try:
-        sc_open_max = os.sysconf("SC_OPEN_MAX")
-    except AttributeError:
-        sc_open_max = 1024
+        try:
+            sc_open_max = os.sysconf("SC_OPEN_MAX")
+        except AttributeError:
+            sc_open_max = 1024
+
+        fds = list(range(3, min(num_open + safety_margin, sc_open_max)))
 
-    num_close = min(num_open + safety_margin, sc_open_max)
+    keep = set(keep)
+    for fd in fds:
+        if fd > 2 and fd not in keep:
+            fd_cloexec(fd)
 
-    for fd in range(3, num_close):
-        fd_cloexec(fd)
+
+def list_open_fds() -> Optional[list[int]]:
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return [int(fd) for fd in os.listdir(fd_dir)]
+        except (OSError, ValueError):
+            continue
+    return None
 
 
 def fd_cloexec(fd: int) -> None:
@@ -239,7 +255,7 @@ def kill_children(
     else:
         log_suffix = "ren"
 
-    log.debug(f"Sending {signal.name} to {num_children} child{log_suffix}.")
+    log.debug("Sending %s to %d child%s.", signal.name, num_children, log_suffix)
     for p in procs:
         try:
             if signal == SIGTERM:
@@ -252,7 +268,7 @@ def kill_children(
     if ensure_death:
         _, alive = psutil.wait_procs(procs, timeout=timeout)
         for p in alive:
-            log.debug(f"Child with PID {p.pid} is still alive, sending SIGKILL")
+            log.debug("Child with PID %d is still alive, sending SIGKILL", p.pid)
             try:
                 p.kill()
             except psutil.NoSuchProcess:
@@ -264,13 +280,13 @@ def increase_limits() -> None:
         return
     for limit_name in ("RLIMIT_NOFILE", "RLIMIT_NPROC"):
         soft_limit, hard_limit = resource.getrlimit(getattr(resource, limit_name))
-        log.debug(f"Current {limit_name} soft: {soft_limit} hard: {hard_limit}")
+        log.debug("Current %s soft: %s hard: %s", limit_name, soft_limit, hard_limit)
         try:
             if soft_limit < hard_limit:
-                log.debug(f"Increasing {limit_name} {soft_limit} -> {hard_limit}")
+                log.debug("Increasing %s %s -> %s", limit_name, soft_limit, hard_limit)
                 resource.setrlimit(getattr(resource, limit_name), (hard_limit, hard_limit))
         except ValueError:
-            log.error(f"Failed to increase {limit_name} {soft_limit} -> {hard_limit}")
+            log.error("Failed to increase %s %s -> %s", limit_name, soft_limit, hard_limit)
 
 
 def num_default_threads(num_min_threads: int = 2) -> int:
@@ -330,11 +346,15 @@ def safe_asdict(obj: Any, max_depth: int = 100, _depth: int = 0, _seen: Optional
 
 
 def dataclass2html_table(data_objects: list[Any]) -> str:
+    # Only the web UI renders tables, so headless runs never pay for importing pandas or msgpack
+    import pandas as pd
+    from .serialize import html_serializer
+
     if not all(map(is_dataclass, data_objects)):
         raise ValueError("All elements in the list should be dataclass instances.")
 
     # Convert dataclasses to dictionaries
-    data_dicts = [safe_asdict(obj) for obj in data_objects]
+    data_dicts = [html_serializer.encode(obj) for obj in data_objects]
 
     df = pd.DataFrame(data_dicts)
 
@@ -0,0 +1,144 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional, List, Tuple, Iterable
+from prometheus_client import Gauge
+from .schedule import ScheduledProgram
+from .station import Network, TVStation
+from .types import MediaType
+
+metric_schedule_conflicts = Gauge(
+    "plextvstation_schedule_conflicts", "Problems found in the network's schedules by the last validation", ["kind"]
+)
+
+
+class ConflictKind(Enum):
+    OVERLAP = "overlap"
+    GAP = "gap"
+    DUPLICATE = "duplicate"
+    ZERO_DURATION = "zero_duration"
+
+
+@dataclass(frozen=True)
+class Conflict:
+    kind: ConflictKind
+    station: str
+    start: datetime
+    end: datetime
+    media_type: Optional[MediaType] = None
+    media_id: Optional[int] = None
+    other_station: Optional[str] = None
+
+    def __str__(self) -> str:
+        text = f"{self.kind.value} on {self.station} from {self.start} to {self.end}"
+        if self.media_type is not None:
+            text += f" ({self.media_type.name.lower()} {self.media_id})"
+        if self.other_station is not None:
+            text += f" also airing on {self.other_station}"
+        return text
+
+
+# (timestamp, 0 for an end and 1 for a start, station index, program index)
+SweepEvent = Tuple[float, int, int, int]
+
+
+def validate_station(station: TVStation, min_gap: timedelta = timedelta(0)) -> List[Conflict]:
+    """Find overlaps, gaps and zero duration programs within one station's schedule."""
+    conflicts: List[Conflict] = []
+    programs = sorted(station.schedule.programs, key=lambda p: p.start_time)
+    previous: Optional[ScheduledProgram] = None
+    for program in programs:
+        if program.duration <= timedelta(0):
+            conflicts.append(
+                Conflict(
+                    ConflictKind.ZERO_DURATION,
+                    station.name,
+                    program.start_time,
+                    program.end_time,
+                    program.media_type,
+                    program.media_id,
+                )
+            )
+            continue
+        if previous is not None:
+            if program.start_time < previous.end_time:
+                conflicts.append(
+                    Conflict(
+                        ConflictKind.OVERLAP,
+                        station.name,
+                        program.start_time,
+                        min(previous.end_time, program.end_time),
+                        program.media_type,
+                        program.media_id,
+                    )
+                )
+            elif program.start_time - previous.end_time > min_gap:
+                conflicts.append(Conflict(ConflictKind.GAP, station.name, previous.end_time, program.start_time))
+        if previous is None or program.end_time > previous.end_time:
+            previous = program
+    return conflicts
+
+
+def find_duplicates(stations: List[TVStation]) -> List[Conflict]:
+    """Find content airing on more than one station at the same time.
+
+    All program starts and ends go into one list, which is sorted once. Sweeping over it keeps
+    the set of programs on air per piece of content. Ends sort before starts at the same
+    instant, so back to back airings on different stations don't count as simultaneous.
+    """
+    events: List[SweepEvent] = []
+    for station_idx, station in enumerate(stations):
+        for program_idx, program in enumerate(station.schedule.programs):
+            if program.duration > timedelta(0):
+                events.append((program.start_time.timestamp(), 1, station_idx, program_idx))
+                events.append((program.end_time.timestamp(), 0, station_idx, program_idx))
+    events.sort()
+
+    conflicts: List[Conflict] = []
+    on_air: dict[Tuple[MediaType, int], List[Tuple[int, int]]] = {}
+    for _, is_start, station_idx, program_idx in events:
+        program = stations[station_idx].schedule.programs[program_idx]
+        key = (program.media_type, program.media_id)
+        airing = on_air.setdefault(key, [])
+        if not is_start:
+            airing.remove((station_idx, program_idx))
+            if not airing:
+                del on_air[key]
+            continue
+        for other_station_idx, other_program_idx in airing:
+            if other_station_idx == station_idx:
+                continue
+            other = stations[other_station_idx].schedule.programs[other_program_idx]
+            conflicts.append(
+                Conflict(
+                    ConflictKind.DUPLICATE,
+                    stations[station_idx].name,
+                    program.start_time,
+                    min(program.end_time, other.end_time),
+                    program.media_type,
+                    program.media_id,
+                    stations[other_station_idx].name,
+                )
+            )
+        airing.append((station_idx, program_idx))
+    return conflicts
+
+
+def validate_network(network: Network, min_gap: timedelta = timedelta(0)) -> List[Conflict]:
+    """Validate all schedules of the network. Runs in O(n log n) for n programs."""
+    stations = [station for station in network.stations if station.active]
+    conflicts: List[Conflict] = []
+    for station in stations:
+        conflicts.extend(validate_station(station, min_gap))
+    conflicts.extend(find_duplicates(stations))
+    conflicts.sort(key=lambda c: (c.start.astimezone(timezone.utc), c.station))
+    update_metrics(conflicts)
+    return conflicts
+
+
+def update_metrics(conflicts: Iterable[Conflict]) -> None:
+    counts = {kind: 0 for kind in ConflictKind}
+    for conflict in conflicts:
+        counts[conflict.kind] += 1
+    for kind, num in counts.items():
+        metric_schedule_conflicts.labels(kind=kind.value).set(num)
@@ -1,91 +1,16 @@
-import threading
-import cherrypy
-from argparse import ArgumentParser
-from typing import Optional, Any
-from ..logging import log
+from argparse import ArgumentParser, ArgumentTypeError
+from typing import Tuple
 
+# Endpoints that walk the whole library, and how many of each may run at once
+default_limits = {"movies": 2, "shows": 2, "search": 4, "similar": 2, "asrun": 2}
 
-class WebServer(threading.Thread):
-    def __init__(
-        self,
-        web_app: Any,
-        web_host: str = "::",
-        web_port: int = 9898,
-        ssl_cert: Optional[str] = None,
-        ssl_key: Optional[str] = None,
-        extra_config: Optional[dict[str, Any]] = None,
-    ) -> None:
-        super().__init__()
-        self.name = "webserver"
-        self.web_app = web_app
-        self.web_host = web_host
-        self.web_port = web_port
-        self.ssl_cert = ssl_cert
-        self.ssl_key = ssl_key
-        self.extra_config = extra_config or {}
-        self.daemon = True
 
-    @property
-    def serving(self) -> bool:
-        return bool(cherrypy.engine.state == cherrypy.engine.states.STARTED)
-
-    def run(self) -> None:
-        # CherryPy always prefixes its log messages with a timestamp.
-        # The next line monkey patches that time method to return a
-        # fixed string. So instead of having duplicate timestamps in
-        # each web server related log message they are now prefixed
-        # with the string 'CherryPy'.
-        cherrypy.config.reset()
-        cherrypy._cplogging.LogManager.time = lambda self: "CherryPy"
-        cherrypy.engine.unsubscribe("graceful", cherrypy.log.reopen_files)
-
-        # We always mount at / as well as any user configured --web-path
-        cherrypy.tree.mount(
-            self.web_app,
-            "",
-            self.web_app.config,
-        )
-        if self.web_app.mountpoint not in ("/", ""):
-            cherrypy.tree.mount(
-                self.web_app,
-                self.web_app.mountpoint,
-                self.web_app.config,
-            )
-        ssl_args = {}
-        if self.ssl_cert and self.ssl_key:
-            ssl_args = {
-                "server.ssl_module": "builtin",
-                "server.ssl_certificate": self.ssl_cert,
-                "server.ssl_private_key": self.ssl_key,
-            }
-        cherrypy.config.update(
-            {
-                "global": {
-                    "engine.autoreload.on": False,
-                    "server.socket_host": self.web_host,
-                    "server.socket_port": self.web_port,
-                    "log.screen": False,
-                    "log.access_file": "",
-                    "log.error_file": "",
-                    "tools.log_headers.on": False,
-                    "tools.encode.on": True,
-                    "tools.encode.encoding": "utf-8",
-                    "request.show_tracebacks": False,
-                    "request.show_mismatched_params": False,
-                    **ssl_args,
-                    **self.extra_config,
-                }
-            }
-        )
-        cherrypy.engine.start()
-        cherrypy.engine.block()
-
-    def shutdown(self) -> None:
-        log.debug("Received request to shutdown http server threads")
-        cherrypy.engine.exit()
-
-    def mount(self, mountpoint: str, app: Any) -> None:
-        cherrypy.tree.mount(app, mountpoint, app.config)
+def endpoint_limit(value: str) -> Tuple[str, int]:
+    endpoint, _, limit = value.partition("=")
+    try:
+        return endpoint.strip("/"), int(limit)
+    except ValueError:
+        raise ArgumentTypeError(f"expected ENDPOINT=N, got '{value}'")
 
 
 def add_args(parser: ArgumentParser) -> None:
@@ -112,3 +37,53 @@ def add_args(parser: ArgumentParser) -> None:
         dest="web_ssl_key",
         help="Web server SSL key file",
     )
+    parser.add_argument(
+        "--web-max-requests",
+        dest="web_max_requests",
+        help="Maximum number of web requests handled or queued at once, beyond which requests get a 503 (default: 8)",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--web-reserved-threads",
+        dest="web_reserved_threads",
+        help="Request threads kept free for /health, /metrics and starting event streams (default: 2)",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--web-stream-threads",
+        dest="web_stream_threads",
+        help=(
+            "Request threads for /stream on top of --web-max-requests, beyond which stream requests get a 503, "
+            "0 to count them against --web-max-requests (default: 4)"
+        ),
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--web-limit",
+        dest="web_limits",
+        help=(
+            "Maximum concurrent requests to an endpoint, 0 for no limit. Can be given multiple times "
+            f"(default: {' '.join(f'{name}={limit}' for name, limit in default_limits.items())})"
+        ),
+        metavar="ENDPOINT=N",
+        action="append",
+        default=[],
+        type=endpoint_limit,
+    )
+    parser.add_argument(
+        "--web-queue",
+        dest="web_queue",
+        help="Number of requests that may wait for a limited endpoint (default: 4)",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--web-queue-timeout",
+        dest="web_queue_timeout",
+        help="Seconds a request waits for a limited endpoint before it gets a 503 (default: 5)",
+        default=5.0,
+        type=float,
+    )
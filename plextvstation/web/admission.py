@@ -0,0 +1,157 @@
+import threading
+import cherrypy
+from typing import Optional, Dict
+from prometheus_client import Gauge, Counter
+from ..logging import log, rate_limit
+from . import default_limits
+
+metric_requests_in_flight = Gauge("plextvstation_web_requests_in_flight", "Admitted or queued web requests")
+metric_request_queue_depth = Gauge(
+    "plextvstation_web_request_queue_depth", "Web requests waiting for an endpoint slot", ["endpoint"]
+)
+metric_requests_rejected = Counter(
+    "plextvstation_web_requests_rejected", "Web requests rejected with 503", ["endpoint", "reason"]
+)
+
+admission_log = rate_limit(log.getChild("admission"), rate=1, burst=10)
+
+
+class ServiceUnavailable(cherrypy.HTTPError):  # type: ignore
+    """A 503 that keeps its Retry-After header, which HTTPError cleans from error responses."""
+
+    def __init__(self, retry_after: int, message: Optional[str] = None) -> None:
+        super().__init__(503, message)
+        self.retry_after = retry_after
+
+    def set_response(self) -> None:
+        super().set_response()
+        cherrypy.serving.response.headers["Retry-After"] = str(self.retry_after)
+
+
+class Lane:
+    """Runs up to `limit` requests at once, and lets up to `queue` more wait for their turn."""
+
+    def __init__(self, name: str, limit: int, queue: int, timeout: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.queue_depth = metric_request_queue_depth.labels(endpoint=name)
+
+    def acquire(self) -> Optional[str]:
+        """Wait for a slot. Returns why the request was rejected, or None once it holds a slot."""
+        with self.condition:
+            if self.active < self.limit:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return "queue_full"
+            self.waiting += 1
+            self.queue_depth.inc()
+            try:
+                if not self.condition.wait_for(lambda: self.active < self.limit, self.timeout):
+                    return "timeout"
+            finally:
+                self.waiting -= 1
+                self.queue_depth.dec()
+            self.active += 1
+            return None
+
+    def release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+
+class AdmissionControl:
+    """Keeps expensive requests from taking every request thread of the web server.
+
+    Requests hold a request thread while they run and while they wait in a queue, so at
+    most `max_requests` of them are let in at once and the rest are rejected right away.
+    The server runs with more threads than that, which leaves a reserved lane for the
+    endpoints that are exempt from admission control, like /health and /metrics. Within
+    that budget, endpoints with a limit have a lane of their own with a bounded queue.
+
+    Endpoints with `dedicated` threads are not counted against `max_requests`, and don't
+    queue: a stream waiting for its playlist shouldn't take a thread from the library, and
+    a library scan shouldn't turn away viewers. The server needs those threads on top.
+    """
+
+    def __init__(
+        self,
+        max_requests: int = 8,
+        limits: Optional[Dict[str, int]] = None,
+        queue: int = 4,
+        queue_timeout: float = 5.0,
+        dedicated: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self.max_requests = max_requests
+        self.queue_timeout = queue_timeout
+        self.lanes = {
+            endpoint: Lane(endpoint, limit, queue, queue_timeout)
+            for endpoint, limit in (default_limits if limits is None else limits).items()
+            if limit > 0
+        }
+        self.dedicated = {
+            endpoint: Lane(endpoint, threads, 0, queue_timeout)
+            for endpoint, threads in (dedicated or {}).items()
+            if threads > 0
+        }
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def admit(self, endpoint: str) -> Optional[str]:
+        """Admit a request to `endpoint`. Returns why it was rejected, or None if it must be released later."""
+        dedicated = self.dedicated.get(endpoint)
+        if dedicated is not None:
+            reason = dedicated.acquire()
+            return self.reject(endpoint, reason) if reason is not None else None
+        with self.lock:
+            if self.in_flight >= self.max_requests:
+                return self.reject(endpoint, "capacity")
+            self.in_flight += 1
+            metric_requests_in_flight.inc()
+        lane = self.lanes.get(endpoint)
+        reason = lane.acquire() if lane is not None else None
+        if reason is not None:
+            self.leave()
+            return self.reject(endpoint, reason)
+        return None
+
+    def release(self, endpoint: str) -> None:
+        dedicated = self.dedicated.get(endpoint)
+        if dedicated is not None:
+            dedicated.release()
+            return
+        lane = self.lanes.get(endpoint)
+        if lane is not None:
+            lane.release()
+        self.leave()
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            metric_requests_in_flight.dec()
+
+    def reject(self, endpoint: str, reason: str) -> str:
+        # Any path can reach the static files handler, so only known endpoints get a label of their own
+        label = endpoint if endpoint in self.lanes or endpoint in self.dedicated else "other"
+        metric_requests_rejected.labels(endpoint=label, reason=reason).inc()
+        admission_log.info("Rejected request to /%s: %s", endpoint, reason)
+        return reason
+
+
+def admit(control: AdmissionControl) -> None:
+    """CherryPy tool that runs the request handler only once `control` admits the request."""
+    request = cherrypy.request
+    endpoint = request.path_info.strip("/").split("/")[0] or "index"
+    reason = control.admit(endpoint)
+    if reason is not None:
+        raise ServiceUnavailable(max(1, round(control.queue_timeout)), "Server busy, try again later")
+    request.hooks.attach("on_end_request", control.release, endpoint=endpoint)
+
+
+cherrypy.tools.admission = cherrypy.Tool("on_start_resource", admit)
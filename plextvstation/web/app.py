@@ -1,34 +1,136 @@
 import os
 import cherrypy
+from functools import partial
 from prometheus_client.exposition import generate_latest, CONTENT_TYPE_LATEST
-from typing import Optional, Dict, Callable
+from typing import Optional, Dict, Callable, Any, List, Union, Iterator, Iterable
+from prometheus_client import Counter
+from cherrypy.lib.static import serve_file
+from cherrypy.lib.httputil import HTTPDate
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from ..asrun import AsRunLog
+from ..events import ProgramEvents
+from ..guide import GuideBuilder, GuideDocument
 from ..plex import PlexDB
+from ..serialize import serializer
+from ..station import Network
+from ..types import MediaType
+from ..stream import StreamManager, valid_segment_name
 from ..utils import dataclass2html_table
+from .admission import AdmissionControl, ServiceUnavailable
+from .assets import StaticAssets
+from .server import DETACH
+
+metric_static_requests = Counter("plextvstation_static_requests", "Static asset requests", ["encoding"])
+
+serialization_content_types = {"json": "application/json", "msgpack": "application/msgpack"}
+
+
+def accepted_encoding(available: Iterable[str]) -> Optional[str]:
+    """The first of the `available` content encodings that the client accepts."""
+    accepted = {e.value.lower(): e.qvalue for e in cherrypy.request.headers.elements("Accept-Encoding")}
+    if "x-gzip" in accepted:
+        accepted.setdefault("gzip", accepted["x-gzip"])
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def not_modified(etag: str, last_modified: datetime) -> bool:
+    """Whether the client's copy is current, by If-None-Match or, without it, If-Modified-Since."""
+    headers = cherrypy.request.headers
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag in [e.strip() for e in if_none_match.split(",")]
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have no fractions of a second
+    return last_modified.replace(microsecond=0) <= since
 
 
 class WebApp:
     def __init__(
         self,
         plexdb: PlexDB,
+        network: Optional[Network] = None,
+        stream_manager: Optional[StreamManager] = None,
+        program_events: Optional[ProgramEvents] = None,
+        asrun_log: Optional[AsRunLog] = None,
         mountpoint: str = "/",
         health_conditions: Optional[Dict[str, Callable[[], bool]]] = None,
+        admission: Optional[AdmissionControl] = None,
     ) -> None:
         self.plexdb = plexdb
+        self.network = network
+        self.stream_manager = stream_manager
+        self.program_events = program_events
+        self.asrun_log = asrun_log
+        self.guide = GuideBuilder(network, plexdb) if network is not None else None
         self.mountpoint = mountpoint
         local_path = os.path.abspath(os.path.dirname(__file__))
-        config = {
+        # Compressed once here instead of by tools.gzip on every request
+        self.assets = StaticAssets(f"{local_path}/static")
+        config: Dict[str, Any] = {
             "tools.gzip.on": True,
-            "tools.staticdir.index": "index.html",
-            "tools.staticdir.on": True,
-            "tools.staticdir.dir": f"{local_path}/static",
         }
+        if admission is not None:
+            config["tools.admission.on"] = True
+            config["tools.admission.control"] = admission
         self.config = {"/": config}
         self.health_conditions = health_conditions if health_conditions is not None else {}
         if self.mountpoint not in ("/", ""):
             self.config[self.mountpoint] = config
 
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET", "HEAD"])  # type: ignore
+    @cherrypy.config(**{"tools.gzip.on": False})  # type: ignore
+    def index(self) -> bytes:
+        return self.serve_asset("index.html")
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET", "HEAD"])  # type: ignore
+    @cherrypy.config(**{"tools.gzip.on": False})  # type: ignore
+    def default(self, *path: str) -> bytes:
+        if len(path) != 1:
+            raise cherrypy.NotFound()
+        return self.serve_asset(path[0])
+
+    def serve_asset(self, name: str) -> bytes:
+        asset = self.assets.get(name)
+        if asset is None:
+            raise cherrypy.NotFound()
+        encoding = accepted_encoding(e for e in ("br", "gzip") if e in asset.encodings)
+        headers = cherrypy.response.headers
+        headers["Content-Type"] = asset.content_type
+        headers["ETag"] = asset.etag(encoding)
+        headers["Last-Modified"] = HTTPDate(asset.last_modified.timestamp())
+        if self.assets.immutable(name):
+            headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            headers["Cache-Control"] = "no-cache"
+        if asset.encodings:
+            headers["Vary"] = "Accept-Encoding"
+        metric_static_requests.labels(encoding=encoding or "identity").inc()
+
+        if not_modified(asset.etag(encoding), asset.last_modified):
+            cherrypy.response.status = 304
+            return b""
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            return asset.encodings[encoding]
+        return asset.body
+
     @cherrypy.expose  # type: ignore
     @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    @cherrypy.config(**{"tools.admission.on": False})  # type: ignore
     def health(self) -> str:
         cherrypy.response.headers["Content-Type"] = "text/plain"
         unhealthy = [f"- {name}" for name, fn in self.health_conditions.items() if not fn()]
@@ -42,18 +144,161 @@ class WebApp:
 
     @cherrypy.expose  # type: ignore
     @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    @cherrypy.config(**{"tools.admission.on": False})  # type: ignore
     def metrics(self) -> bytes:
         cherrypy.response.headers["Content-Type"] = CONTENT_TYPE_LATEST
         return generate_latest()
 
     @cherrypy.expose  # type: ignore
     @cherrypy.tools.allow(methods=["GET"])  # type: ignore
-    def movies(self) -> str:
-        cherrypy.response.headers["Content-Type"] = "text/html"
-        return dataclass2html_table(self.plexdb.movies)
+    def movies(self, format: str = "html") -> Union[str, bytes]:
+        return self.serve_library(self.plexdb.movies, format)
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    def shows(self, format: str = "html") -> Union[str, bytes]:
+        return self.serve_library(self.plexdb.tv_shows, format)
+
+    def serve_library(self, items: List[Any], format: str) -> Union[str, bytes]:
+        if format == "html":
+            cherrypy.response.headers["Content-Type"] = "text/html"
+            return dataclass2html_table(items)
+        if format not in serialization_content_types:
+            raise cherrypy.HTTPError(400, f"Unknown format {format}")
+        try:
+            body = serializer.dumps(items, format)
+        except ValueError as e:
+            raise cherrypy.HTTPError(501, str(e))
+        cherrypy.response.headers["Content-Type"] = serialization_content_types[format]
+        return body
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    def stream(self, station: str, filename: str = "index.m3u8") -> Any:
+        if self.stream_manager is None:
+            raise cherrypy.HTTPError(404, "Streaming is not enabled")
+        viewer = f"{cherrypy.request.remote.ip}|{cherrypy.request.headers.get('User-Agent', '')}"
+        station_stream = self.stream_manager.watch(station, viewer)
+        if station_stream is None:
+            raise cherrypy.HTTPError(404, f"Station {station} is not on air")
+
+        if filename == "index.m3u8":
+            if not self.stream_manager.wait_for_playlist(station_stream):
+                raise cherrypy.HTTPError(503, "Stream is starting")
+            cherrypy.response.headers["Cache-Control"] = "no-cache"
+            return serve_file(station_stream.playlist, content_type="application/vnd.apple.mpegurl")
+
+        if not valid_segment_name.match(filename):
+            raise cherrypy.HTTPError(404)
+        return serve_file(os.path.join(station_stream.stream_dir, filename), content_type="video/mp2t")
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET", "HEAD"])  # type: ignore
+    @cherrypy.config(**{"tools.gzip.on": False})  # type: ignore
+    def xmltv(self) -> bytes:
+        if self.guide is None:
+            raise cherrypy.HTTPError(404, "No network loaded")
+        return self.serve_document(self.guide.xmltv())
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET", "HEAD"])  # type: ignore
+    @cherrypy.config(**{"tools.gzip.on": False})  # type: ignore
+    def m3u(self) -> bytes:
+        if self.guide is None:
+            raise cherrypy.HTTPError(404, "No network loaded")
+        base_url = cherrypy.request.base + self.mountpoint.rstrip("/")
+        return self.serve_document(self.guide.m3u(base_url))
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    # Event streams have a limit of their own, and only hold a request thread for their greeting
+    @cherrypy.config(**{"response.stream": True, "tools.gzip.on": False, "tools.admission.on": False})  # type: ignore
+    def events(self, station: Optional[str] = None) -> Iterator[bytes]:
+        if self.program_events is None or self.network is None:
+            raise cherrypy.HTTPError(404, "Events are not enabled")
+        if station is not None and self.network.get_station(station) is None:
+            raise cherrypy.HTTPError(404, f"Unknown station {station}")
+        subscription = self.program_events.broadcaster.subscribe(station)
+        if subscription is None:
+            raise ServiceUnavailable(30, "Too many event stream clients")
+        headers = cherrypy.response.headers
+        headers["Content-Type"] = "text/event-stream"
+        headers["Cache-Control"] = "no-cache"
+        headers["X-Accel-Buffering"] = "no"
+        detach = cherrypy.request.wsgi_environ.get(DETACH)
+        if detach is None:
+            return self.program_events.stream(subscription)
+        # The program events thread serves the stream from here on
+        detach(partial(self.program_events.attach, subscription))
+        return iter(self.program_events.greeting(subscription))
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    @cherrypy.tools.json_out()  # type: ignore
+    def asrun(self, station: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None) -> Any:
+        if self.asrun_log is None:
+            raise cherrypy.HTTPError(404, "The as-run log is not enabled")
+        try:
+            end_time = datetime.fromisoformat(end) if end else datetime.now(timezone.utc)
+            start_time = datetime.fromisoformat(start) if start else end_time - timedelta(days=1)
+            if start_time.tzinfo is None or end_time.tzinfo is None:
+                raise ValueError("Missing timezone")
+        except ValueError:
+            raise cherrypy.HTTPError(400, "start and end must be ISO 8601 timestamps with a timezone")
+        return [
+            {
+                "station": entry.station,
+                "start": entry.start.isoformat(),
+                "end": entry.end.isoformat(),
+                "type": entry.media_type.name.lower(),
+                "id": entry.media_id,
+                "title": entry.title,
+            }
+            for entry in self.asrun_log.aired(station, start_time, end_time)
+        ]
+
+    @staticmethod
+    def serve_document(document: GuideDocument) -> bytes:
+        headers = cherrypy.response.headers
+        headers["Content-Type"] = document.content_type
+        headers["ETag"] = document.etag
+        headers["Last-Modified"] = HTTPDate(document.last_modified.timestamp())
+        headers["Cache-Control"] = "no-cache"
+        headers["Vary"] = "Accept-Encoding"
+
+        if not_modified(document.etag, document.last_modified):
+            cherrypy.response.status = 304
+            return b""
+
+        if accepted_encoding(("gzip",)) == "gzip":
+            headers["Content-Encoding"] = "gzip"
+            return document.gzip_body
+        return document.body
+
+    @cherrypy.expose  # type: ignore
+    @cherrypy.tools.allow(methods=["GET"])  # type: ignore
+    @cherrypy.tools.json_out()  # type: ignore
+    def search(self, q: str = "", limit: str = "20", type: Optional[str] = None) -> List[Dict[str, Any]]:
+        try:
+            media_type = MediaType[type.upper()] if type else None
+            max_results = min(max(int(limit), 1), 1000)
+        except (KeyError, ValueError):
+            raise cherrypy.HTTPError(400, "Invalid search parameters")
+        return [
+            {"type": r.media_type.name.lower(), "id": r.media_id, "title": r.title, "score": round(r.score, 4)}
+            for r in self.plexdb.search(q, max_results, media_type)
+        ]
 
     @cherrypy.expose  # type: ignore
     @cherrypy.tools.allow(methods=["GET"])  # type: ignore
-    def shows(self) -> str:
-        cherrypy.response.headers["Content-Type"] = "text/html"
-        return dataclass2html_table(self.plexdb.tv_shows)
+    @cherrypy.tools.json_out()  # type: ignore
+    def similar(self, type: str, id: str, limit: str = "20") -> List[Dict[str, Any]]:
+        try:
+            key = (MediaType[type.upper()], int(id))
+            max_results = min(max(int(limit), 1), 1000)
+        except (KeyError, ValueError):
+            raise cherrypy.HTTPError(400, "Invalid parameters")
+        return [
+            {"type": media_type.name.lower(), "id": media_id, "score": round(score, 4)}
+            for (media_type, media_id), score in self.plexdb.more_like_this([key], max_results)
+        ]
@@ -0,0 +1,129 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Dict
+from ..logging import log
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+compressible_types = {
+    "application/json",
+    "application/manifest+json",
+    "application/xml",
+    "image/svg+xml",
+    "image/vnd.microsoft.icon",
+    "image/x-icon",
+}
+
+# References in HTML that are rewritten to fingerprinted URLs
+html_reference = re.compile(rb'((?:href|src)=")([^"/:?#]+)(")')
+
+
+@dataclass
+class Asset:
+    """A static file with its compressed variants, prepared once so requests only copy bytes."""
+
+    name: str
+    content_type: str
+    body: bytes
+    last_modified: datetime
+    fingerprint: str = ""
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.prepare()
+
+    def prepare(self) -> None:
+        self.fingerprint = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self.encodings.clear()
+        if self.content_type.startswith("text/") or self.content_type in compressible_types:
+            self.compress()
+
+    @property
+    def fingerprinted_name(self) -> str:
+        stem, ext = os.path.splitext(self.name)
+        return f"{stem}.{self.fingerprint}{ext}"
+
+    def compress(self) -> None:
+        variants = {"gzip": gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(self.body, quality=11)
+        for encoding, body in variants.items():
+            # Not worth it for files that are compressed already
+            if len(body) < len(self.body) * 0.9:
+                self.encodings[encoding] = body
+
+    def etag(self, encoding: Optional[str]) -> str:
+        # Representations differ per encoding, and so must their strong ETags
+        return f'"{self.fingerprint}-{encoding}"' if encoding else f'"{self.fingerprint}"'
+
+
+class StaticAssets:
+    """All files of a static directory, keyed by their name and their fingerprinted name.
+
+    Fingerprinted names contain a digest of the content, so they can be cached forever.
+    References to other assets in HTML files are rewritten to them, which in turn changes
+    the HTML files' fingerprints.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.assets: Dict[str, Asset] = {}
+        self.fingerprinted: Dict[str, Asset] = {}
+        self.load()
+
+    def load(self) -> None:
+        assets = {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            assets[name] = Asset(
+                name,
+                content_type(name),
+                body,
+                datetime.fromtimestamp(os.path.getmtime(path), timezone.utc),
+            )
+        for asset in assets.values():
+            if asset.content_type == "text/html":
+                asset.body = html_reference.sub(
+                    lambda m: m[1] + fingerprinted(assets, m[2].decode()).encode() + m[3], asset.body
+                )
+                asset.prepare()
+        self.assets = assets
+        self.fingerprinted = {asset.fingerprinted_name: asset for asset in assets.values()}
+        log.debug(
+            "Prepared %d static assets, %d bytes compressed to %d",
+            len(assets),
+            sum(len(a.body) for a in assets.values() if a.encodings),
+            sum(min(len(b) for b in a.encodings.values()) for a in assets.values() if a.encodings),
+        )
+
+    def get(self, name: str) -> Optional[Asset]:
+        return self.fingerprinted.get(name) or self.assets.get(name)
+
+    def immutable(self, name: str) -> bool:
+        return name in self.fingerprinted
+
+    def url(self, name: str) -> str:
+        return fingerprinted(self.assets, name)
+
+
+def fingerprinted(assets: Dict[str, Asset], name: str) -> str:
+    asset = assets.get(name)
+    return asset.fingerprinted_name if asset is not None else name
+
+
+def content_type(name: str) -> str:
+    if name.endswith(".webmanifest"):
+        return "application/manifest+json"
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
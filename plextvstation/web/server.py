@@ -0,0 +1,228 @@
+import socket
+import threading
+import cherrypy
+from cherrypy._cpserver import Server
+from cheroot.server import HTTPServer
+from cheroot.wsgi import Gateway_10
+from cherrypy._cpwsgi_server import CPWSGIServer
+from typing import Optional, Any, Callable
+from ..logging import log
+
+# The WSGI environ key of the function that detaches the connection from the web server
+DETACH = "plextvstation.detach"
+
+DetachCallback = Callable[[Optional[socket.socket], bool], None]
+
+
+class DetachingGateway(Gateway_10):
+    """A WSGI gateway that lets the application take over the connection after the response.
+
+    While handling a request the application may call `environ[DETACH](callback)`. Once the
+    response headers and body are written, `callback(sock, chunked)` gets the connection
+    instead of the web server keeping it alive or closing it, and the request thread moves
+    on. `chunked` tells whether the response body is in chunked transfer encoding, which the
+    new owner continues. If the response fails, `callback(None, False)` is called instead.
+    """
+
+    def __init__(self, req: Any) -> None:
+        self.detached: Optional[DetachCallback] = None
+        super().__init__(req)
+
+    def get_environ(self) -> Any:
+        env = super().get_environ()  # type: ignore[no-untyped-call]
+        env[DETACH] = self.detach
+        return env
+
+    def detach(self, callback: DetachCallback) -> None:
+        self.detached = callback
+
+    def respond(self) -> None:
+        try:
+            super().respond()
+            if self.detached is not None:
+                self.req.conn.wfile.flush()
+        except BaseException:
+            if self.detached is not None:
+                self.detached(None, False)
+            raise
+        if self.detached is None:
+            return
+        chunked = self.req.chunked_write
+        # The body goes on, so there's no last chunk, and the connection is neither kept alive
+        # nor shut down. With linger the server only drops its reference to the socket.
+        self.req.chunked_write = False
+        self.req.close_connection = True
+        self.req.conn.linger = True
+        self.detached(self.req.conn.socket, chunked)
+
+
+class DetachingServer(Server):  # type: ignore
+    """A CherryPy server whose requests can take over their connection, see `DetachingGateway`."""
+
+    def httpserver_from_self(self, httpserver: Any = None) -> Any:
+        httpserver, bind_addr = super().httpserver_from_self(httpserver)
+        httpserver.gateway = DetachingGateway
+        return httpserver, bind_addr
+
+
+class SharedSocketWSGIServer(CPWSGIServer):  # type: ignore
+    """A cheroot server that serves on a socket bound by someone else, instead of binding one."""
+
+    def __init__(self, server_adapter: Any, sock: socket.socket) -> None:
+        super().__init__(server_adapter)
+        self.shared_socket = sock
+
+    def bind(self, family: int, type: int, proto: int = 0) -> socket.socket:
+        self.socket = self.shared_socket
+        self.bind_addr = self.resolve_real_bind_addr(self.socket)
+        return self.shared_socket
+
+
+class SharedSocketServer(DetachingServer):
+    """A CherryPy server for a listening socket that other processes serve on as well.
+
+    That's our sibling workers, or the process we are replacing or that replaces us.
+    """
+
+    def __init__(self, sock: socket.socket) -> None:
+        super().__init__()
+        self.shared_socket = sock
+
+    def httpserver_from_self(self, httpserver: Any = None) -> Any:
+        if httpserver is None and self.instance is None:
+            httpserver = SharedSocketWSGIServer(self, self.shared_socket)
+        return super().httpserver_from_self(httpserver)
+
+    def start(self) -> None:
+        # ServerAdapter.start() waits for the port to be free. Here the port is expected
+        # to be in use by the other processes on the socket, so we skip that check.
+        if not self.httpserver:  # type: ignore[has-type]
+            self.httpserver, self.bind_addr = self.httpserver_from_self()
+        self.interrupt = None
+        t = threading.Thread(target=self._start_http_thread, name="HTTPServer")
+        t.start()
+        self.wait()
+        self.running = True
+        self.bus.log(f"Serving on {self.description} (shared)")
+
+    def stop(self) -> None:
+        # Same for ServerAdapter.stop(), which waits for the port to become free
+        if self.running:
+            self.httpserver.stop()
+            self.running = False
+            self.bus.log(f"HTTP Server {self.httpserver} shut down")
+        else:
+            self.bus.log(f"HTTP Server {self.httpserver} already shut down")
+
+
+def listen_socket(host: str, port: int) -> socket.socket:
+    """Bind and listen on the web server's port, the way cheroot would, so the socket can be shared.
+
+    Fails if the port is in use, by another instance of us for example.
+    """
+    error: Optional[OSError] = None
+    for family, type, proto, _, addr in socket.getaddrinfo(
+        host, port, socket.AF_UNSPEC, socket.SOCK_STREAM, 0, socket.AI_PASSIVE
+    ):
+        try:
+            sock: socket.socket = HTTPServer.prepare_socket(addr, family, type, proto, True, None)
+        except OSError as e:
+            error = e
+            continue
+        try:
+            HTTPServer.bind_socket(sock, addr)  # type: ignore[no-untyped-call]
+            sock.listen(socket.SOMAXCONN)
+        except OSError as e:
+            sock.close()
+            error = e
+            continue
+        return sock
+    raise error or OSError(f"Can't listen on {host}:{port}")
+
+
+class WebServer(threading.Thread):
+    def __init__(
+        self,
+        web_app: Any,
+        web_host: str = "::",
+        web_port: int = 9898,
+        ssl_cert: Optional[str] = None,
+        ssl_key: Optional[str] = None,
+        extra_config: Optional[dict[str, Any]] = None,
+        shared_socket: Optional[socket.socket] = None,
+    ) -> None:
+        super().__init__()
+        self.name = "webserver"
+        self.web_app = web_app
+        self.web_host = web_host
+        self.web_port = web_port
+        self.ssl_cert = ssl_cert
+        self.ssl_key = ssl_key
+        self.extra_config = extra_config or {}
+        self.shared_socket = shared_socket
+        self.daemon = True
+
+    @property
+    def serving(self) -> bool:
+        return bool(cherrypy.engine.state == cherrypy.engine.states.STARTED)
+
+    def run(self) -> None:
+        # CherryPy always prefixes its log messages with a timestamp.
+        # The next line monkey patches that time method to return a
+        # fixed string. So instead of having duplicate timestamps in
+        # each web server related log message they are now prefixed
+        # with the string 'CherryPy'.
+        cherrypy.config.reset()
+        cherrypy._cplogging.LogManager.time = lambda self: "CherryPy"
+        cherrypy.engine.unsubscribe("graceful", cherrypy.log.reopen_files)
+        cherrypy.server.unsubscribe()
+        cherrypy.server = DetachingServer() if self.shared_socket is None else SharedSocketServer(self.shared_socket)
+        cherrypy.server.subscribe()
+
+        # We always mount at / as well as any user configured --web-path
+        cherrypy.tree.mount(
+            self.web_app,
+            "",
+            self.web_app.config,
+        )
+        if self.web_app.mountpoint not in ("/", ""):
+            cherrypy.tree.mount(
+                self.web_app,
+                self.web_app.mountpoint,
+                self.web_app.config,
+            )
+        ssl_args = {}
+        if self.ssl_cert and self.ssl_key:
+            ssl_args = {
+                "server.ssl_module": "builtin",
+                "server.ssl_certificate": self.ssl_cert,
+                "server.ssl_private_key": self.ssl_key,
+            }
+        cherrypy.config.update(
+            {
+                "global": {
+                    "engine.autoreload.on": False,
+                    "server.socket_host": self.web_host,
+                    "server.socket_port": self.web_port,
+                    "log.screen": False,
+                    "log.access_file": "",
+                    "log.error_file": "",
+                    "tools.log_headers.on": False,
+                    "tools.encode.on": True,
+                    "tools.encode.encoding": "utf-8",
+                    "request.show_tracebacks": False,
+                    "request.show_mismatched_params": False,
+                    **ssl_args,
+                    **self.extra_config,
+                }
+            }
+        )
+        cherrypy.engine.start()
+        cherrypy.engine.block()
+
+    def shutdown(self) -> None:
+        log.debug("Received request to shutdown http server threads")
+        cherrypy.engine.exit()
+
+    def mount(self, mountpoint: str, app: Any) -> None:
+        cherrypy.tree.mount(app, mountpoint, app.config)
@@ -0,0 +1,70 @@
+import gc
+import os
+import multiprocessing
+from argparse import ArgumentParser
+from multiprocessing.process import BaseProcess
+from signal import SIGTERM
+from typing import Callable, Optional, Any
+from .logging import log
+from .utils import kill_children
+
+
+def add_args(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        help="Number of web worker processes sharing the loaded library (default: 1, no worker processes)",
+        default=1,
+        type=int,
+    )
+
+
+class WorkerPool:
+    """Runs `target` in `num_workers` child processes and restarts them if they die.
+
+    Workers are forked so they share the parent's already loaded library and network
+    copy-on-write, which is the only way they share memory: objects are never copied out
+    of the parent explicitly. The heap is frozen before forking, which keeps the garbage
+    collector from touching (and thereby copying) the library pages in every worker.
+    Where there is no fork() every worker loads the library itself.
+
+    From then on each worker has a network of its own. Run them with --replica to have
+    one of them write it and the others pick up its changes.
+    """
+
+    def __init__(self, num_workers: int, target: Callable[[int], None], name: str = "worker") -> None:
+        self.num_workers = num_workers
+        self.target = target
+        self.name = name
+        self.workers: dict[int, BaseProcess] = {}
+        self.context: Any = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+
+    def _start_worker(self, worker_id: int) -> None:
+        process = self.context.Process(target=self.target, args=(worker_id,), name=f"{self.name}-{worker_id}")
+        process.daemon = False
+        process.start()
+        log.debug("Started %s with PID %s", process.name, process.pid)
+        self.workers[worker_id] = process
+
+    def start(self) -> None:
+        gc.collect()
+        gc.freeze()
+        for worker_id in range(self.num_workers):
+            self._start_worker(worker_id)
+
+    def check(self) -> None:
+        for worker_id, process in list(self.workers.items()):
+            if not process.is_alive():
+                log.error(
+                    "%s with PID %s exited with code %s - restarting", process.name, process.pid, process.exitcode
+                )
+                self._start_worker(worker_id)
+
+    def shutdown(self, timeout: Optional[int] = 10) -> None:
+        for process in self.workers.values():
+            if process.is_alive() and process.pid is not None:
+                os.kill(process.pid, SIGTERM)
+        for process in self.workers.values():
+            process.join(timeout)
+        kill_children(SIGTERM, ensure_death=True)
+        self.workers.clear()
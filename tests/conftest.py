@@ -0,0 +1,52 @@
+import io
+import cherrypy
+import pytest
+
+
+class WebClient:
+    """Calls a web app through CherryPy's WSGI interface, without a server or its request threads."""
+
+    def __init__(self, app):
+        cherrypy.config.update({"log.screen": False})
+        self.tree = cherrypy._cptree.Tree()
+        self.tree.mount(app, "", app.config)
+
+    def get(self, path, headers=None):
+        """(status code, headers, body) of a GET request."""
+        path, _, query = path.partition("?")
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": "localhost",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in (headers or {}).items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response["status"] = int(status.split()[0])
+            response["headers"] = dict(response_headers)
+
+        result = self.tree(environ, start_response)
+        try:
+            body = b"".join(result)
+        finally:
+            # Like a WSGI server, which is when CherryPy runs its on_end_request hooks
+            result.close()
+        return response["status"], response["headers"], body
+
+
+@pytest.fixture
+def web_client():
+    return WebClient
@@ -0,0 +1,16 @@
+"""Small networks of movie stations shared by the tests."""
+
+from datetime import datetime, timedelta, timezone
+from plextvstation.schedule import StationSchedule, ScheduledProgram
+from plextvstation.station import TVStation
+from plextvstation.types import MediaType
+
+start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+
+
+def program(media_id, offset=0):
+    return ScheduledProgram(media_id, MediaType.MOVIE, start + timedelta(hours=offset), timedelta(hours=1))
+
+
+def station(name, *programs):
+    return TVStation(name, None, StationSchedule(start, programs), None, None, [], True)
@@ -0,0 +1,76 @@
+import threading
+from argparse import Namespace
+from plextvstation.plex import PlexDB
+from plextvstation.web.admission import AdmissionControl
+from plextvstation.web.app import WebApp
+
+
+def test_endpoint_lane(mocker):
+    control = AdmissionControl(max_requests=4, limits={"shows": 1}, queue=1, queue_timeout=5)
+    assert control.admit("shows") is None
+    # Other endpoints aren't held up by a busy one
+    assert control.admit("movies") is None
+
+    lane = control.lanes["shows"]
+    wait_for = lane.condition.wait_for
+    waiting = threading.Event()
+
+    def queue(predicate, timeout):
+        waiting.set()
+        return wait_for(predicate, timeout)
+
+    mocker.patch.object(lane.condition, "wait_for", side_effect=queue)
+    queued = []
+    waiter = threading.Thread(target=lambda: queued.append(control.admit("shows")))
+    waiter.start()
+    assert waiting.wait(timeout=5)
+    assert control.admit("shows") == "queue_full"
+
+    control.release("shows")
+    waiter.join()
+    assert queued == [None]
+    control.release("shows")
+    control.release("movies")
+    assert control.in_flight == 0
+
+
+def test_capacity_and_timeout():
+    control = AdmissionControl(max_requests=2, limits={"shows": 1}, queue=1, queue_timeout=0.01)
+    assert control.admit("shows") is None
+    assert control.admit("shows") == "timeout"
+    assert control.admit("xmltv") is None
+    assert control.admit("xmltv") == "capacity"
+    control.release("xmltv")
+    control.release("shows")
+    assert control.in_flight == 0 and control.lanes["shows"].active == 0
+
+
+def test_dedicated_threads():
+    control = AdmissionControl(max_requests=1, limits={}, dedicated={"stream": 1})
+    assert control.admit("movies") is None
+    # Streams don't count against max_requests, but have a limit of their own
+    assert control.admit("stream") is None
+    assert control.admit("stream") == "queue_full"
+    control.release("stream")
+    control.release("movies")
+    assert control.in_flight == 0 and control.dedicated["stream"].active == 0
+
+
+def test_service_unavailable(web_client):
+    control = AdmissionControl(max_requests=1, limits={}, queue_timeout=2.4, dedicated={"stream": 1})
+    client = web_client(WebApp(PlexDB(Namespace(plex_db=None, path_translate=None), load=False), admission=control))
+    assert control.admit("movies") is None
+
+    status, headers, _ = client.get("/shows")
+    assert status == 503 and headers["Retry-After"] == "2"
+    assert client.get("/health")[0] == 200
+    assert client.get("/metrics")[0] == 200
+    # Streaming isn't enabled, which /stream gets to say despite the full house
+    assert client.get("/stream?station=One")[0] == 404
+    assert control.admit("stream") is None
+    assert client.get("/stream?station=One")[0] == 503
+
+    control.release("stream")
+    control.release("movies")
+    assert client.get("/shows")[0] == 200
+    assert control.in_flight == 0
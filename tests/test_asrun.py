@@ -0,0 +1,82 @@
+import os
+import gzip
+from datetime import datetime, timedelta, timezone
+from plextvstation.asrun import AsRunLog, AsRunEntry, index_name
+from plextvstation.events import ProgramEvent
+from plextvstation.types import MediaType
+
+
+def test_asrun_log(tmp_path):
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    asrun_log = AsRunLog(str(tmp_path), max_segment_bytes=1000)
+    asrun_log.start()
+    for i in range(50):
+        for station in ("One", "Two"):
+            asrun_log.record(
+                AsRunEntry(
+                    station,
+                    start + timedelta(hours=i),
+                    start + timedelta(hours=i + 1),
+                    MediaType.MOVIE,
+                    i,
+                    f"Movie {i}",
+                )
+            )
+    asrun_log.shutdown()
+
+    files = os.listdir(tmp_path)
+    assert index_name in files
+    assert len([f for f in files if f.endswith(".ndjson.gz")]) > 1
+    # The last segment is left open for the next start
+    assert len([f for f in files if f.endswith(".ndjson") and f != index_name]) == 1
+
+    aired = asrun_log.aired("One", start + timedelta(hours=10, minutes=30), start + timedelta(hours=13))
+    assert [(e.station, e.media_id) for e in aired] == [("One", 10), ("One", 11), ("One", 12)]
+    assert len(asrun_log.aired(None, start + timedelta(hours=49), start + timedelta(hours=60))) == 2
+
+    # A new writer finishes the segment left behind
+    asrun_log = AsRunLog(str(tmp_path))
+    assert asrun_log.acquire()
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".ndjson") and f != index_name]
+    assert len(asrun_log.aired(None, start, start + timedelta(days=7))) == 100
+
+    # Readers don't see a segment twice while it is indexed but its raw file isn't removed yet
+    segment = sorted(f for f in os.listdir(tmp_path) if f.endswith(".ndjson.gz"))[-1]
+    with gzip.open(tmp_path / segment, "rb") as f:
+        (tmp_path / segment[: -len(".gz")]).write_bytes(f.read())
+    assert len(asrun_log.aired(None, start, start + timedelta(days=7))) == 100
+
+
+def program_event(station, media_id, start, end):
+    program = {"media_type": "movie", "media_id": media_id, "title": f"Movie {media_id}"}
+    program.update(start=start.isoformat(), end=end.isoformat())
+    return ProgramEvent(media_id, "program", station, {"station": station, "program": program})
+
+
+def test_asrun_records_programs_as_they_end(tmp_path):
+    now = datetime.now(timezone.utc)
+    boundary = now + timedelta(minutes=5)
+    asrun_log = AsRunLog(str(tmp_path))
+    assert asrun_log.acquire()
+    asrun_log.start()
+    # On air at startup, and only logged from then on
+    asrun_log.seed(program_event("One", 1, now - timedelta(minutes=10), boundary))
+    asrun_log.seed(program_event("Two", 2, now - timedelta(minutes=10), now + timedelta(hours=1)))
+    asrun_log.record_event(program_event("One", 3, boundary, boundary + timedelta(minutes=30)))
+    # Nothing on air after the program ends
+    asrun_log.record_event(ProgramEvent(4, "program", "One", {"station": "One", "program": None}))
+
+    # Another process that can't get the lock drops its entries
+    other = AsRunLog(str(tmp_path))
+    other.start()
+    other.seed(program_event("One", 5, now, boundary))
+    other.record_event(ProgramEvent(6, "program", "One", {"station": "One", "program": None}))
+    other.shutdown()
+    asrun_log.shutdown()
+
+    aired = asrun_log.aired(None, now - timedelta(days=1), now + timedelta(days=1))
+    assert [(e.station, e.media_id) for e in aired[:2]] == [("One", 1), ("Two", 2)]
+    assert all(now <= e.start < now + timedelta(minutes=1) for e in aired[:2])
+    # Two was still on air at shutdown
+    assert aired[0].end == boundary and aired[1].end < now + timedelta(minutes=1)
+    assert [(e.media_id, e.start, e.end) for e in aired[2:]] == [(3, boundary, boundary + timedelta(minutes=30))]
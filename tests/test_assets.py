@@ -0,0 +1,74 @@
+import gzip
+import pytest
+from argparse import Namespace
+from plextvstation.plex import PlexDB
+from plextvstation.web.app import WebApp
+from plextvstation.web.assets import StaticAssets
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / "style.css").write_text("body { color: black; }\n" * 100)
+    (tmp_path / "icon.png").write_bytes(bytes(range(256)) * 4)
+    (tmp_path / "index.html").write_text(
+        '<link rel="stylesheet" href="style.css"><img src="icon.png"><a href="/health">health</a>'
+    )
+    return StaticAssets(str(tmp_path))
+
+
+def test_fingerprinted_references(assets):
+    css = assets.get("style.css")
+    index = assets.get("index.html")
+    assert css.fingerprinted_name in index.body.decode()
+    assert assets.url("icon.png") in index.body.decode()
+    assert b'href="/health"' in index.body
+    assert assets.get(css.fingerprinted_name) is css
+    assert assets.immutable(css.fingerprinted_name) and not assets.immutable("style.css")
+
+
+def test_precompressed(assets):
+    css = assets.get("style.css")
+    assert gzip.decompress(css.encodings["gzip"]) == css.body
+    assert css.etag("gzip") != css.etag(None)
+    assert assets.get("icon.png").encodings == {}
+
+
+def test_brotli(assets):
+    brotli = pytest.importorskip("brotli")
+    css = assets.get("style.css")
+    assert brotli.decompress(css.encodings["br"]) == css.body
+
+
+def test_serve_assets(web_client):
+    app = WebApp(PlexDB(Namespace(plex_db=None, path_translate=None), load=False))
+    client = web_client(app)
+    css = app.assets.url("picnic.min.css")
+
+    status, headers, body = client.get(f"/{css}", {"Accept-Encoding": "gzip, deflate"})
+    assert status == 200 and headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(body) == app.assets.get(css).body
+    assert headers["Vary"] == "Accept-Encoding"
+    assert headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    # Each encoding has an ETag of its own
+    assert client.get(f"/{css}", {"Accept-Encoding": "gzip", "If-None-Match": headers["Etag"]})[0] == 304
+    status, headers, body = client.get(f"/{css}", {"If-None-Match": headers["Etag"]})
+    assert status == 200 and "Content-Encoding" not in headers and body == app.assets.get(css).body
+
+    # The index has references to fingerprinted names, but isn't fingerprinted itself
+    status, headers, body = client.get("/")
+    assert status == 200 and css.encode() in body
+    assert headers["Cache-Control"] == "no-cache"
+    status, headers, _ = client.get("/picnic.min.css")
+    assert headers["Cache-Control"] == "no-cache" and headers["Etag"] == app.assets.get(css).etag(None)
+    assert client.get("/missing.css")[0] == 404
+
+
+def test_serve_brotli(web_client):
+    brotli = pytest.importorskip("brotli")
+    app = WebApp(PlexDB(Namespace(plex_db=None, path_translate=None), load=False))
+    client = web_client(app)
+    status, headers, body = client.get("/", {"Accept-Encoding": "gzip, br"})
+    assert status == 200 and headers["Content-Encoding"] == "br"
+    assert brotli.decompress(body) == app.assets.get("index.html").body
+    # Clients that rule brotli out get gzip
+    assert client.get("/", {"Accept-Encoding": "br;q=0, *"})[1]["Content-Encoding"] == "gzip"
@@ -0,0 +1,15 @@
+from argparse import Namespace
+from plextvstation import batch
+
+
+def test_generate_and_extend(mocker, tmp_path):
+    mocker.patch.object(batch, "PlexDB")
+    commands = mocker.Mock()
+    mocker.patch.object(batch, "regenerate_schedules", commands.generate)
+    mocker.patch.object(batch, "extend_schedules", commands.extend)
+    config = {"conf_dir": str(tmp_path), "tmp_dir": str(tmp_path), "network": "Test"}
+    args = Namespace(commands=["extend", "generate"], days=1, seed=0, schedule_workers=1, strict=False)
+    assert batch.run(args, config) == 0
+
+    # Neither is dropped, and extend only tops up what generate left short
+    assert [name for name, _, _ in commands.mock_calls] == ["generate", "extend"]
@@ -0,0 +1,100 @@
+import socket
+from datetime import datetime, timedelta, timezone
+from plextvstation.events import ProgramEvents, Broadcaster
+from plextvstation.schedule import StationSchedule, ScheduledProgram
+from plextvstation.station import Network, TVStation
+from plextvstation.types import MediaType
+
+
+class EmptyLibrary:
+    def get_media(self, media_type, media_id):
+        return None
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_program_events():
+    now = datetime(2024, 1, 1, 20, tzinfo=timezone.utc)
+    programs = [
+        ScheduledProgram(1, MediaType.MOVIE, now - timedelta(minutes=5), timedelta(minutes=5, seconds=30)),
+        ScheduledProgram(2, MediaType.MOVIE, now + timedelta(seconds=30), timedelta(minutes=30)),
+    ]
+    station = TVStation("One", None, StationSchedule(now, programs), None, None, [], True)
+    other = TVStation("Two", None, StationSchedule(now, []), None, None, [], True)
+    broadcaster = Broadcaster(max_subscribers=1)
+    network = Network("Test", [station, other])
+    clock = FakeClock(now)
+    events = ProgramEvents(network, EmptyLibrary(), broadcaster, clock=clock)
+    subscription = broadcaster.subscribe("One")
+    assert broadcaster.subscribe() is None
+
+    events.start()
+    try:
+        clock.now = now + timedelta(seconds=30)
+        events.wake()
+        event = subscription.queue.get(timeout=2)
+        assert event.kind == "program"
+        assert event.data["program"]["media_id"] == 2
+
+        network.update_schedules(
+            {
+                "One": station.schedule.extended(
+                    [ScheduledProgram(3, MediaType.MOVIE, now + timedelta(hours=1), timedelta(1))]
+                )
+            }
+        )
+        event = subscription.queue.get(timeout=2)
+        assert event.kind == "schedule" and event.station == "One"
+    finally:
+        events.shutdown()
+    assert subscription.queue.get(timeout=1) is None
+
+
+def read_until(sock, marker):
+    data = b""
+    while marker not in data:
+        chunk = sock.recv(4096)
+        assert chunk, data
+        data += chunk
+    return data
+
+
+def test_attached_clients():
+    now = datetime(2024, 1, 1, 20, tzinfo=timezone.utc)
+    programs = [ScheduledProgram(1, MediaType.MOVIE, now + timedelta(seconds=30), timedelta(minutes=30))]
+    station = TVStation("One", None, StationSchedule(now, programs), None, None, [], True)
+    broadcaster = Broadcaster()
+    clock = FakeClock(now)
+    events = ProgramEvents(Network("Test", [station]), EmptyLibrary(), broadcaster, keepalive=60, clock=clock)
+    chunked, chunked_peer = socket.socketpair()
+    plain, plain_peer = socket.socketpair()
+    gone, gone_peer = socket.socketpair()
+    for server, is_chunked in ((chunked, True), (plain, False), (gone, False)):
+        events.attach(broadcaster.subscribe(), server, is_chunked)
+    gone_peer.close()
+
+    events.start()
+    try:
+        clock.now = now + timedelta(seconds=30)
+        events.wake()
+        data = read_until(plain_peer, b"\n\n")
+        assert data.startswith(b"id: 1\nevent: program\n") and b'"media_id": 1' in data
+        size, _, chunk = read_until(chunked_peer, b"\n\n\r\n").partition(b"\r\n")
+        assert chunk.startswith(b"id: 1\n") and int(size, 16) == len(chunk) - 2
+
+        # The client that went away is dropped, the others get a keepalive once they've been idle
+        clock.now = now + timedelta(seconds=91)
+        events.wake()
+        assert read_until(plain_peer, b"\n\n") == b": keepalive\n\n"
+        assert len(broadcaster.subscribers) == 2
+    finally:
+        events.shutdown()
+        events.join(timeout=5)
+    assert plain_peer.recv(4096) == b""
+    assert not broadcaster.subscribers
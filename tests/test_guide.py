@@ -0,0 +1,114 @@
+import gzip
+from argparse import Namespace
+from datetime import datetime, timedelta, timezone
+from plextvstation.guide import GuideBuilder
+from plextvstation.media import Movie, MediaFile
+from plextvstation.plex import PlexDB
+from plextvstation.schedule import StationSchedule
+from plextvstation.station import Network, TVStation
+from plextvstation.web.app import WebApp
+
+
+def movie(id: int, title: str) -> Movie:
+    return Movie(
+        id=id,
+        title=title,
+        summary="Crime & punishment",
+        tagline=None,
+        genres=["Drama"],
+        released_at=None,
+        media=MediaFile(id=id, file=f"/movies/{id}.mkv", duration=timedelta(hours=2)),
+    )
+
+
+def library() -> PlexDB:
+    plexdb = PlexDB(Namespace(plex_db=None, path_translate=None), load=False)
+    plexdb.movies = [movie(1, "Heat"), movie(2, "Late Movie")]
+    plexdb.build_index()
+    return plexdb
+
+
+def station(name: str, start: datetime) -> TVStation:
+    schedule = StationSchedule(date=start, programs=[]).with_program(movie(1, "Heat"), start)
+    return TVStation(name, None, schedule, "US", "en", ["Movies"], True)
+
+
+def test_xmltv_incremental():
+    now = datetime(2023, 11, 1, 12, tzinfo=timezone.utc)
+    network = Network("Test", [station("One", now), station("Two", now)])
+    guide = GuideBuilder(network, library())
+
+    document = guide.xmltv(now)
+    assert b'<channel id="one.plextvstation">' in document.body
+    assert b"<desc>Crime &amp; punishment</desc>" in document.body
+    assert gzip.decompress(document.gzip_body) == document.body
+
+    assert guide.xmltv(now) is document
+    one, two = guide.fragments[0], guide.fragments[1]
+
+    network.update_schedules(
+        {"Two": network.stations[1].schedule.with_program(movie(2, "Late Movie"), now + timedelta(hours=2))}
+    )
+    updated = guide.xmltv(now)
+    assert updated.etag != document.etag
+    assert b"Late Movie" in updated.body
+    assert guide.fragments[0] is one
+    assert guide.fragments[1] is not two
+
+
+def test_m3u():
+    now = datetime(2023, 11, 1, 12, tzinfo=timezone.utc)
+    guide = GuideBuilder(Network("Test", [station("Movie Time", now)]), library())
+    body = guide.m3u("http://localhost:9898").body.decode()
+    assert body.startswith('#EXTM3U x-tvg-url="http://localhost:9898/xmltv"')
+    assert 'tvg-id="movie-time.plextvstation"' in body
+    assert "http://localhost:9898/stream/Movie%20Time/index.m3u8" in body
+
+
+def test_m3u_unique_escaped():
+    now = datetime(2023, 11, 1, 12, tzinfo=timezone.utc)
+    network = Network("Test", [station("Movie Time", now), station('Movie "Time"', now)])
+    guide = GuideBuilder(network, library())
+    body = guide.m3u("http://localhost:9898").body.decode()
+    assert 'tvg-id="movie-time.plextvstation"' in body
+    assert 'tvg-id="movie-time-2.plextvstation" tvg-name="Movie &quot;Time&quot;"' in body
+    assert b'<channel id="movie-time-2.plextvstation">' in guide.xmltv(now).body
+
+
+def test_same_names_cached():
+    now = datetime(2023, 11, 1, 12, tzinfo=timezone.utc)
+    guide = GuideBuilder(Network("Test", [station("One", now), station("One", now)]), library())
+    body = guide.xmltv(now).body
+    assert b'<channel id="one.plextvstation">' in body and b'<channel id="one-2.plextvstation">' in body
+    fragments = dict(guide.fragments)
+    guide.documents.clear()
+    guide.xmltv(now)
+    assert guide.fragments[0] is fragments[0] and guide.fragments[1] is fragments[1]
+
+
+def test_regenerated_schedule_rendered():
+    now = datetime(2023, 11, 1, 12, tzinfo=timezone.utc)
+    network = Network("Test", [station("One", now)])
+    guide = GuideBuilder(network, library())
+    assert b"Heat" in guide.xmltv(now).body
+
+    # Same revision and length as before, but a different schedule
+    schedule = network.stations[0].schedule
+    regenerated = StationSchedule(now - timedelta(days=1), [], schedule.revision).with_program(
+        movie(2, "Late Movie"), now
+    )
+    network.update_schedules({"One": regenerated})
+    assert b"Late Movie" in guide.xmltv(now).body
+
+
+def test_not_modified(web_client):
+    now = datetime.now(timezone.utc)
+    client = web_client(WebApp(library(), Network("Test", [station("One", now)])))
+    status, headers, _ = client.get("/xmltv")
+    assert status == 200
+
+    assert client.get("/xmltv", {"If-None-Match": headers["Etag"]})[0] == 304
+    assert client.get("/xmltv", {"If-Modified-Since": headers["Last-Modified"]})[0] == 304
+    assert client.get("/xmltv", {"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"})[0] == 200
+    # If-None-Match takes precedence
+    assert client.get("/xmltv", {"If-None-Match": '"other"', "If-Modified-Since": headers["Last-Modified"]})[0] == 200
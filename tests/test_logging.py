@@ -0,0 +1,75 @@
+import json
+import logging
+import threading
+from plextvstation import logging as plex_logging
+from plextvstation.logging import RateLimitFilter, SampleFilter, JsonFormatter
+
+
+def record(msg="Message %s", args=("a",), level=logging.DEBUG, lineno=10):
+    return logging.LogRecord("plextvstation.test", level, "test.py", lineno, msg, args, None)
+
+
+def test_rate_limit():
+    rate_limit = RateLimitFilter(rate=1, burst=2)
+    assert [rate_limit.filter(record()) for _ in range(5)] == [True, True, False, False, False]
+    assert rate_limit.filter(record(lineno=11))
+    assert rate_limit.filter(record(level=logging.WARNING))
+
+    rate_limit.buckets[("test.py", 10)].updated -= 1
+    allowed = record()
+    assert rate_limit.filter(allowed)
+    assert allowed.getMessage() == "Message a (3 similar messages suppressed)"
+
+
+def test_sample():
+    sample = SampleFilter(every=3)
+    assert [sample.filter(record()) for _ in range(7)] == [True, False, False, True, False, False, True]
+    assert sample.filter(record(level=logging.ERROR))
+
+
+def test_queue_handler_prepare():
+    handler = plex_logging.LogQueueHandler(None)
+    kept = handler.prepare(record("%s at %s", ("Item", (1, 2.5))))
+    assert kept.msg == "%s at %s" and kept.args == ("Item", (1, 2.5))
+    merged = handler.prepare(record("%s", ([1],)))
+    assert merged.msg == "[1]" and merged.args is None
+
+
+def test_json_formatter():
+    data = json.loads(JsonFormatter().format(record()))
+    assert data["level"] == "DEBUG"
+    assert data["logger"] == "plextvstation.test"
+    assert data["message"] == "Message a"
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.getMessage(), record.threadName, threading.current_thread().name))
+
+
+def test_queue_listener():
+    root = logging.getLogger()
+    collect = Collect()
+    root.addHandler(collect)
+    try:
+        plex_logging.setup()
+        assert collect not in root.handlers
+        items = [1]
+        plex_logging.log.warning("Items %s", items)
+        # Arguments that may change are merged on the calling thread
+        items.append(2)
+        plex_logging.log.warning("Item %d of %s", 2, "items")
+        plex_logging.stop()
+        assert collect in root.handlers
+        assert plex_logging.queue_handler not in root.handlers
+    finally:
+        root.removeHandler(collect)
+
+    assert [message for message, _, _ in collect.records[-2:]] == ["Items [1]", "Item 2 of items"]
+    message, record_thread, emit_thread = collect.records[-1]
+    assert record_thread == threading.current_thread().name
+    assert emit_thread != threading.current_thread().name
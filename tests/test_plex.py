@@ -0,0 +1,162 @@
+import os
+import pickle
+import sqlite3
+from argparse import Namespace
+from plextvstation.lazy import LazySeasons
+from plextvstation.plex import snapshot_plex_db, PlexDB
+from plextvstation.scheduler import compact_library
+
+
+def test_snapshot_plex_db(tmp_path, mocker):
+    source = str(tmp_path / "com.plexapp.plugins.library.db")
+    with sqlite3.connect(source) as conn:
+        conn.execute("CREATE TABLE metadata_items (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.executemany("INSERT INTO metadata_items (title) VALUES (?)", [(f"Movie {i}",) for i in range(1000)])
+    conn.close()
+
+    snapshot = str(tmp_path / "plex-library.db")
+    replace = mocker.spy(os, "replace")
+    assert snapshot_plex_db(source, snapshot, pages=4, sleep=0) == snapshot
+    with sqlite3.connect(snapshot) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM metadata_items").fetchone()[0] == 1000
+    conn.close()
+
+    snapshot_plex_db(source, snapshot, pages=4, sleep=0)
+    assert replace.call_count == 1
+
+    with sqlite3.connect(source) as conn:
+        conn.execute("INSERT INTO metadata_items (title) VALUES ('New Movie')")
+    conn.close()
+    os.utime(source, ns=(0, 0))
+    snapshot_plex_db(source, snapshot, pages=4, sleep=0)
+    assert replace.call_count == 2
+    with sqlite3.connect(snapshot) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM metadata_items").fetchone()[0] == 1001
+    conn.close()
+
+
+def make_plex_db(path, num_shows=3, num_seasons=2, num_episodes=4):
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            """
+            CREATE TABLE metadata_items (
+                id INTEGER PRIMARY KEY, library_section_id INTEGER, metadata_type INTEGER, parent_id INTEGER,
+                title TEXT, tagline TEXT, summary TEXT, originally_available_at INTEGER, "index" INTEGER
+            );
+            CREATE INDEX index_metadata_items_on_parent_id ON metadata_items (parent_id);
+            CREATE TABLE media_items (id INTEGER PRIMARY KEY, metadata_item_id INTEGER, duration INTEGER);
+            CREATE TABLE media_parts (id INTEGER PRIMARY KEY, media_item_id INTEGER, file TEXT);
+            CREATE TABLE taggings (metadata_item_id INTEGER, tag_id INTEGER);
+            CREATE TABLE tags (id INTEGER PRIMARY KEY, tag TEXT, tag_type INTEGER);
+            """
+        )
+        next_id = 1
+        for show in range(num_shows):
+            show_id = next_id
+            conn.execute(
+                "INSERT INTO metadata_items VALUES (?, 2, 2, NULL, ?, NULL, NULL, NULL, NULL)",
+                (show_id, f"Show {show}"),
+            )
+            next_id += 1
+            for season in range(1, num_seasons + 1):
+                season_id = next_id
+                conn.execute(
+                    "INSERT INTO metadata_items VALUES (?, 2, 3, ?, NULL, NULL, NULL, NULL, ?)",
+                    (season_id, show_id, season),
+                )
+                next_id += 1
+                for episode in range(1, num_episodes + 1):
+                    conn.execute(
+                        "INSERT INTO metadata_items VALUES (?, 2, 4, ?, ?, NULL, ?, ?, ?)",
+                        (next_id, season_id, f"Episode {episode}", "A summary", 86400 * next_id, episode),
+                    )
+                    conn.execute("INSERT INTO media_items VALUES (?, ?, 1800000)", (next_id, next_id))
+                    conn.execute("INSERT INTO media_parts VALUES (?, ?, ?)", (next_id, next_id, f"/tv/{next_id}.mkv"))
+                    next_id += 1
+    conn.close()
+
+
+def test_lazy_seasons(tmp_path):
+    db = str(tmp_path / "com.plexapp.plugins.library.db")
+    make_plex_db(db)
+    eager = PlexDB(Namespace(plex_db=db, path_translate=None))
+    lazy = PlexDB(Namespace(plex_db=db, path_translate=None, plex_db_lazy=True, plex_db_show_cache=1))
+
+    assert len(lazy.episodes_by_id) == 0
+    assert lazy.generation == eager.generation
+    assert compact_library(lazy) == compact_library(eager)
+    assert [(s.first_aired, s.last_aired) for s in lazy.tv_shows] == [
+        (s.first_aired, s.last_aired) for s in eager.tv_shows
+    ]
+
+    first, second = lazy.tv_shows[:2]
+    assert isinstance(first.seasons, LazySeasons)
+    assert len(first.seasons) == 3
+    assert first.seasons[1].episodes[2].tv_show is first
+    assert len(lazy.episodes_by_id) == 8
+
+    # Loading a second show evicts the first with a cache size of 1
+    assert [s.number for s in second.seasons] == [0, 1, 2]
+    assert len(lazy.show_cache) == 1
+    assert not first.seasons.loaded
+
+    # Pickled seasons refer to the show cache and stay unloaded
+    unpickled = pickle.loads(pickle.dumps(first.seasons))
+    assert isinstance(unpickled, LazySeasons) and not unpickled.loaded and not first.seasons.loaded
+    assert unpickled.show_id == first.id and unpickled.cache is lazy.show_cache
+
+    episode_id = eager.tv_shows[0].seasons[2].episodes[4].id
+    episode = lazy.get_episode(episode_id)
+    assert episode is not None and episode.tv_show is first and episode.number == 4
+    assert lazy.get_episode(-1) is None
+
+
+class WritingConnection:
+    """A connection whose backups see another connection write to the source after every step."""
+
+    def __init__(self, conn, source):
+        self.conn = conn
+        self.source = source
+        self.steps = 0
+
+    def backup(self, target, pages=-1, progress=None, **kwargs):
+        def write_then_progress(status, remaining, total):
+            self.steps += 1
+            with sqlite3.connect(self.source) as writer:
+                writer.execute("INSERT INTO metadata_items (title) VALUES ('Written during backup')")
+            writer.close()
+            if progress is not None:
+                progress(status, remaining, total)
+
+        return self.conn.backup(target, pages=pages, progress=write_then_progress, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+def test_snapshot_plex_db_under_writes(tmp_path, mocker):
+    source = str(tmp_path / "com.plexapp.plugins.library.db")
+    with sqlite3.connect(source) as conn:
+        conn.execute("CREATE TABLE metadata_items (id INTEGER PRIMARY KEY, title TEXT)")
+        conn.executemany("INSERT INTO metadata_items (title) VALUES (?)", [(f"Movie {i}",) for i in range(1000)])
+    conn.close()
+
+    connect = sqlite3.connect
+    connections = []
+
+    def connect_writing(database, **kwargs):
+        conn = connect(database, **kwargs)
+        if database.startswith("file:"):
+            conn = WritingConnection(conn, source)
+            connections.append(conn)
+        return conn
+
+    mocker.patch("plextvstation.plex.sqlite3.connect", side_effect=connect_writing)
+    snapshot = str(tmp_path / "plex-library.db")
+    snapshot_plex_db(source, snapshot, pages=1, sleep=0, max_restarts=3)
+
+    # Gave up on the step by step backup, which Plex kept restarting
+    assert connections[0].steps < 10
+    with connect(snapshot) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM metadata_items").fetchone()[0] >= 1000
+    conn.close()
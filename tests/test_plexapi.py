@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+import requests
+from argparse import Namespace
+from datetime import timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from plextvstation.plex import PlexDB
+
+
+def make_library(num_movies=10, num_shows=3, num_seasons=2, num_episodes=4):
+    """Plex API metadata of a library with a movie and a TV show section."""
+    movies = [
+        {
+            "ratingKey": str(1000 + i),
+            "title": f"Movie {i}",
+            "summary": f"Summary {i}",
+            "originallyAvailableAt": "1999-03-31",
+            "Genre": [{"tag": "Action"}, {"tag": "Drama"}],
+            "Media": [{"id": 5000 + i, "duration": 90 * 60_000, "Part": [{"file": f"/movies/{i}.mkv"}]}],
+        }
+        for i in range(num_movies)
+    ]
+    shows, episodes = [], []
+    for show in range(num_shows):
+        show_id = 2000 + show * 100
+        shows.append({"ratingKey": str(show_id), "title": f"Show {show}", "Genre": [{"tag": "Comedy"}]})
+        for season in range(1, num_seasons + 1):
+            for episode in range(1, num_episodes + 1):
+                episodes.append(
+                    {
+                        "ratingKey": str(show_id * 1000 + season * 100 + episode),
+                        "parentRatingKey": str(show_id + season),
+                        "grandparentRatingKey": str(show_id),
+                        "title": f"Episode {season}x{episode}",
+                        "index": episode,
+                        "parentIndex": season,
+                        "originallyAvailableAt": f"2001-01-{episode:02d}",
+                        "Media": [{"duration": 22 * 60_000, "Part": [{"file": f"/tv/{show}/{season}/{episode}.mkv"}]}],
+                    }
+                )
+    return {"1": ("movie", {1: movies}), "2": ("show", {2: shows, 4: episodes})}
+
+
+class StubPlexServer(ThreadingHTTPServer):
+    """Serves a library like Plex Media Server's JSON API does."""
+
+    daemon_threads = True
+
+    def __init__(self, library, token="secret", latency=0.0):
+        super().__init__(("127.0.0.1", 0), StubPlexHandler)
+        self.library = library
+        self.token = token
+        self.latency = latency
+        self.requests = 0
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class StubPlexHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+        time.sleep(server.latency)
+        if self.headers.get("X-Plex-Token") != server.token:
+            return self.reply(401, {})
+        url = urlparse(self.path)
+        if url.path == "/library/sections":
+            sections = [{"key": key, "type": kind} for key, (kind, _) in server.library.items()]
+            return self.reply(200, {"MediaContainer": {"size": len(sections), "Directory": sections}})
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 4 or parts[3] != "all" or parts[2] not in server.library:
+            return self.reply(404, {})
+        items = server.library[parts[2]][1].get(int(parse_qs(url.query)["type"][0]), [])
+        start = int(self.headers.get("X-Plex-Container-Start", 0))
+        size = int(self.headers.get("X-Plex-Container-Size", len(items)))
+        page = items[start : start + size]
+        self.reply(200, {"MediaContainer": {"size": len(page), "totalSize": len(items), "Metadata": page}})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def plex_args(url, **kwargs):
+    return Namespace(**{"plex_db": None, "path_translate": None, "plex_url": url, "plex_token": "secret", **kwargs})
+
+
+def test_load_from_api():
+    with StubPlexServer(make_library(num_movies=25)) as server:
+        plexdb = PlexDB(plex_args(server.url, plex_api_workers=3, plex_api_page_size=7))
+
+    assert len(plexdb.movies) == 25
+    # One request for the sections, then 4 pages of movies, 1 of shows and 4 of episodes
+    assert server.requests == 10
+    assert len(server.connections) <= 3
+
+    movie = plexdb.get_movie(1000)
+    assert movie.title == "Movie 0"
+    assert movie.genres == ["Action", "Drama"]
+    assert movie.media.file == "/movies/0.mkv"
+    assert movie.media.duration == timedelta(minutes=90)
+    assert movie.released_at.year == 1999
+
+    show = plexdb.tv_shows_by_id[2100]
+    assert [len(season.episodes) for season in show.seasons] == [0, 5, 5]
+    episode = show.seasons[2].episodes[3]
+    assert episode.title == "Episode 2x3"
+    assert episode.tv_show is show and episode.season is show.seasons[2]
+    assert plexdb.get_episode(episode.id) is episode
+    assert show.first_aired.day == 1 and show.last_aired.day == 4
+    assert len(plexdb.episodes_by_id) == 24
+
+
+def test_skips_items_without_media(mocker):
+    library = make_library(num_movies=3, num_shows=1, num_seasons=1, num_episodes=2)
+    del library["1"][1][1][0]["Media"]
+    library["2"][1][4][1]["Media"] = [{"duration": 60_000, "Part": []}]
+    close = mocker.spy(requests.Session, "close")
+    with StubPlexServer(library) as server:
+        plexdb = PlexDB(plex_args(server.url, path_translate=("/movies", "/mnt/movies")))
+
+    assert [movie.id for movie in plexdb.movies] == [1001, 1002]
+    assert plexdb.get_movie(1001).media.file == "/mnt/movies/1.mkv"
+    assert len(plexdb.episodes_by_id) == 1
+    # The session's connections don't outlive the load
+    close.assert_called_once_with(plexdb.api.session)
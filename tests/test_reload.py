@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import signal
+import socket
+import subprocess
+import urllib.request
+import psutil
+import pytest
+from plextvstation.reload import supported
+from test_plex import make_plex_db
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def health(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5) as response:
+            return response.status
+    except OSError:
+        return None
+
+
+@pytest.mark.skipif(not supported(), reason="Graceful reloads need fork()")
+def test_sighup_hands_over_socket(tmp_path):
+    db = str(tmp_path / "com.plexapp.plugins.library.db")
+    make_plex_db(db)
+    port = free_port()
+    command = [sys.executable, "-m", "plextvstation", "--plex-db", db, "-d", str(tmp_path / "work")]
+    command += ["--web-host", "127.0.0.1", "--web-port", str(port)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    replacements = []
+    try:
+        deadline = time.monotonic() + 30
+        while health(port) != 200:
+            assert process.poll() is None and time.monotonic() < deadline
+            time.sleep(0.1)
+
+        # A second instance doesn't silently share the port
+        assert subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30).returncode == 1
+
+        # The replacement serves on the same socket, and no request fails while it takes over
+        process.send_signal(signal.SIGHUP)
+        deadline = time.monotonic() + 30
+        while process.poll() is None:
+            assert health(port) == 200 and time.monotonic() < deadline
+        assert process.returncode == 0
+        replacements = [
+            p
+            for p in psutil.process_iter(["cmdline"])
+            if p.info["cmdline"] and p.info["cmdline"][-1] == str(port) and p.pid != os.getpid()
+        ]
+        assert len(replacements) == 1 and replacements[0].pid != process.pid
+        assert health(port) == 200
+    finally:
+        if process.poll() is None:
+            process.kill()
+        for replacement in replacements:
+            replacement.terminate()
+        psutil.wait_procs(replacements, timeout=10)
@@ -0,0 +1,38 @@
+from plextvstation.replica import Replica
+from plextvstation.station import Network, load_network, save_network
+from helpers import program, station
+
+
+def test_leader_and_follower(tmp_path):
+    config = {"conf_dir": str(tmp_path), "network": "Test"}
+    save_network(config, Network("Test", [station("One", program(1))]))
+
+    def extend(network, media_id):
+        schedule = network.get_station("One").schedule
+        network.update_schedules({"One": schedule.extended([program(media_id, len(schedule.programs))])})
+
+    leader_network, follower_network = load_network(config), load_network(config)
+    leader = Replica(config, leader_network, extend=lambda: extend(leader_network, 2), extend_interval=3600)
+    follower = Replica(config, follower_network, extend=lambda: extend(follower_network, 3))
+    try:
+        leader.poll()
+        follower.poll()
+        assert leader.leader and not follower.leader
+        assert [p.media_id for p in follower_network.get_station("One").schedule.programs] == [1, 2]
+        assert follower_network.saved_version == follower_network.snapshot().number
+
+        # Nothing changed on disk, so nothing is reloaded
+        version = follower_network.snapshot()
+        leader.poll()
+        assert not follower.check()
+        assert follower_network.snapshot() is version
+
+        # The follower takes over when the leader goes away, and continues from its schedules
+        leader.release()
+        follower.poll()
+        assert follower.leader
+        assert [p.media_id for p in load_network(config).get_station("One").schedule.programs] == [1, 2, 3]
+        assert load_network(config).get_station("One").schedule.programs[-1].start_time == program(3, 2).start_time
+    finally:
+        leader.release()
+        follower.release()
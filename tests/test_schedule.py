@@ -0,0 +1,67 @@
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from plextvstation.media import Movie, MediaFile
+from plextvstation.schedule import StationSchedule, ScheduledProgram
+from plextvstation.station import load_network
+from plextvstation.types import MediaType
+
+
+def movie(id: int, minutes: int) -> Movie:
+    return Movie(
+        id=id,
+        title=f"Movie {id}",
+        summary=None,
+        tagline=None,
+        genres=[],
+        released_at=None,
+        media=MediaFile(id=id, file=f"/movies/{id}.mkv", duration=timedelta(minutes=minutes)),
+    )
+
+
+def test_program_at():
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    schedule = (
+        StationSchedule(date=start, programs=[])
+        .with_program(movie(1, 90), start)
+        .with_program(movie(2, 60), start + timedelta(minutes=90))
+        .with_program(movie(3, 30), start + timedelta(minutes=180))
+    )
+    assert schedule.revision == 3
+
+    assert schedule.program_at(start - timedelta(seconds=1)) is None
+    assert schedule.program_at(start).media_id == 1
+    assert schedule.program_at(start + timedelta(minutes=89)).media_id == 1
+    assert schedule.program_at(start + timedelta(minutes=90)).media_id == 2
+    assert schedule.program_at(start + timedelta(minutes=160)) is None
+    assert schedule.program_at(start + timedelta(minutes=200)).media_id == 3
+    assert schedule.program_at(start + timedelta(minutes=210)) is None
+
+
+def test_migrate_embedded_content(tmp_path):
+    # Saved by the original release, whose programs embedded their movie or episode
+    shutil.copy(os.path.join(os.path.dirname(__file__), "data", "network-v0.db"), tmp_path / "network.db")
+    network = load_network({"conf_dir": str(tmp_path), "network": "Test"})
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    programs = network.get_station("One").schedule.programs
+    assert programs == (
+        ScheduledProgram(1, MediaType.MOVIE, start, timedelta(minutes=170)),
+        ScheduledProgram(3, MediaType.EPISODE, start + timedelta(minutes=170), timedelta(minutes=60)),
+    )
+    assert programs[1].end_time == start + timedelta(minutes=230)
+    assert "content" not in vars(programs[0])
+
+
+def test_next_boundary():
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    schedule = (
+        StationSchedule(date=start, programs=[])
+        .with_program(movie(1, 90), start)
+        .with_program(movie(2, 30), start + timedelta(minutes=120))
+    )
+
+    assert schedule.next_boundary(start - timedelta(minutes=1)) == start
+    assert schedule.next_boundary(start) == start + timedelta(minutes=90)
+    assert schedule.next_boundary(start + timedelta(minutes=90)) == start + timedelta(minutes=120)
+    assert schedule.next_boundary(start + timedelta(minutes=130)) == start + timedelta(minutes=150)
+    assert schedule.next_boundary(start + timedelta(minutes=150)) is None
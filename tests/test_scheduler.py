@@ -0,0 +1,85 @@
+from argparse import Namespace
+from datetime import datetime, timedelta, timezone
+from plextvstation.plex import PlexDB
+from plextvstation.scheduler import (
+    MOVIE,
+    EPISODE,
+    generate_compact_schedules,
+    station_tasks,
+    extend_schedules,
+    regenerate_schedules,
+)
+from plextvstation.schedule import StationSchedule
+from plextvstation.station import TVStation, Network
+from test_plex import make_plex_db
+
+units = [
+    (("drama",), ((MOVIE, 1, 90 * 60_000),)),
+    (("comedy",), ((MOVIE, 2, 100 * 60_000),)),
+    (("comedy", "drama"), tuple((EPISODE, 10 + i, 22 * 60_000) for i in range(5))),
+]
+
+
+def test_generate_deterministic():
+    start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    stations = [
+        TVStation(f"Station {i}", None, StationSchedule(start, []), None, None, tags, True)
+        for i, tags in enumerate([["Drama"], ["Comedy"], [], ["Western"]])
+    ]
+    tasks = station_tasks(stations, start, start + timedelta(days=1), seed=7)
+
+    serial = generate_compact_schedules(units, tasks, workers=1)
+    parallel = generate_compact_schedules(units, tasks, workers=2)
+    assert serial == parallel
+
+    drama = serial[0][1]
+    assert {media_id for _, media_id, _, _ in drama} <= {1, 10, 11, 12, 13, 14}
+    assert drama[0][2] == start.timestamp()
+    assert drama[-1][2] < (start + timedelta(days=1)).timestamp()
+    episodes = [media_id for kind, media_id, _, _ in drama if kind == EPISODE]
+    assert episodes[:5] == [10, 11, 12, 13, 14][: len(episodes[:5])]
+    assert serial[3][1] == []
+
+    assert generate_compact_schedules(units, station_tasks(stations, start, start + timedelta(days=1), 8), 1) != serial
+
+
+def test_extend_schedules(tmp_path):
+    db = str(tmp_path / "plex.db")
+    make_plex_db(db)
+    plexdb = PlexDB(Namespace(plex_db=db, path_translate=None), index_content=False)
+    now = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    station = TVStation("Station", None, StationSchedule(now, []), None, None, None, True)
+    network = Network("Network", [station])
+
+    extend_schedules(network, plexdb, now + timedelta(hours=6), now=now)
+    schedule = network.stations[0].schedule
+    assert schedule.programs[0].start_time == now
+    assert schedule.revision == 1
+    # The previous version is unchanged
+    assert station.schedule.programs == ()
+
+    extend_schedules(network, plexdb, now + timedelta(hours=12), now=now)
+    extended = network.stations[0].schedule
+    assert extended.programs[: len(schedule.programs)] == schedule.programs
+    assert extended.programs[len(schedule.programs)].start_time == schedule.programs[-1].end_time
+    assert extended.programs[-1].start_time < now + timedelta(hours=12)
+    assert extended.revision == 2
+
+
+def test_duplicate_station_names(tmp_path):
+    db = str(tmp_path / "plex.db")
+    make_plex_db(db)
+    plexdb = PlexDB(Namespace(plex_db=db, path_translate=None), index_content=False)
+    now = datetime(2023, 11, 1, tzinfo=timezone.utc)
+    network = Network(
+        "Network",
+        [TVStation("Station", None, StationSchedule(now, []), None, None, tags, True) for tags in (None, ["Western"])],
+    )
+
+    regenerate_schedules(network, plexdb, now, timedelta(hours=6), workers=1)
+    first, second = network.stations
+    assert first.schedule.programs and second.schedule.programs == ()
+
+    extend_schedules(network, plexdb, now + timedelta(hours=12), now=now, workers=1)
+    assert network.stations[0].schedule.programs[-1].end_time > now + timedelta(hours=6)
+    assert network.stations[1].schedule.programs == ()
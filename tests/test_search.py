@@ -0,0 +1,36 @@
+from plextvstation.search import SearchIndex, SearchDocument
+from plextvstation.types import MediaType
+
+documents = [
+    SearchDocument(MediaType.MOVIE, 1, "Heat", "A Los Angeles crime saga", "A group of bank robbers plan a heist."),
+    SearchDocument(MediaType.MOVIE, 2, "The Heist", None, "A thief assembles a crew."),
+    SearchDocument(MediaType.SHOW, 3, "Gardening Today", None, "Tips for your garden."),
+]
+
+
+def test_search_ranking(tmp_path):
+    index = SearchIndex(str(tmp_path / "search.db"))
+    index.update(documents)
+    assert len(index) == 3
+
+    results = index.search("heists")
+    assert [r.media_id for r in results] == [2, 1]
+    assert results[0].score > results[1].score
+    assert index.search("heist", media_type=MediaType.SHOW) == []
+    assert index.search('" OR *') == []
+
+
+def test_search_incremental_update():
+    index = SearchIndex()
+    index.update(documents)
+    index.update(
+        [
+            documents[0],
+            SearchDocument(MediaType.MOVIE, 2, "The Job", None, "A thief assembles a crew."),
+            SearchDocument(MediaType.MOVIE, 4, "Ocean's Eleven", None, "A casino heist."),
+        ]
+    )
+    assert len(index) == 3
+    assert {r.media_id for r in index.search("heist")} == {1, 4}
+    assert index.search("gardening") == []
+    assert [r.title for r in index.search("job")] == ["The Job"]
@@ -0,0 +1,48 @@
+import json
+import pytest
+from datetime import datetime, timedelta, timezone
+from plextvstation.media import TVShow, Season, Episode, MediaFile
+from plextvstation.serialize import Serializer, html_serializer
+from plextvstation.utils import dataclass2html_table
+
+
+def make_show() -> TVShow:
+    show = TVShow(1, "Show", None, None, ["Drama"], datetime(2020, 1, 1, tzinfo=timezone.utc))
+    season = Season(number=1, episodes=[None])
+    season.episodes.append(
+        Episode(2, 1, "Pilot", None, None, MediaFile(2, "/tv/2.mkv", timedelta(minutes=44)), season, show)
+    )
+    show.seasons.append(season)
+    return show
+
+
+def test_serializer_projects_cycles():
+    data = json.loads(Serializer().dumps([make_show()]))
+    assert data[0]["released_at"] == "2020-01-01T00:00:00+00:00"
+    episode = data[0]["seasons"][0]["episodes"][1]
+    assert episode["tv_show_id"] == 1
+    assert episode["season"] == 1
+    assert episode["media"]["duration"] == 2640.0
+    assert "tv_show" not in episode
+
+
+def test_serializer_max_depth():
+    data = Serializer(rules={}, max_depth=3).encode(make_show())
+    # Without rules the cycle is cut at max_depth by emitting ids
+    assert data["seasons"][0]["episodes"][1]["tv_show"] == 1
+
+
+def test_serializer_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    show = make_show()
+    serializer = Serializer()
+    assert msgpack.unpackb(serializer.dumps(show, "msgpack")) == json.loads(serializer.dumps(show))
+
+
+def test_html_table_reuses_encoders():
+    pytest.importorskip("pandas")
+    table = dataclass2html_table([make_show()])
+    assert "Show" in table and "2020-01-01" in table
+    encoder = html_serializer.encoders[TVShow]
+    dataclass2html_table([make_show()])
+    assert html_serializer.encoders[TVShow] is encoder
@@ -0,0 +1,41 @@
+import pytest
+from plextvstation.similarity import SimilarityEngine, SimilarityItem
+from plextvstation.types import MediaType
+
+pytest.importorskip("scipy")
+
+items = [
+    SimilarityItem(MediaType.MOVIE, 1, "Bank robbers plan a daring heist of the vault", ("crime", "thriller")),
+    SimilarityItem(MediaType.MOVIE, 2, "A crew of robbers pull off a casino heist", ("crime",)),
+    SimilarityItem(MediaType.MOVIE, 3, "The vault heist goes wrong for the robbers", ("crime", "drama")),
+    SimilarityItem(MediaType.SHOW, 4, "Two friends open a bakery and bake bread", ("comedy",)),
+    SimilarityItem(MediaType.SHOW, 5, "A family bakery struggles to bake enough bread", ("comedy", "family")),
+    SimilarityItem(MediaType.MOVIE, 6, "A chef opens a bakery in Paris", ("comedy", "romance")),
+]
+
+
+def test_more_like_this():
+    engine = SimilarityEngine.build(items)
+    similar = engine.similar([(MediaType.MOVIE, 1)], limit=2)
+    assert {key for key, _ in similar} == {(MediaType.MOVIE, 2), (MediaType.MOVIE, 3)}
+    assert similar[0][1] >= similar[1][1]
+    assert engine.similar([(MediaType.MOVIE, 99)]) == []
+
+
+def test_cluster():
+    engine = SimilarityEngine.build(items)
+    clusters = engine.cluster(2, seed=1)
+    assert sorted(sorted(media_id for _, media_id in cluster) for cluster in clusters) == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_cache(tmp_path, mocker):
+    engine = SimilarityEngine.load_or_build(items, "abc", str(tmp_path))
+    build = mocker.spy(SimilarityEngine, "build")
+    cached = SimilarityEngine.load_or_build(items, "abc", str(tmp_path))
+    assert build.call_count == 0
+    assert cached.keys == engine.keys
+    assert (cached.matrix != engine.matrix).nnz == 0
+
+    SimilarityEngine.load_or_build(items, "def", str(tmp_path))
+    assert build.call_count == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["similarity-def.npz"]
@@ -0,0 +1,62 @@
+import os
+import pickle
+import pytest
+from datetime import timedelta
+from plextvstation.schedule import StationSchedule
+from plextvstation.station import Network, load_network, save_network
+from helpers import program, start, station
+
+
+def test_network_versions():
+    network = Network("Test", [station("One", program(1)), station("Two", program(2))])
+    before = network.snapshot()
+
+    after = network.update_schedules({"One": before.get_station("One").schedule.extended([program(3, 1)])})
+    assert after.number == before.number + 1
+    assert network.snapshot() is after
+    assert [p.media_id for p in before.get_station("One").schedule.programs] == [1]
+    assert [p.media_id for p in after.get_station("One").schedule.programs] == [1, 3]
+    # Unchanged stations are shared between versions
+    assert after.get_station("Two") is before.get_station("Two")
+
+    # A schedule built from an old version doesn't overwrite a newer change
+    stale = before.get_station("One").schedule.extended([program(4, 1)])
+    network.update_schedules({"One": stale, "Two": StationSchedule(start, ())}, since=before)
+    assert [p.media_id for p in network.get_station("One").schedule.programs] == [1, 3]
+    assert network.get_station("Two").schedule.programs == ()
+
+
+def test_save_network(tmp_path):
+    config = {"conf_dir": str(tmp_path), "network": "Test"}
+    network = Network("Test", [station("One", program(1))])
+    save_network(config, network)
+    network_file = os.path.join(tmp_path, "network.db")
+    mtime = os.stat(network_file).st_mtime_ns
+
+    save_network(config, network)
+    assert os.stat(network_file).st_mtime_ns == mtime
+
+    loaded = load_network(config)
+    assert loaded.stations == network.stations
+    assert loaded.saved_version == loaded.snapshot().number
+
+
+def test_failed_save_is_retried(tmp_path, mocker):
+    config = {"conf_dir": str(tmp_path), "network": "Test"}
+    network = Network("Test", [station("One", program(1))])
+    mocker.patch("plextvstation.station.os.rename", side_effect=OSError("Disk full"))
+    with pytest.raises(OSError):
+        save_network(config, network)
+    assert network.saved_version != network.snapshot().number and network.last_save_sha is None
+
+    mocker.stopall()
+    save_network(config, network)
+    assert load_network(config).stations == network.stations
+
+
+def test_load_mutable_schedule():
+    schedule = StationSchedule(start, ())
+    # How schedules were pickled before they were immutable
+    object.__setattr__(schedule, "programs", [program(1)])
+    loaded = pickle.loads(pickle.dumps(schedule))
+    assert loaded.programs == (program(1),)
@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from plextvstation.media import Movie, MediaFile
+from plextvstation.schedule import StationSchedule, ScheduledProgram
+from plextvstation.station import Network, TVStation
+from plextvstation.stream import StreamManager
+from plextvstation.types import MediaType
+
+# Writes the playlist it is given as its last argument, then encodes until it is stopped
+fake_ffmpeg = """#!{python}
+import sys, time
+open(sys.argv[-1], "w").write("#EXTM3U\\n")
+time.sleep(60)
+"""
+
+
+class Library:
+    def get_media(self, media_type, media_id):
+        return Movie(media_id, "Movie", None, None, [], None, MediaFile(media_id, "/movies/1.mkv", timedelta(hours=1)))
+
+
+def stream_manager(tmp_path, script):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(script.format(python=sys.executable))
+    ffmpeg.chmod(0o755)
+    now = datetime.now(timezone.utc)
+    schedule = StationSchedule(now, [ScheduledProgram(1, MediaType.MOVIE, now - timedelta(minutes=5), timedelta(1))])
+    network = Network("Test", [TVStation("One", None, schedule, None, None, [], True)])
+    return StreamManager(network, Library(), str(tmp_path), ffmpeg=str(ffmpeg), idle_timeout=1, segment_duration=1)
+
+
+def test_stream_lifecycle(tmp_path):
+    manager = stream_manager(tmp_path, fake_ffmpeg)
+    try:
+        stream = manager.watch("One", "viewer")
+        assert stream is not None and stream.running and stream.owner
+        assert manager.wait_for_playlist(stream, timeout=10)
+        assert manager.watch("Two", "viewer") is None
+
+        # Stopping the idle stream doesn't hold up viewers of other stations
+        stream.viewers["viewer"] = time.monotonic() - 10
+        os.utime(stream.heartbeat, (0, 0))
+        manager.reap()
+        assert not stream.running and not os.path.exists(stream.stream_dir)
+        assert manager.streams == {}
+    finally:
+        manager.shutdown()
+
+
+def test_failing_ffmpeg_backs_off(tmp_path):
+    manager = stream_manager(tmp_path, "#!{python}\nimport sys\nsys.exit(1)\n")
+    try:
+        stream = manager.watch("One", "viewer")
+        assert stream is not None
+        stream.process.wait()
+        manager.reap()
+        assert stream.failures == 1 and stream.process is None
+        # Still within the backoff, so no new ffmpeg
+        assert not stream.ensure_running()
+        assert stream.process is None
+
+        stream.retry_at = 0
+        assert stream.ensure_running()
+        stream.process.wait()
+        assert not stream.ensure_running()
+        assert stream.failures == 2
+        assert stream.retry_at - time.monotonic() > stream.retry_delay
+    finally:
+        manager.shutdown()
+
+
+def test_stop_after_ffmpeg_exited(tmp_path):
+    manager = stream_manager(tmp_path, "#!{python}\nimport sys\nopen(sys.argv[-1], 'w').write('#EXTM3U\\n')\n")
+    try:
+        stream = manager.watch("One", "viewer")
+        stream.process.wait()
+        stream.viewers["viewer"] = time.monotonic() - 10
+        os.utime(stream.heartbeat, (0, 0))
+        manager.reap()
+        assert stream.process is None and not stream.owner
+        assert not os.path.exists(stream.stream_dir)
+
+        # The lock was released, so the station can stream again
+        stream = manager.watch("One", "viewer")
+        assert stream.owner and stream.process is not None
+    finally:
+        manager.shutdown()
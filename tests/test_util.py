@@ -1,5 +1,6 @@
 import os
-from plextvstation.utils import make_dirs
+import pytest
+from plextvstation.utils import make_dirs, close_fds
 
 
 def test_make_dirs(mocker):
@@ -19,3 +20,17 @@ def test_make_dirs(mocker):
             mocker.call("/path/to/conf", exist_ok=True),
         ]
     )
+
+
+@pytest.mark.skipif(os.name != "posix", reason="FD_CLOEXEC is POSIX only")
+def test_close_fds():
+    read_fd, write_fd = os.pipe()
+    os.set_inheritable(read_fd, True)
+    os.set_inheritable(write_fd, True)
+    try:
+        close_fds(keep=[write_fd])
+        assert not os.get_inheritable(read_fd)
+        assert os.get_inheritable(write_fd)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+from plextvstation.schedule import StationSchedule, ScheduledProgram
+from plextvstation.station import Network, TVStation
+from plextvstation.types import MediaType
+from plextvstation.validate import validate_network, ConflictKind
+
+start = datetime(2023, 11, 1, tzinfo=timezone.utc)
+
+
+def station(name: str, *programs: tuple[int, int, int]) -> TVStation:
+    schedule = StationSchedule(
+        start,
+        [
+            ScheduledProgram(media_id, MediaType.MOVIE, start + timedelta(minutes=offset), timedelta(minutes=minutes))
+            for media_id, offset, minutes in programs
+        ],
+    )
+    return TVStation(name, None, schedule, None, None, [], True)
+
+
+def test_validate_network():
+    network = Network(
+        "Test",
+        [
+            station("One", (1, 0, 60), (2, 50, 30), (3, 90, 30), (4, 120, 0)),
+            station("Two", (5, 0, 60), (1, 60, 60), (2, 70, 10)),
+        ],
+    )
+    conflicts = {(c.kind, c.station, c.media_id, c.other_station) for c in validate_network(network)}
+    assert conflicts == {
+        (ConflictKind.OVERLAP, "One", 2, None),
+        (ConflictKind.GAP, "One", None, None),
+        (ConflictKind.ZERO_DURATION, "One", 4, None),
+        (ConflictKind.OVERLAP, "Two", 2, None),
+        # Movie 1 airs back to back on One and Two, which is fine. Movie 2 overlaps.
+        (ConflictKind.DUPLICATE, "Two", 2, "One"),
+    }